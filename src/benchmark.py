@@ -0,0 +1,188 @@
+"""
+Benchmarks of the stages of solving matchups.
+
+Every benchmark is timed repeat times and the fastest run is reported, then run once more under tracemalloc to measure
+its peak memory (tracemalloc slows Python down, so the two are never measured together). Peak memory is the peak of
+Python allocations in this process, so for run_experiment with several cores it does not include the worker processes.
+
+Results are written as JSON. Passing the JSON of an earlier run as --baseline compares the two and flags every benchmark
+whose time or peak memory grew by more than --threshold, in which case the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import constants
+import solve_metrics
+import transition_skeleton
+from coup_matchup_environment import CoupMatchupEnvironment
+from run_experiment import run_experiment
+from solution_store import get_rules_fingerprint
+
+MATCHUPS = {
+    "DAvAMAM": ((constants.DUKE, constants.ASSASSIN), (constants.AMBASSADOR, constants.AMBASSADOR)),
+    "DDvCC": ((constants.DUKE, constants.DUKE), (constants.CAPTAIN, constants.CAPTAIN)),
+}
+
+
+def _new_environment(matchup, compact):
+    # the transition skeleton is cached per process, drop it so every run pays for building it like a fresh process
+    transition_skeleton._skeletons.clear()
+    return CoupMatchupEnvironment(*MATCHUPS[matchup], compact=compact)
+
+
+def get_benchmarks(matchups=tuple(MATCHUPS), num_cores=None, compact=True, experiment=True):
+    """
+    :param num_cores: Number of cores of the parallel run_experiment benchmark (by default all cores)
+    :param compact: Whether environments store their transitions in a compact TransitionTable
+    :param experiment: Whether to include the run_experiment benchmarks
+    :return: A list of (name, setup, run) benchmarks. setup() prepares the input of a run and is not timed, run(input)
+    is the timed part
+    """
+    benchmarks = list()
+    for matchup in matchups:
+        def setup_states(matchup=matchup):
+            return _new_environment(matchup, compact)
+
+        def setup_transitions(matchup=matchup):
+            environment = _new_environment(matchup, compact)
+            environment._states = environment._get_states()
+            environment.actions = environment._get_actions()
+            return environment
+
+        def setup_solver(matchup=matchup):
+            environment = _new_environment(matchup, compact)
+            environment.build_game()
+            environment._get_table()
+            return environment
+
+        benchmarks.extend([
+            (f"{matchup}/_get_states", setup_states, lambda environment: environment._get_states()),
+            (f"{matchup}/_get_transitions", setup_transitions, lambda environment: environment._get_transitions()),
+            (f"{matchup}/solver", setup_solver, _run_solver),
+            (f"{matchup}/solve", setup_states, lambda environment: environment.solve()),
+        ])
+    if experiment:
+        num_cores = os.cpu_count() if num_cores is None else num_cores
+        for cores in sorted({1, num_cores}):
+            benchmarks.append((f"run_experiment/{cores}_cores", _setup_experiment,
+                               lambda path, cores=cores: _run_experiment(path, cores)))
+    return benchmarks
+
+
+def _run_solver(environment):
+    """
+    The attractor computation of solve without building the game
+    """
+    ranks_1, ranks_2 = environment._get_attractor_ranks()
+    environment._decode_solution(ranks_1, environment._get_policy_codes(1, ranks_1), ranks_2,
+                                 environment._get_policy_codes(2, ranks_2))
+
+
+def _setup_experiment():
+    transition_skeleton._skeletons.clear()
+    return os.path.join(tempfile.mkdtemp(prefix="coup_benchmark_"), "results.txt")
+
+
+def _run_experiment(path, num_cores):
+    try:
+        run_experiment(path=path, num_cores=num_cores, overwrite=True, resume=False)
+    finally:
+        if os.path.isfile(path):
+            os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+def run_benchmarks(benchmarks, repeat=3, verbose=True):
+    """
+    :return: A dict mapping the name of every benchmark to its result: the fastest time in seconds, the times of all
+    runs and the peak memory in bytes
+    """
+    results = dict()
+    for name, setup, run in benchmarks:
+        times = list()
+        for _ in range(repeat):
+            argument = setup()
+            start = time.perf_counter()
+            run(argument)
+            times.append(time.perf_counter() - start)
+
+        argument = setup()
+        tracemalloc.start()
+        # solve phases reset the tracemalloc peak to measure their own peaks, solve_metrics keeps the overall peak
+        solve_metrics.reset_peak_memory()
+        try:
+            run(argument)
+            peak_memory = solve_metrics.get_peak_memory()
+        finally:
+            tracemalloc.stop()
+        results[name] = {"seconds": min(times), "runs": times, "peak_memory_bytes": peak_memory}
+        if verbose:
+            print(f"{name}: {min(times):.3f}s, peak memory {peak_memory / 1024 ** 2:.1f} MiB")
+    return results
+
+
+def get_metadata():
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "rules_fingerprint": get_rules_fingerprint(CoupMatchupEnvironment)}
+
+
+def compare_results(results, baseline, threshold=0.1):
+    """
+    :param results: Benchmark results (see run_benchmarks)
+    :param baseline: Benchmark results of an earlier run
+    :param threshold: Relative increase of time or peak memory that counts as a regression
+    :return: A list of (name, metric, baseline value, value) of every regression
+    """
+    regressions = list()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ("seconds", "peak_memory_bytes"):
+            if result[metric] > baseline[name][metric] * (1 + threshold):
+                regressions.append((name, metric, baseline[name][metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of solving Coup matchups")
+    parser.add_argument("--output", default=None, help="Path of the JSON file to write results to")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative increase of time or peak memory over the baseline that counts as a regression")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs of every benchmark")
+    parser.add_argument("--matchups", nargs="+", default=list(MATCHUPS), choices=list(MATCHUPS))
+    parser.add_argument("--cores", type=int, default=None, help="Cores of the parallel run_experiment benchmark")
+    parser.add_argument("--no-compact", action="store_true", help="Store transitions in dicts instead of a table")
+    parser.add_argument("--no-experiment", action="store_true", help="Skip the run_experiment benchmarks")
+    args = parser.parse_args()
+
+    benchmarks = get_benchmarks(matchups=args.matchups, num_cores=args.cores, compact=not args.no_compact,
+                                experiment=not args.no_experiment)
+    output = {"metadata": get_metadata(), "results": run_benchmarks(benchmarks, repeat=args.repeat)}
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if baseline["metadata"]["rules_fingerprint"] != output["metadata"]["rules_fingerprint"]:
+            print("Warning: the baseline was measured with different game rules")
+        regressions = compare_results(output["results"], baseline["results"], threshold=args.threshold)
+        for name, metric, baseline_value, value in regressions:
+            print(f"Regression in {name}: {metric} {baseline_value:.4g} -> {value:.4g} "
+                  f"({value / baseline_value - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,8 @@ FOREIGN_AID = "foreign_aid"
 COUP = "coup"
 TAX = "tax"
 ASSASSINATE = "assassinate"
-# EXCHANGE = "exchange"
+# EXCHANGE is only part of the extended rules (see extended_rules)
+EXCHANGE = "exchange"
 STEAL = "steal"
 actions = (INCOME, FOREIGN_AID, COUP, TAX, ASSASSINATE, STEAL)
 
@@ -24,7 +25,11 @@ BLOCK_ASSASSINATE = "block_assassinate"
 KILL_CARD_1 = "kill_card_1"
 KILL_CARD_2 = "kill_card_2"
 counter_actions = (BLOCK_FOREIGN_AID, BLOCK_STEAL, BLOCK_ASSASSINATE, KILL_CARD_1, KILL_CARD_2, NO_ACTION)
+# challenging a claimed card is only part of the extended rules
+CHALLENGE = "challenge"
 
 # DEFINE OTHER CONSTANTS
 ACTION_DISABLED = "action_disabled"
 DEAD = "dead"
+# number of fields of a state (see CoupMatchupEnvironment._get_states), the extended rules add a pending field
+NUM_STATE_FIELDS = 7
@@ -1,20 +1,61 @@
-import copy
+import functools
+import heapq
 import itertools
+from array import array
+from collections import deque
+
 import constants
+import csr_solver
+import graph_export
+import parallel_solver
+import policy_table
+import solve_metrics
+import transition_skeleton
+from rules import DEFAULT_RULES
+from transition_table import DISABLED, TransitionTable
+
+SOLVER_BACKENDS = ("worklist", "csr", "parallel")
 
 
 class CoupMatchupEnvironment:
-    def __init__(self, player1_cards, player2_cards):
+    def __init__(self, player1_cards, player2_cards, compact=False, reachable_only=False, lazy=False, max_states=None,
+                 rules=DEFAULT_RULES, fold_hands=False):
         """
         :param player1_cards: The cards player1 starts the game with
         :param player2_cards: The cards player2 starts the game with
+        :param compact: If True transitions are stored in an integer indexed TransitionTable and self.transitions is a
+        read only view on top of it instead of a dict of dicts
+        :param reachable_only: If True only the states reachable from the start of the game are generated, transitions
+        and solving then run on that reduced graph
+        :param lazy: If True states are generated on demand from the start state and interned into the transition table
+        as they are reached (see TransitionTable.expand) instead of being enumerated up front. Implies compact and
+        reachable_only
+        :param max_states: Maximum number of states a lazy or reachable_only environment may generate, building the game
+        fails instead of exceeding it
+        :param rules: The Rules of the game (coins and costs, see rules)
+        :param fold_hands: If True player states that only differ in the order of the cards in hand are folded into one
+        state (see fold_state), which shrinks the state space of matchups where a player holds two copies of a card.
+        get_original_states and get_original_action map folded states and actions back
         """
         self.player1_cards = player1_cards
         self.player2_cards = player2_cards
+        self.rules = rules
+        self.fold_hands = fold_hands
+        if fold_hands:
+            # every state the environment generates goes through transition, so folding its result folds the game
+            self.transition = self._fold_transition
+        self.compact = compact or lazy
+        self.reachable_only = reachable_only or lazy
+        self.lazy = lazy
+        self.max_states = max_states
 
         # self.transitions[state][action] = new_state
         self.transitions = None
+        # self._table.target(state_id, action_id) = new_state_id (only used when compact is True)
+        self._table = None
         self._states = None
+        # number of states of the full state space left out because they are unreachable (see reachable_only)
+        self.pruned_state_count = 0
         self._goal_states_1 = None
         self._goal_states_2 = None
         self.actions = None
@@ -22,6 +63,21 @@ class CoupMatchupEnvironment:
         self._player_2_winning_region = None
         self._policy_1 = None
         self._policy_2 = None
+        self._draw_region = None
+        # self._ranks_1[state_id] = attractor rank of the state for player 1 (-1 outside the winning region)
+        self._ranks_1 = None
+        self._ranks_2 = None
+        # self._policy_codes[player - 1][state_id] = code of the action of player's policy from the state or -1
+        self._policy_codes = None
+        # self._slowest_loss_codes[player] = codes of player's slowest loss policy (see get_slowest_loss_policy)
+        self._slowest_loss_codes = dict()
+        # self._optimal_codes[player] = codes of player's optimal policy (see get_optimal_policy)
+        self._optimal_codes = dict()
+        self._state_ids = None
+        # the sets of player states of both players (see _is_in_state_space)
+        self._player_states = None
+        # self._local_solutions[state] = (winner, rank) of every state proven by solve_from
+        self._local_solutions = dict()
 
     def _get_states(self):
         """
@@ -34,9 +90,18 @@ class CoupMatchupEnvironment:
 
         :return: A list of all possible states
         """
-        if self._states is None:
-            player1_states = self._get_player_states(self.player1_cards)
-            player2_states = self._get_player_states(self.player2_cards)
+        if self._states is None and self.reachable_only:
+            # goal states are expanded as well, so the graph is closed under transitions and the winning regions of the
+            # reachable states are the same as in the full state space
+            self._table = TransitionTable.expand([self.get_start_game_state()], self._get_actions(),
+                                                 functools.partial(self.transition, rules=self.rules),
+                                                 functools.partial(self.get_enabled_actions, rules=self.rules),
+                                                 self._is_in_state_space, max_states=self.max_states)
+            self._states = self._table.states[:self._table.num_states]
+            self.pruned_state_count = self._get_state_space_size() - len(self._states)
+        elif self._states is None:
+            player1_states = self._get_player_states(self.player1_cards, self.rules, self.fold_hands)
+            player2_states = self._get_player_states(self.player2_cards, self.rules, self.fold_hands)
             possible_turn_values = (1, 2)
             possible_assassinate_counter_state_values = (0, 1)
             possible_foreign_aid_counter_state_values = (0, 1)
@@ -54,6 +119,29 @@ class CoupMatchupEnvironment:
             self._states = list(possible_states)
         return self._states
 
+    def _is_in_state_space(self, state):
+        """
+        :return: Whether state is part of the state space (see _get_states)
+        """
+        if self._player_states is None:
+            self._player_states = (set(self._get_player_states(self.player1_cards, self.rules, self.fold_hands)),
+                                   set(self._get_player_states(self.player2_cards, self.rules, self.fold_hands)))
+        return state[0] in self._player_states[0] and state[1] in self._player_states[1] and \
+            not state[0][:2] == state[1][:2] == (constants.DEAD, constants.DEAD)
+
+    def _get_state_space_size(self):
+        """
+        :return: The number of states in the full state space (see _get_states) without enumerating it
+        """
+        player1_states = self._get_player_states(self.player1_cards, self.rules, self.fold_hands)
+        player2_states = self._get_player_states(self.player2_cards, self.rules, self.fold_hands)
+        player1_dead_states = [state for state in player1_states if state[:2] == (constants.DEAD, constants.DEAD)]
+        player2_dead_states = [state for state in player2_states if state[:2] == (constants.DEAD, constants.DEAD)]
+        # turn and the four counter flags each take two values
+        other_field_values = 2 ** 5
+        return (len(player1_states) * len(player2_states) - len(player1_dead_states) * len(player2_dead_states)) \
+            * other_field_values
+
     def _get_actions(self):
         """
         :return: A tuple of all possible actions (including counter-actions)
@@ -69,71 +157,242 @@ class CoupMatchupEnvironment:
         """
         :return: A transition dictionary where transitions[state][action] = new_state
         """
+        if self.compact:
+            if self.reachable_only:
+                # the table is built while the states are generated
+                self._get_states()
+            elif self.fold_hands:
+                # the transition skeleton is built over the unfolded player states
+                self._table = TransitionTable.build(self._states, self.actions,
+                                                    functools.partial(self.transition, rules=self.rules),
+                                                    functools.partial(self.get_enabled_actions, rules=self.rules))
+            else:
+                # the full state space has the same structure for every matchup, only the ability mask differs
+                self._table = transition_skeleton.get_skeleton(type(self), self.rules).build_table(self)
+            return self._table.view()
         transitions = dict(
             zip(self._states, [dict(zip(self.actions, [None for _ in self.actions])) for _ in self._states]))
         for state in transitions:
             for action in transitions[state]:
-                if action in self.get_enabled_actions(state):
-                    transitions[state][action] = self.transition(state, action)
+                if action in self.get_enabled_actions(state, self.rules):
+                    transitions[state][action] = self.transition(state, action, self.rules)
                 else:
                     transitions[state][action] = constants.ACTION_DISABLED
         return transitions
 
-    def _solve_winning_region(self, player, verbose=False):
+    def _get_table(self):
         """
-        Calculates and returns the winning region of player using the two player attractor algorithm
-        :param player: An integer representing the player who's winning region should be returned
-        :return: A list of states that are winning for player
+        :return: The TransitionTable for the game, building it from self.transitions if the environment is not compact
         """
+        if self._table is None:
+            self._table = TransitionTable.from_transitions(self._states, self.actions, self.transitions)
+        return self._table
 
-        policy = dict(zip(self._states, [None for _ in self._states]))
-        attractor_sets = list()
-        # initial winning set = player final states
-        previous_attractor = self.get_goal_states(player)
-        new_attractor = set()
-        # keep track of each attractor level in attractor_sets to construct the winning policy later
-        attractor_sets.append(previous_attractor)
+    def _get_attractor_ranks(self, verbose=False, metrics=None):
+        """
+        Computes the attractors of both players' goal states with a worklist (retrograde) algorithm. The predecessor
+        index is built once and shared by both players, every state is visited at most once per player and every edge
+        is followed once backwards, so the total cost is O(edges).
 
-        i = 1
-        while True:
-            if verbose:
-                print(f"Computing attractor level {i} for player {player}")
-            new_attractor = copy.deepcopy(previous_attractor)
-            for state in self._states:
-                if state not in previous_attractor:
-                    turn = state[2]
-                    if turn == player:
-                        # if state is player's state add to attractor if ANY action leads to a winning state
-                        for action in self.transitions[state]:
-                            if self.transitions[state][action] in previous_attractor:
-                                new_attractor.add(state)
-                                policy[state] = action
-                    else:
-                        # if it is the other players turn add the state if ALL actions lead to a winning state
-                        all_actions_safe = True
-                        for action in self.transitions[state]:
-                            if self.transitions[state][action] != constants.ACTION_DISABLED \
-                                    and self.transitions[state][action] not in previous_attractor:
-                                all_actions_safe = False
-                        if all_actions_safe:
-                            new_attractor.add(state)
-            attractor_sets.append(new_attractor)
-            i += 1
-            if new_attractor == previous_attractor:
-                break
-            else:
-                previous_attractor = copy.deepcopy(new_attractor)
+        The rank of a state is the attractor level it is added at: goal states have rank 0, a state of the attracting
+        player has rank 1 + the lowest rank of its successors and a state of the other player has rank 1 + the highest
+        rank of its successors once all of its successors are in the attractor.
+        :param metrics: An optional SolveMetrics the phases, level sizes and iterations are recorded in
+        :return: Two arrays ranks_1 and ranks_2 where ranks_i[state_id] is the rank of the state in player i's
+        attractor or -1 if it is not in the attractor
+        """
+        metrics = solve_metrics.SolveMetrics(self.player1_cards, self.player2_cards) if metrics is None else metrics
+        table = self._get_table()
+        num_states = table.num_states
+        num_actions = table.num_actions
+        targets = table.targets
+
+        with metrics.phase("predecessors"):
+            # predecessors[state_id] = ids of states with an edge into state_id (once per edge)
+            predecessors = [[] for _ in range(num_states)]
+            # degree[state_id] = number of enabled actions from state_id
+            degree = array('i', [0]) * num_states
+            for state_id in range(num_states):
+                row = state_id * num_actions
+                for action_id in range(num_actions):
+                    target = targets[row + action_id]
+                    if target != DISABLED:
+                        degree[state_id] += 1
+                        if target < num_states:
+                            predecessors[target].append(state_id)
+            turns = [state[2] for state in table.states[:num_states]]
+
+        all_ranks = list()
+        for player in (1, 2):
+            with metrics.phase(f"attractor_{player}"):
+                # remaining[state_id] = number of enabled actions from state_id that do not (yet) lead into the
+                # attractor
+                remaining = array('i', degree)
+                ranks = array('i', [-1]) * num_states
+                queue = deque()
+                for state in self.get_goal_states(player):
+                    state_id = table.state_ids[state]
+                    ranks[state_id] = 0
+                    queue.append(state_id)
+                # states of the other player with no enabled actions are trivially in the first attractor level
+                for state_id in range(num_states):
+                    if ranks[state_id] == -1 and degree[state_id] == 0 and turns[state_id] != player:
+                        ranks[state_id] = 1
+                        queue.append(state_id)
+
+                level = 0
+                iterations = 0
+                while queue:
+                    state_id = queue.popleft()
+                    iterations += 1
+                    rank = ranks[state_id]
+                    if verbose and rank > level:
+                        level = rank
+                        print(f"Computing attractor level {level} for player {player}")
+                    for predecessor in predecessors[state_id]:
+                        if ranks[predecessor] != -1:
+                            continue
+                        if turns[predecessor] == player:
+                            # a state of player is winning if ANY action leads to a winning state
+                            ranks[predecessor] = rank + 1
+                            queue.append(predecessor)
+                        else:
+                            # a state of the other player is winning once ALL of its actions lead to winning states
+                            remaining[predecessor] -= 1
+                            if remaining[predecessor] == 0:
+                                ranks[predecessor] = rank + 1
+                                queue.append(predecessor)
+            metrics.record_attractor(player, ranks, iterations)
+            all_ranks.append(ranks)
+        return all_ranks[0], all_ranks[1]
+
+    def _get_policy_codes(self, player, ranks):
+        """
+        :param player: An integer representing the player whose policy should be computed
+        :param ranks: Attractor ranks of player (see _get_attractor_ranks)
+        :return: An array where policy_codes[state_id] is the action code player takes from the state or -1
+        """
+        table = self._get_table()
+        num_states = table.num_states
+        num_actions = table.num_actions
+        policy_codes = array('b', [-1]) * num_states
+        for state_id in range(num_states):
+            rank = ranks[state_id]
+            if rank > 0 and table.states[state_id][2] == player:
+                # choose the last action (in action order) that leads to a state in a lower attractor level. The rank
+                # of a state of player is 1 + the lowest rank of its successors, so every such action leads to rank - 1
+                # and the policy wins in the fewest moves
+                row = state_id * num_actions
+                for action_id in range(num_actions):
+                    target = table.targets[row + action_id]
+                    if target != DISABLED and target < num_states and 0 <= ranks[target] < rank:
+                        policy_codes[state_id] = action_id
+        return policy_codes
+
+    def _decode_solution(self, ranks_1, policy_codes_1, ranks_2, policy_codes_2):
+        """
+        Stores the winning regions and policies of both players and the draw region (states where neither player can
+        force a win) from the integer results of a solver
+        :param ranks_i: Attractor ranks of player i indexed by state id (-1 for states outside the attractor)
+        :param policy_codes_i: Action codes of player i indexed by state id (-1 for states without a winning action)
+        """
+        states = self._states
+        winning_region_1 = set()
+        winning_region_2 = set()
+        draw_region = set()
+        policy_1 = dict(zip(self._states, [None for _ in self._states]))
+        policy_2 = dict(zip(self._states, [None for _ in self._states]))
+        for state_id in range(len(states)):
+            state = states[state_id]
+            if ranks_1[state_id] != -1:
+                winning_region_1.add(state)
+            if ranks_2[state_id] != -1:
+                winning_region_2.add(state)
+            if ranks_1[state_id] == -1 and ranks_2[state_id] == -1:
+                draw_region.add(state)
+            if policy_codes_1[state_id] != -1:
+                policy_1[state] = self.actions[policy_codes_1[state_id]]
+            if policy_codes_2[state_id] != -1:
+                policy_2[state] = self.actions[policy_codes_2[state_id]]
+        self._player_1_winning_region, self._policy_1 = winning_region_1, policy_1
+        self._player_2_winning_region, self._policy_2 = winning_region_2, policy_2
+        self._draw_region = draw_region
+        self._ranks_1 = array('i', ranks_1)
+        self._ranks_2 = array('i', ranks_2)
+        self._policy_codes = (array('b', policy_codes_1), array('b', policy_codes_2))
+        self._slowest_loss_codes = dict()
+        self._optimal_codes = dict()
+
+    @staticmethod
+    def fold_state(state):
+        """
+        Only which cards are alive matters to the game, not which slot of the hand they are in. Once one card of a
+        player is dead the alive card is moved to card 1, so (dead, duke, n) and (duke, dead, n) are the same folded
+        player state (duke, dead, n) and KILL_CARD_1 always kills the last alive card
+        :return: The folded state of state
+        """
+        return (CoupMatchupEnvironment._fold_player_state(state[0]),
+                CoupMatchupEnvironment._fold_player_state(state[1])) + tuple(state[2:])
+
+    @staticmethod
+    def _fold_player_state(player_state):
+        if player_state[0] == constants.DEAD and player_state[1] != constants.DEAD:
+            return player_state[1], constants.DEAD, player_state[2]
+        return player_state
+
+    def _fold_transition(self, state, action, rules=DEFAULT_RULES):
+        """
+        transition of an environment with fold_hands, see fold_state
+        """
+        return self.fold_state(type(self).transition(state, action, rules))
+
+    def get_original_states(self, state):
+        """
+        :param state: A state of the environment (folded if fold_hands is set)
+        :return: A list of the states of the unfolded game that fold into state
+        """
+        if not self.fold_hands:
+            return [state]
+        return [(player1_state, player2_state) + tuple(state[2:])
+                for player1_state in self._get_original_player_states(state[0], self.player1_cards)
+                for player2_state in self._get_original_player_states(state[1], self.player2_cards)]
+
+    @staticmethod
+    def _get_original_player_states(player_state, player_cards):
+        card, other_card, coins = player_state
+        if card == constants.DEAD or other_card != constants.DEAD:
+            return [player_state]
+        original_player_states = list()
+        if card == player_cards[0]:
+            original_player_states.append((card, constants.DEAD, coins))
+        if card == player_cards[1]:
+            original_player_states.append((constants.DEAD, card, coins))
+        return original_player_states
 
-        # TODO calculate policy here based on attractor_sets
-        # policy[state] = actions that result in state at lower attractor_set level
-        return previous_attractor, policy
+    def get_original_action(self, original_state, action):
+        """
+        :param original_state: A state of the unfolded game (see get_original_states)
+        :param action: The action taken from the folded state of original_state
+        :return: The action that has the same effect in original_state. A folded state keeps the last alive card in
+        card 1, so the kill actions swap when card 1 of the player to move is dead in original_state
+        """
+        if not self.fold_hands:
+            return action
+        player_state = original_state[0] if original_state[2] == 1 else original_state[1]
+        if player_state[0] == constants.DEAD and player_state[1] != constants.DEAD:
+            if action == constants.KILL_CARD_1:
+                return constants.KILL_CARD_2
+            if action == constants.KILL_CARD_2:
+                return constants.KILL_CARD_1
+        return action
 
     def get_start_game_state(self):
         """
-        :return: The state that represents the start of a new game (both players have their cards alive and 2 coins)
+        :return: The state that represents the start of a new game (both players have their cards alive and the
+        starting coins of the rules)
         """
-        player1_state = (self.player1_cards[0], self.player1_cards[1], 2)
-        player2_state = (self.player2_cards[0], self.player2_cards[1], 2)
+        player1_state = (self.player1_cards[0], self.player1_cards[1], self.rules.starting_coins)
+        player2_state = (self.player2_cards[0], self.player2_cards[1], self.rules.starting_coins)
         start_game_state = (player1_state, player2_state, 1, 0, 0, 0, 0)
         return start_game_state
 
@@ -160,13 +419,178 @@ class CoupMatchupEnvironment:
                 raise IndexError
             return goal_states
 
-    def solve(self, verbose=False):
-        self._states = self._get_states()
-        self.actions = self._get_actions()
-        self.transitions = self._get_transitions()
+    def build_game(self, verbose=False, metrics=None):
+        """
+        Computes the states, actions and transitions of the game without solving it
+        :param verbose: Whether to report the number of pruned states when only reachable states are generated
+        :param metrics: An optional SolveMetrics the phases and the size of the game graph are recorded in
+        """
+        metrics = solve_metrics.SolveMetrics(self.player1_cards, self.player2_cards) if metrics is None else metrics
+        with metrics.phase("states"):
+            self._states = self._get_states()
+            self.actions = self._get_actions()
+        with metrics.phase("transitions"):
+            self.transitions = self._get_transitions()
+        with metrics.phase("table"):
+            metrics.record_graph(self._get_table())
+        if verbose and self.reachable_only:
+            print(f"Solving {len(self._states)} reachable states, pruned {self.pruned_state_count} unreachable states")
+
+    def _ensure_game_built(self):
+        """
+        Builds the game if its transitions are missing, which is the case for solutions loaded from a SolutionStore
+        """
+        if self.transitions is None:
+            self.build_game()
+
+    def solve(self, verbose=False, backend="worklist", store=None, hooks=None, num_workers=None, trace_memory=False):
+        """
+        :param verbose: Whether to print progress of the attractor computation
+        :param backend: The solver used to compute the attractors. "worklist" runs the retrograde worklist solver in
+        pure Python, "csr" stores the game graph as a CSR adjacency and computes each attractor level with vectorized
+        NumPy operations (see csr_solver), "parallel" splits the game graph across num_workers processes that share it
+        in shared memory (see parallel_solver)
+        :param store: An optional SolutionStore. If it holds a solution for this matchup the solution is loaded instead
+        of solving, otherwise the new solution is added to it
+        :param hooks: Callables called with an event dict at the end of every phase of the solve (see solve_metrics)
+        :param num_workers: Number of worker processes of the parallel backend (by default all cores)
+        :param trace_memory: Whether to trace memory with tracemalloc during the solve, so every phase records its peak
+        and the metrics hold the peak of this solve instead of the peak of the process (see solve_metrics.trace_memory)
+        :return: The SolveMetrics of the solve
+        """
+        if backend not in SOLVER_BACKENDS:
+            raise Exception(f"Solver backend {backend} not defined, choose one of {SOLVER_BACKENDS}")
+        metrics = solve_metrics.SolveMetrics(self.player1_cards, self.player2_cards, hooks=hooks)
+        metrics.backend = backend
+        with solve_metrics.trace_memory(trace_memory):
+            if store is not None:
+                with metrics.phase("store_load"):
+                    metrics.loaded_from_store = store.load(self)
+                if metrics.loaded_from_store:
+                    if verbose:
+                        print(f"Loaded solution of {self.player1_cards} vs {self.player2_cards} from {store.directory}")
+                    metrics.finish()
+                    return metrics
+            if backend == "csr":
+                csr_solver.solve_batch([self], verbose=verbose, metrics=[metrics])
+            elif backend == "parallel":
+                parallel_solver.solve_parallel(self, num_workers=num_workers, verbose=verbose, metrics=metrics)
+            else:
+                self.build_game(verbose=verbose, metrics=metrics)
+                ranks_1, ranks_2 = self._get_attractor_ranks(verbose=verbose, metrics=metrics)
+                with metrics.phase("policy"):
+                    policy_codes_1 = self._get_policy_codes(1, ranks_1)
+                    policy_codes_2 = self._get_policy_codes(2, ranks_2)
+                with metrics.phase("decode"):
+                    self._decode_solution(ranks_1, policy_codes_1, ranks_2, policy_codes_2)
+            if store is not None:
+                with metrics.phase("store_save"):
+                    store.save(self)
+            metrics.finish()
+        return metrics
+
+    def solve_from(self, state):
+        """
+        Solves the game from state without building the game graph. A depth first search explores only the states
+        reachable from state (through transition and get_enabled_actions), stopping at goal states, states outside
+        the state space and states proven by earlier calls. The attractors of both players are then computed over the
+        explored states, which resolves cycles exactly as solve does. Every explored state is proven this way and
+        cached, so later calls only explore states that are new.
+        :param state: The state to solve the game from
+        :return: (winner, rank) where winner is the player who can force a win from state (0 if neither can) and rank
+        is the attractor rank of state for winner (see get_attractor_rank, None if neither player wins)
+        """
+        if state not in self._local_solutions:
+            self._solve_closure(state)
+        return self._local_solutions[state]
+
+    def _solve_closure(self, state):
+        """
+        Proves every state reachable from state that is not proven yet and adds them to self._local_solutions
+        """
+        states = [state]
+        state_ids = {state: 0}
+        # leaves[state_id] = (winner, rank) of states whose value is known without exploring their successors (see
+        # _get_leaf_solution), None for the states that are explored
+        leaves = [self._get_leaf_solution(state)]
+        # successors[state_id] = ids of the states the enabled actions lead to (once per action)
+        successors = [list()]
+        stack = [0] if leaves[0] is None else list()
+        while stack:
+            state_id = stack.pop()
+            current = states[state_id]
+            for action in self.get_enabled_actions(current, self.rules):
+                new_state = self.transition(current, action, self.rules)
+                new_state_id = state_ids.get(new_state)
+                if new_state_id is None:
+                    new_state_id = len(states)
+                    state_ids[new_state] = new_state_id
+                    states.append(new_state)
+                    leaves.append(self._get_leaf_solution(new_state))
+                    successors.append(list())
+                    if leaves[new_state_id] is None:
+                        stack.append(new_state_id)
+                successors[state_id].append(new_state_id)
+
+        num_states = len(states)
+        predecessors = [[] for _ in range(num_states)]
+        for state_id in range(num_states):
+            for successor in successors[state_id]:
+                predecessors[successor].append(state_id)
+        turns = [explored_state[2] for explored_state in states]
+        solutions = [(0, None)] * num_states
+        for player in (1, 2):
+            remaining = [len(state_successors) for state_successors in successors]
+            ranks = [-1] * num_states
+            # leaves proven by earlier calls can have any rank, so states are added in order of rank with a heap
+            # instead of a queue, which keeps the ranks equal to the ranks of solve
+            heap = list()
+            for state_id in range(num_states):
+                leaf = leaves[state_id]
+                if leaf is not None:
+                    if leaf[0] == player:
+                        ranks[state_id] = leaf[1]
+                        heap.append((leaf[1], state_id))
+                elif not successors[state_id] and turns[state_id] != player:
+                    ranks[state_id] = 1
+                    heap.append((1, state_id))
+            heapq.heapify(heap)
+            while heap:
+                rank, state_id = heapq.heappop(heap)
+                for predecessor in predecessors[state_id]:
+                    if ranks[predecessor] != -1:
+                        continue
+                    if turns[predecessor] == player:
+                        ranks[predecessor] = rank + 1
+                        heapq.heappush(heap, (rank + 1, predecessor))
+                    else:
+                        remaining[predecessor] -= 1
+                        if remaining[predecessor] == 0:
+                            ranks[predecessor] = rank + 1
+                            heapq.heappush(heap, (rank + 1, predecessor))
+            for state_id in range(num_states):
+                if ranks[state_id] != -1:
+                    solutions[state_id] = (player, ranks[state_id])
+        self._local_solutions.update(zip(states, solutions))
+
+    def _get_leaf_solution(self, state):
+        """
+        :return: (winner, rank) of state if it is known without exploring its successors, otherwise None
+        """
+        if state in self._local_solutions:
+            return self._local_solutions[state]
+        if not self._is_in_state_space(state):
+            return 0, None
+        for player, opponent_state in ((1, state[1]), (2, state[0])):
+            if opponent_state[0] == constants.DEAD and opponent_state[1] == constants.DEAD:
+                return player, 0
+        return None
 
-        self._player_1_winning_region, self._policy_1 = self._solve_winning_region(player=1, verbose=verbose)
-        self._player_2_winning_region, self._policy_2 = self._solve_winning_region(player=2, verbose=verbose)
+    def is_solved(self):
+        """
+        :return: Whether the winning regions and policies of the game have been computed or loaded
+        """
+        return self._player_1_winning_region is not None
 
     def get_win_region(self, player):
         """
@@ -184,6 +608,36 @@ class CoupMatchupEnvironment:
         else:
             raise Exception(f"Player {player} not defined in {self}")
 
+    def get_draw_region(self):
+        """
+        Reachability games are determined, so every state is winning for exactly one player unless neither player can
+        force the game to end, in which case it belongs to the draw region.
+        :return: The stored set of states from which neither player can force a win
+        """
+        assert self._draw_region is not None, f"Draw region not defined for {self} call {self}.solve()"
+        return self._draw_region
+
+    def get_state_id(self, state):
+        """
+        :return: The integer id of state (its position in the list of states)
+        """
+        if self._state_ids is None:
+            self._state_ids = self._table.state_ids if self._table is not None else \
+                dict(zip(self._states, range(len(self._states))))
+        return self._state_ids[state]
+
+    def get_attractor_rank(self, player, state):
+        """
+        The attractor rank of a winning state is the number of moves (of both players) the winner needs to end the game
+        when the other player delays the end as long as possible.
+        :param player: An integer representing the player whose attractor rank should be returned
+        :return: The attractor rank of state for player or None if state is not in player's winning region
+        """
+        ranks = self._ranks_1 if player == 1 else self._ranks_2
+        assert ranks is not None, f"Attractor ranks not defined for {self} call {self}.solve()"
+        rank = ranks[self.get_state_id(state)]
+        return None if rank == -1 else rank
+
     def get_policy(self, player):
         """
         :param player: An integer representing the player whose policy should be returned
@@ -192,27 +646,109 @@ class CoupMatchupEnvironment:
         policy = self._policy_1 if player == 1 else self._policy_2
         return policy
 
-    def play_game(self, save_run=False, path=None):
+    def get_fastest_win_policy(self, player):
         """
-        Allow the user to play a run of the game as the losing player to test their strategies
+        From every winning state of player the policy takes an action into the next lower attractor rank, so it wins in
+        the fewest moves (the attractor rank) when the other player delays the end as long as possible
+        :return: player's policy (see get_policy) as a mapping policy[state] = action that looks actions up in the
+        stored policy codes in O(1)
         """
+        assert self._policy_codes is not None, f"Policy not defined for {self} call {self}.solve()"
+        return policy_table.ActionCodePolicy(self, self._policy_codes[player - 1])
+
+    def get_slowest_loss_policy(self, player):
+        """
+        From every state of player in the other player's winning region the policy takes an action into the highest
+        attractor rank of the other player, so the game lasts as long as possible against the other player's fastest win
+        :return: A mapping policy[state] = action (None outside the other player's winning region) with O(1) lookups
+        """
+        if player not in self._slowest_loss_codes:
+            self._slowest_loss_codes[player] = self._get_slowest_loss_codes(player)
+        return policy_table.ActionCodePolicy(self, self._slowest_loss_codes[player])
+
+    def get_optimal_policy(self, player):
+        """
+        :return: A mapping policy[state] = action that follows player's fastest win policy from player's winning region
+        and player's slowest loss policy from the other player's winning region (None in the draw region)
+        """
+        assert self._policy_codes is not None, f"Policy not defined for {self} call {self}.solve()"
+        if player not in self._optimal_codes:
+            policy_codes = array('b', self._policy_codes[player - 1])
+            self.get_slowest_loss_policy(player)
+            slowest_loss_codes = self._slowest_loss_codes[player]
+            for state_id in range(len(policy_codes)):
+                if policy_codes[state_id] == -1:
+                    policy_codes[state_id] = slowest_loss_codes[state_id]
+            self._optimal_codes[player] = policy_codes
+        return policy_table.ActionCodePolicy(self, self._optimal_codes[player])
+
+    def _get_slowest_loss_codes(self, player):
+        """
+        :return: An array where codes[state_id] is the action code of player's slowest loss policy from the state or -1
+        """
+        assert self._ranks_1 is not None, f"Attractor ranks not defined for {self} call {self}.solve()"
+        self._ensure_game_built()
+        table = self._get_table()
+        num_states = table.num_states
+        num_actions = table.num_actions
+        other_ranks = self._ranks_2 if player == 1 else self._ranks_1
+        codes = array('b', [-1]) * num_states
+        for state_id in range(num_states):
+            rank = other_ranks[state_id]
+            if rank > 0 and table.states[state_id][2] == player:
+                # the rank of a state of the losing player is 1 + the highest rank of its successors, choose the last
+                # action (in action order) that leads to rank - 1
+                row = state_id * num_actions
+                for action_id in range(num_actions):
+                    target = table.targets[row + action_id]
+                    if target != DISABLED and target < num_states and other_ranks[target] == rank - 1:
+                        codes[state_id] = action_id
+        return codes
+
+    def export_solution(self, path):
+        """
+        Writes both winning regions as bitsets and both policies as uint8 action codes, indexed by the stable state
+        numbering of policy_table.get_state_index, to a compact binary file
+        :param path: Path of the file to write
+        """
+        if not self.is_solved():
+            raise Exception("Cannot export solution game is not solved")
+        policy_table.write_solution(path, self)
+
+    @staticmethod
+    def load_solution(path):
+        """
+        :param path: Path of a file written by export_solution
+        :return: A MappedSolution reading the file through mmap, lookups index straight into the shared mapping
+        """
+        return policy_table.MappedSolution(path)
+
+    def play_game(self, save_run=False, path=None, store=None):
+        """
+        Allow the user to play a run of the game as the losing player to test their strategies. The winning player plays
+        their fastest win policy
+        :param store: An optional SolutionStore used to load (or save) the solution if the game is not solved yet
+        """
+        if not self.is_solved():
+            self.solve(store=store)
         run = list()
         state = self.get_start_game_state()
         winner = 1 if state in self.get_win_region(1) else 2
+        policy = self.get_fastest_win_policy(winner)
         while state not in self.get_goal_states(1) and state not in self.get_goal_states(2):
             print(state)
             turn = state[2]
             if turn != winner:
-                action = input(f"Choose an action from: {self.get_enabled_actions(state)}\n")
-                while action not in self.get_enabled_actions(state):
-                    action = input(f"Choose an action from: {self.get_enabled_actions(state)}\n")
+                action = input(f"Choose an action from: {self.get_enabled_actions(state, self.rules)}\n")
+                while action not in self.get_enabled_actions(state, self.rules):
+                    action = input(f"Choose an action from: {self.get_enabled_actions(state, self.rules)}\n")
             else:
-                action = self._policy_1[state] if turn == 1 else self._policy_2[state]
+                action = policy[state]
             print(f"Player {turn} taking action {action}")
 
             run.append(state)
             run.append(action)
-            state = CoupMatchupEnvironment.transition(state, action)
+            state = self.transition(state, action, self.rules)
         run.append(state)
         print(state)
         if save_run:
@@ -221,8 +757,9 @@ class CoupMatchupEnvironment:
                     file.write(f"{item}\n")
 
     def save_game_graph_edge_list(self, path: str):
-        if self.transitions is None:
+        if not self.is_solved():
             raise Exception("Cannot save game graph game is not solved")
+        self._ensure_game_built()
         with open(path, 'w') as file:
             file.write(f"source,target\n")
             for source_state in self.transitions:
@@ -231,11 +768,22 @@ class CoupMatchupEnvironment:
                     if target_state != constants.ACTION_DISABLED:
                         file.write(f"{str(source_state).replace(',', '.')},{str(target_state).replace(',', '.')}\n")
 
+    def save_game_graph_npz(self, path: str):
+        """
+        Binary counterpart of save_game_graph_edge_list, see graph_export (needs numpy). Load it with
+        graph_export.GameGraph.
+        """
+        if not self.is_solved():
+            raise Exception("Cannot save game graph game is not solved")
+        self._ensure_game_built()
+        graph_export.save_game_graph_npz(path, self)
+
     @staticmethod
-    def transition(state, action):
+    def transition(state, action, rules=DEFAULT_RULES):
         """
         :param state: An initial state the action is being taken from
         :param action: The action being taken from state
+        :param rules: The Rules of the game
         :return: The resulting state from taking action from the input state
         """
         # unpack state
@@ -263,9 +811,9 @@ class CoupMatchupEnvironment:
             elif action == constants.COUP:
                 new_coup_counter_state = 1
                 if turn == 1:
-                    new_player1_state = (player1_state[0], player1_state[1], player1_state[2] - 7)
+                    new_player1_state = (player1_state[0], player1_state[1], player1_state[2] - rules.coup_cost)
                 elif turn == 2:
-                    new_player2_state = (player2_state[0], player2_state[1], player2_state[2] - 7)
+                    new_player2_state = (player2_state[0], player2_state[1], player2_state[2] - rules.coup_cost)
             elif action == constants.TAX:
                 if turn == 1:
                     new_player1_state = (player1_state[0], player1_state[1], player1_state[2] + 3)
@@ -335,11 +883,12 @@ class CoupMatchupEnvironment:
         return new_state
 
     @staticmethod
-    def get_enabled_actions(state):
+    def get_enabled_actions(state, rules=DEFAULT_RULES):
         """
         Returns a list of all actions/counter-actions that can be taken from 'state'.
 
         :param state: The state from which player is taking actions
+        :param rules: The Rules of the game
         :return: A list of all possible actions that can be taken from 'state'
         """
         player = state[0] if state[2] == 1 else state[1]
@@ -347,16 +896,16 @@ class CoupMatchupEnvironment:
         enabled_acts = list()
         # ACTION STATE
         if state[3] == 0 and state[4] == 0 and state[5] == 0 and state[6] == 0:
-            if player_coins >= 10:
+            if player_coins >= rules.forced_coup_coins:
                 enabled_acts.append(constants.COUP)
                 return enabled_acts
             enabled_acts.append(constants.INCOME)
             enabled_acts.append(constants.FOREIGN_AID)
-            if player_coins >= 7:
+            if player_coins >= rules.coup_cost:
                 enabled_acts.append(constants.COUP)
             if constants.DUKE in player:
                 enabled_acts.append(constants.TAX)
-            if constants.ASSASSIN in player and player_coins >= 3:
+            if constants.ASSASSIN in player and player_coins >= rules.assassinate_cost:
                 enabled_acts.append(constants.ASSASSINATE)
             if constants.CAPTAIN in player:
                 enabled_acts.append(constants.STEAL)
@@ -388,17 +937,23 @@ class CoupMatchupEnvironment:
         return enabled_acts
 
     @staticmethod
-    def _get_player_states(player_cards):
+    def _get_player_states(player_cards, rules=DEFAULT_RULES, fold_hands=False):
         """
         player_states are of the form (card, card, coin_count) where card is either the value of the
         alive card or "dead" and coin_count is the number of coins the player has.
 
         :param player_cards: A tuple of the player's cards
+        :param rules: The Rules of the game
+        :param fold_hands: Whether to return the folded player states (see fold_state)
         :return: A list of all possible player states
         """
         card0_states = (player_cards[0], "dead")
         card1_states = (player_cards[1], "dead")
-        # players can have at most 12 coins since they must coup if they have 10+ and can take at most 3 at a time
-        coin_states = [n for n in range(13)]
+        # with the default rules players can have at most 12 coins since they must coup if they have 10+ and can take
+        # at most 3 at a time
+        coin_states = [n for n in range(rules.max_coins + 1)]
         player_states = itertools.product(card0_states, card1_states, coin_states)
+        if fold_hands:
+            return list(dict.fromkeys(CoupMatchupEnvironment._fold_player_state(player_state)
+                                      for player_state in player_states))
         return list(player_states)
\ No newline at end of file
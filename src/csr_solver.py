@@ -0,0 +1,186 @@
+"""
+Vectorized attractor solver. The game graph is stored as a CSR (compressed sparse row) adjacency and every attractor
+level is computed with NumPy boolean mask operations over all edges at once instead of one state at a time. Several
+matchups can be stacked into one block diagonal graph and solved together in a single batch.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import solve_metrics
+
+
+class CSRGraph:
+    """
+    A game graph in CSR form. The successors of state s are indices[indptr[s]:indptr[s + 1]] and the action codes of
+    those edges are edge_actions[indptr[s]:indptr[s + 1]]. Transitions leaving the state space all point at a single
+    sink node with index num_states which is never winning.
+    """
+
+    def __init__(self, indptr, indices, edge_actions, turns, num_states):
+        """
+        :param indptr: int64 array of length num_states + 1 with the start of each state's edges
+        :param indices: int32 array with the target of every edge
+        :param edge_actions: int8 array with the action code of every edge
+        :param turns: int8 array with the player whose turn it is in every state
+        :param num_states: The number of states in the graph (not counting the sink)
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.edge_actions = edge_actions
+        self.turns = turns
+        self.num_states = num_states
+        # edge_sources[e] = the state edge e leaves from
+        self.edge_sources = np.repeat(np.arange(num_states, dtype=np.int32), np.diff(indptr))
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        :param table: A TransitionTable
+        :return: The CSRGraph of the enabled transitions in table
+        """
+        require_numpy("The csr solver backend", "use the worklist backend")
+        num_states = table.num_states
+        targets = np.frombuffer(table.targets, dtype=np.int32).reshape(num_states, table.num_actions)
+        enabled = targets != -1
+        indptr = np.zeros(num_states + 1, dtype=np.int64)
+        np.cumsum(enabled.sum(axis=1), out=indptr[1:])
+        # row major order keeps each state's edges contiguous and sorted by action code
+        sources, edge_actions = np.nonzero(enabled)
+        indices = targets[sources, edge_actions]
+        indices = np.where(indices < num_states, indices, num_states).astype(np.int32)
+        turns = np.fromiter((table.states[state_id][2] for state_id in range(num_states)), dtype=np.int8,
+                            count=num_states)
+        return cls(indptr, indices, edge_actions.astype(np.int8), turns, num_states)
+
+    @classmethod
+    def stack(cls, graphs):
+        """
+        :param graphs: A list of CSRGraphs
+        :return: A single block diagonal CSRGraph containing every graph and the state offset of each graph in it
+        """
+        offsets = np.zeros(len(graphs) + 1, dtype=np.int64)
+        np.cumsum([graph.num_states for graph in graphs], out=offsets[1:])
+        num_states = int(offsets[-1])
+        indptr = [np.zeros(1, dtype=np.int64)]
+        indices = list()
+        edge_offset = 0
+        for graph, offset in zip(graphs, offsets):
+            indptr.append(graph.indptr[1:] + edge_offset)
+            edge_offset += len(graph.indices)
+            # the sink of every graph becomes the shared sink of the stacked graph
+            indices.append(np.where(graph.indices < graph.num_states, graph.indices + offset, num_states)
+                           .astype(np.int32))
+        return cls(np.concatenate(indptr), np.concatenate(indices),
+                   np.concatenate([graph.edge_actions for graph in graphs]),
+                   np.concatenate([graph.turns for graph in graphs]), num_states), offsets
+
+
+def solve_attractor(graph, goal_mask, player, verbose=False, metrics=None):
+    """
+    Computes the attractor of the states in goal_mask for player one level at a time. A state of player joins the next
+    level if ANY of its successors is winning and a state of the other player joins if ALL of its enabled successors
+    are winning.
+    :param graph: A CSRGraph
+    :param goal_mask: Boolean array of length graph.num_states marking player's goal states
+    :param player: The player whose attractor is computed
+    :param metrics: An optional SolveMetrics the number of level sweeps is recorded in
+    :return: An int32 array of attractor ranks (-1 outside the attractor) and an int8 array of policy action codes (-1
+    where player has no winning action)
+    """
+    num_states = graph.num_states
+    players_turn = graph.turns == player
+    degree = np.diff(graph.indptr)
+    # the extra slot is the sink which is never winning
+    winning = np.zeros(num_states + 1, dtype=bool)
+    winning[:num_states] = goal_mask
+    ranks = np.full(num_states, -1, dtype=np.int32)
+    ranks[goal_mask] = 0
+
+    level = 1
+    while True:
+        if verbose:
+            print(f"Computing attractor level {level} for player {player}")
+        winning_edges = winning[graph.indices]
+        winning_successors = np.bincount(graph.edge_sources[winning_edges], minlength=num_states)
+        new_states = ~winning[:num_states] & np.where(players_turn, winning_successors > 0,
+                                                      winning_successors == degree)
+        if not new_states.any():
+            break
+        ranks[new_states] = level
+        winning[:num_states] |= new_states
+        level += 1
+    if metrics is not None:
+        # every level is one sweep over all edges, plus the final sweep that finds no new states
+        metrics.iterations[player] = level
+    return ranks, get_policy_codes(graph, ranks, player)
+
+
+def get_policy_codes(graph, ranks, player):
+    """
+    :param graph: A CSRGraph
+    :param ranks: player's attractor ranks (-1 outside the attractor)
+    :return: An int8 array with the code of the last action (in action order) from every state of player that leads to
+    a lower attractor level (-1 where player has no winning action)
+    """
+    players_turn = graph.turns == player
+    source_ranks = ranks[graph.edge_sources]
+    target_ranks = np.append(ranks, -1)[graph.indices]
+    policy_edges = players_turn[graph.edge_sources] & (source_ranks > 0) & (target_ranks >= 0) & \
+                   (target_ranks < source_ranks)
+    policy_codes = np.full(graph.num_states, -1, dtype=np.int8)
+    np.maximum.at(policy_codes, graph.edge_sources[policy_edges], graph.edge_actions[policy_edges])
+    return policy_codes
+
+
+def solve_batch(environments, verbose=False, metrics=None):
+    """
+    Solves several matchups at once by stacking their game graphs into one CSR graph. The winning regions and policies
+    of both players and the draw region are stored in each environment as if environment.solve() had been called.
+    :param environments: A list of CoupMatchupEnvironments
+    :param metrics: An optional list with a SolveMetrics for every environment. The phases that solve the stacked
+    graph are recorded with the time of the whole batch in each of them
+    """
+    require_numpy("The csr solver backend", "use the worklist backend")
+    if metrics is None:
+        metrics = [solve_metrics.SolveMetrics(environment.player1_cards, environment.player2_cards)
+                   for environment in environments]
+    graphs = list()
+    for environment, environment_metrics in zip(environments, metrics):
+        environment.build_game(verbose=verbose, metrics=environment_metrics)
+        with environment_metrics.phase("csr_graph"):
+            graphs.append(CSRGraph.from_table(environment._get_table()))
+    batch_metrics = solve_metrics.SolveMetrics((), ())
+    with batch_metrics.phase("csr_stack"):
+        graph, offsets = CSRGraph.stack(graphs)
+
+    solutions = list()
+    for player in (1, 2):
+        with batch_metrics.phase(f"attractor_{player}"):
+            goal_mask = np.zeros(graph.num_states, dtype=bool)
+            for environment, offset in zip(environments, offsets):
+                state_ids = environment._get_table().state_ids
+                goal_mask[[offset + state_ids[state] for state in environment.get_goal_states(player)]] = True
+            solutions.append(solve_attractor(graph, goal_mask, player, verbose=verbose, metrics=batch_metrics))
+    (ranks_1, policy_codes_1), (ranks_2, policy_codes_2) = solutions
+    for i, (environment, environment_metrics) in enumerate(zip(environments, metrics)):
+        environment_metrics.phases.update({name: dict(phase) for name, phase in batch_metrics.phases.items()})
+        start, end = offsets[i], offsets[i + 1]
+        for player, ranks in ((1, ranks_1), (2, ranks_2)):
+            environment_metrics.record_attractor(player, ranks[start:end].tolist(), batch_metrics.iterations[player])
+        with environment_metrics.phase("decode"):
+            environment._decode_solution(ranks_1[start:end].tolist(), policy_codes_1[start:end].tolist(),
+                                         ranks_2[start:end].tolist(), policy_codes_2[start:end].tolist())
+
+
+def require_numpy(feature, alternative=None):
+    """
+    Raises an exception naming feature if NumPy is not installed. NumPy is optional: the modules that use it leave np
+    as None when the import fails, so they (and the modules importing them) still load without it, and they call this
+    before using it
+    :param feature: The feature that needs NumPy, e.g. "The csr solver backend"
+    :param alternative: What to use instead without NumPy
+    """
+    if np is None:
+        raise Exception(f"{feature} requires numpy, install it" + (f" or {alternative}" if alternative else ""))
@@ -0,0 +1,270 @@
+"""
+Coup matchups with EXCHANGE and challenges.
+
+Under the extended rules any player may claim any character: TAX, ASSASSINATE, STEAL and EXCHANGE and the three blocks
+can be taken with or without the card they need. Every claim opens a challenge window for the other player. A challenge
+against a player who holds the claimed card fails and the challenger loses an influence, otherwise the claimant loses an
+influence and the claimed action or block does not happen. The player losing an influence chooses which card to lose.
+
+Which cards players hold changes with EXCHANGE, so the state space is no longer the product of the two starting hands.
+Its eager product is several orders of magnitude larger than the reachable part, so the environment is always lazy:
+states are generated from the start state as they are reached (see TransitionTable.expand).
+
+States have an eighth field, pending, that is NO_PENDING or one of
+    (CHALLENGE_WINDOW, claim) -- the player to move may challenge claim (an action or a block) of the other player
+    (LOSE_INFLUENCE, claim, claim_succeeds) -- the player to move loses an influence, then claim is resolved (claim is
+    None when the influence is lost to an assassination)
+    (EXCHANGE_WINDOW,) -- the player to move chooses their new cards
+
+The game stays one of perfect information, which makes a few simplifications necessary:
+    - a player whose claim survives a challenge keeps the revealed card instead of drawing a replacement
+    - EXCHANGE lets the player choose any new hand with at most COPIES_PER_CARD alive copies of each card among both
+    players, instead of choosing from two random cards of the court deck
+    - dead cards are not remembered, so they do not count towards COPIES_PER_CARD
+"""
+import itertools
+
+import constants
+from coup_matchup_environment import CoupMatchupEnvironment
+from rules import DEFAULT_RULES
+
+NO_PENDING = 0
+CHALLENGE_WINDOW = "challenge_window"
+LOSE_INFLUENCE = "lose_influence"
+EXCHANGE_WINDOW = "exchange_window"
+
+COPIES_PER_CARD = 3
+# cards that back each claim
+CLAIMED_CARDS = {
+    constants.TAX: (constants.DUKE,),
+    constants.ASSASSINATE: (constants.ASSASSIN,),
+    constants.STEAL: (constants.CAPTAIN,),
+    constants.EXCHANGE: (constants.AMBASSADOR,),
+    constants.BLOCK_FOREIGN_AID: (constants.DUKE,),
+    constants.BLOCK_STEAL: (constants.CAPTAIN, constants.AMBASSADOR),
+    constants.BLOCK_ASSASSINATE: (constants.CONTESSA,),
+}
+# new hands a player can choose with EXCHANGE, both cards alive (in CARDS order) or only one card alive
+EXCHANGE_HANDS = tuple(itertools.combinations_with_replacement(constants.CARDS, 2)) + \
+    tuple((card,) for card in constants.CARDS)
+EXCHANGE_ACTIONS = tuple(f"exchange_for_{'_'.join(hand)}" for hand in EXCHANGE_HANDS)
+
+
+class ExtendedCoupMatchupEnvironment(CoupMatchupEnvironment):
+    # helpers of transition and get_enabled_actions that are part of the rules (see solution_store)
+    rule_methods = ("_resolve_claim", "_lose_influence", "_exchange", "_get_exchange_hands", "_get_state_space_size")
+
+    def __init__(self, player1_cards, player2_cards, max_states=None, rules=DEFAULT_RULES):
+        """
+        :param max_states: Maximum number of states to generate, building the game fails instead of exceeding it
+        :param rules: The Rules of the game (coins and costs, see rules)
+        """
+        super().__init__(player1_cards, player2_cards, lazy=True, max_states=max_states, rules=rules)
+
+    def _get_actions(self):
+        """
+        :return: A tuple of all possible actions (including counter-actions, CHALLENGE and the EXCHANGE choices)
+        """
+        if self.actions is None:
+            return tuple(constants.actions) + (constants.EXCHANGE,) + tuple(constants.counter_actions) + \
+                (constants.CHALLENGE,) + EXCHANGE_ACTIONS
+        return self.actions
+
+    def _is_in_state_space(self, state):
+        """
+        :return: Whether state is part of the state space: coins within 0 to the coin cap and at least one alive card
+        """
+        player1_state, player2_state = state[0], state[1]
+        max_coins = self.rules.max_coins
+        return 0 <= player1_state[2] <= max_coins and 0 <= player2_state[2] <= max_coins and \
+            not player1_state[:2] == player2_state[:2] == (constants.DEAD, constants.DEAD)
+
+    def _get_state_space_size(self):
+        """
+        :return: The number of states an eager product over all fields would enumerate: 6 values (5 cards or dead) per
+        card and the coin values per player, 2 turns, 16 counter flag combinations and 24 pending values
+        """
+        player_states = (len(constants.CARDS) + 1) ** 2 * (self.rules.max_coins + 1)
+        pending_values = 1 + len(CLAIMED_CARDS) + 2 * len(CLAIMED_CARDS) + 1 + 1
+        return player_states ** 2 * 2 * 2 ** 4 * pending_values
+
+    def get_start_game_state(self):
+        """
+        :return: The state that represents the start of a new game (both players have their cards alive and the
+        starting coins of the rules)
+        """
+        return super().get_start_game_state() + (NO_PENDING,)
+
+    @staticmethod
+    def transition(state, action, rules=DEFAULT_RULES):
+        """
+        :param state: An initial state the action is being taken from
+        :param action: The action being taken from state
+        :param rules: The Rules of the game
+        :return: The resulting state from taking action from the input state
+        """
+        turn = state[2]
+        other_turn = 1 if turn == 2 else 2
+        pending = state[7]
+        if pending == NO_PENDING:
+            if action in CLAIMED_CARDS:
+                # the other player may challenge the claim before it takes effect
+                return state[0], state[1], other_turn, 0, 0, 0, 0, (CHALLENGE_WINDOW, action)
+            return CoupMatchupEnvironment.transition(state[:7], action, rules) + (NO_PENDING,)
+
+        if pending[0] == CHALLENGE_WINDOW:
+            claim = pending[1]
+            if action == constants.NO_ACTION:
+                return ExtendedCoupMatchupEnvironment._resolve_claim(state, claim, other_turn, True)
+            claimant_state = state[0] if other_turn == 1 else state[1]
+            if any(card in claimant_state[:2] for card in CLAIMED_CARDS[claim]):
+                # the challenge fails, the challenger loses an influence and the claim goes ahead
+                return state[:7] + ((LOSE_INFLUENCE, claim, True),)
+            # the claim was a bluff, the claimant loses an influence and the claim fails
+            return state[0], state[1], other_turn, 0, 0, 0, 0, (LOSE_INFLUENCE, claim, False)
+
+        if pending[0] == LOSE_INFLUENCE:
+            new_state = ExtendedCoupMatchupEnvironment._lose_influence(state, action)
+            claim, claim_succeeds = pending[1:]
+            if claim is None:
+                return new_state[:7] + (NO_PENDING,)
+            # a successful claim means the challenger (the player to move) lost the challenge
+            claimant = other_turn if claim_succeeds else turn
+            return ExtendedCoupMatchupEnvironment._resolve_claim(new_state, claim, claimant, claim_succeeds)
+
+        # EXCHANGE_WINDOW
+        new_state = ExtendedCoupMatchupEnvironment._exchange(state, EXCHANGE_HANDS[EXCHANGE_ACTIONS.index(action)])
+        return new_state[0], new_state[1], other_turn, 0, 0, 0, 0, NO_PENDING
+
+    @staticmethod
+    def _resolve_claim(state, claim, claimant, claim_succeeds):
+        """
+        :param state: The state once the claim is no longer challenged (its turn and flags are ignored)
+        :param claim: The claimed action or block
+        :param claimant: The player who made the claim
+        :param claim_succeeds: Whether the claimed action or block takes effect
+        :return: The state after the claim is resolved
+        """
+        player_states = [state[0], state[1]]
+        other = 1 if claimant == 2 else 2
+        if claim in constants.actions or claim == constants.EXCHANGE:
+            if not claim_succeeds:
+                return player_states[0], player_states[1], other, 0, 0, 0, 0, NO_PENDING
+            if claim == constants.TAX:
+                card_1, card_2, coins = player_states[claimant - 1]
+                player_states[claimant - 1] = (card_1, card_2, coins + 3)
+                return player_states[0], player_states[1], other, 0, 0, 0, 0, NO_PENDING
+            if claim == constants.ASSASSINATE:
+                return player_states[0], player_states[1], other, 1, 0, 0, 0, NO_PENDING
+            if claim == constants.STEAL:
+                return player_states[0], player_states[1], other, 0, 0, 1, 0, NO_PENDING
+            return player_states[0], player_states[1], claimant, 0, 0, 0, 0, (EXCHANGE_WINDOW,)
+
+        # the claimant blocked an action of the other player, the blocker moves next
+        if claim_succeeds:
+            return player_states[0], player_states[1], claimant, 0, 0, 0, 0, NO_PENDING
+        if claim == constants.BLOCK_FOREIGN_AID:
+            card_1, card_2, coins = player_states[other - 1]
+            player_states[other - 1] = (card_1, card_2, coins + 2)
+        elif claim == constants.BLOCK_STEAL:
+            card_1, card_2, coins = player_states[claimant - 1]
+            coins_stolen = 2 if coins >= 2 else coins
+            player_states[claimant - 1] = (card_1, card_2, coins - coins_stolen)
+            card_1, card_2, coins = player_states[other - 1]
+            player_states[other - 1] = (card_1, card_2, coins + coins_stolen)
+        elif claim == constants.BLOCK_ASSASSINATE:
+            return player_states[0], player_states[1], claimant, 0, 0, 0, 0, (LOSE_INFLUENCE, None, False)
+        return player_states[0], player_states[1], claimant, 0, 0, 0, 0, NO_PENDING
+
+    @staticmethod
+    def _lose_influence(state, action):
+        """
+        :param action: KILL_CARD_1 or KILL_CARD_2
+        :return: state with the chosen card of the player to move dead
+        """
+        player_state = state[0] if state[2] == 1 else state[1]
+        if action == constants.KILL_CARD_1:
+            player_state = (constants.DEAD, player_state[1], player_state[2])
+        else:
+            player_state = (player_state[0], constants.DEAD, player_state[2])
+        if state[2] == 1:
+            return (player_state,) + state[1:]
+        return (state[0], player_state) + state[2:]
+
+    @staticmethod
+    def _exchange(state, hand):
+        """
+        :param hand: The new cards of the player to move, one for each of their alive cards
+        :return: state with the alive cards of the player to move replaced by hand
+        """
+        player_state = state[0] if state[2] == 1 else state[1]
+        if len(hand) == 2:
+            player_state = (hand[0], hand[1], player_state[2])
+        elif player_state[0] != constants.DEAD:
+            player_state = (hand[0], constants.DEAD, player_state[2])
+        else:
+            player_state = (constants.DEAD, hand[0], player_state[2])
+        if state[2] == 1:
+            return (player_state,) + state[1:]
+        return (state[0], player_state) + state[2:]
+
+    @staticmethod
+    def _get_exchange_hands(state):
+        """
+        :return: The ids (indices in EXCHANGE_HANDS) of the hands the player to move can choose with EXCHANGE
+        """
+        player_state, other_player_state = (state[0], state[1]) if state[2] == 1 else (state[1], state[0])
+        num_alive = sum(card != constants.DEAD for card in player_state[:2])
+        hand_ids = list()
+        for hand_id, hand in enumerate(EXCHANGE_HANDS):
+            if len(hand) != num_alive:
+                continue
+            alive_cards = list(hand) + [card for card in other_player_state[:2] if card != constants.DEAD]
+            if all(alive_cards.count(card) <= COPIES_PER_CARD for card in hand):
+                hand_ids.append(hand_id)
+        return hand_ids
+
+    @staticmethod
+    def get_enabled_actions(state, rules=DEFAULT_RULES):
+        """
+        Returns a list of all actions/counter-actions that can be taken from 'state'. Claims do not depend on the cards
+        a player holds, bluffs are resolved by challenges.
+
+        :param state: The state from which player is taking actions
+        :param rules: The Rules of the game
+        :return: A list of all possible actions that can be taken from 'state'
+        """
+        player = state[0] if state[2] == 1 else state[1]
+        alive_cards = list()
+        if player[0] != constants.DEAD:
+            alive_cards.append(constants.KILL_CARD_1)
+        if player[1] != constants.DEAD:
+            alive_cards.append(constants.KILL_CARD_2)
+        pending = state[7]
+        if pending != NO_PENDING:
+            if pending[0] == CHALLENGE_WINDOW:
+                return [constants.CHALLENGE, constants.NO_ACTION]
+            if pending[0] == LOSE_INFLUENCE:
+                return alive_cards
+            return [EXCHANGE_ACTIONS[hand_id] for hand_id in ExtendedCoupMatchupEnvironment._get_exchange_hands(state)]
+
+        # ACTION STATE
+        if state[3] == 0 and state[4] == 0 and state[5] == 0 and state[6] == 0:
+            if player[2] >= rules.forced_coup_coins:
+                return [constants.COUP]
+            enabled_acts = [constants.INCOME, constants.FOREIGN_AID]
+            if player[2] >= rules.coup_cost:
+                enabled_acts.append(constants.COUP)
+            enabled_acts.append(constants.TAX)
+            if player[2] >= rules.assassinate_cost:
+                enabled_acts.append(constants.ASSASSINATE)
+            enabled_acts.extend([constants.STEAL, constants.EXCHANGE])
+            return enabled_acts
+        # COUNTER ACTION STATES
+        if state[3] == 1:
+            return alive_cards + [constants.BLOCK_ASSASSINATE]
+        if state[4] == 1:
+            return [constants.BLOCK_FOREIGN_AID, constants.NO_ACTION]
+        if state[5] == 1:
+            return [constants.BLOCK_STEAL, constants.NO_ACTION]
+        return alive_cards
@@ -0,0 +1,139 @@
+"""
+Binary game graph export. Graphs are written to a NumPy .npz container holding a node table (one row of decoded state
+fields per node), the edges as CSR arrays and the action label of every edge, so they can be loaded back without any
+string parsing. Cards are stored as their index in the player's cards rather than as alive flags, since a folded state
+(see CoupMatchupEnvironment.fold_state) can hold the player's second card in card 1.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import constants
+from csr_solver import require_numpy
+from transition_table import DISABLED
+
+# columns of the node table, the card columns hold the index of the card in the player's cards or DEAD_CARD
+NODE_FIELDS = ("player1_card_1", "player1_card_2", "player1_coins", "player2_card_1", "player2_card_2", "player2_coins",
+               "turn", "assassinate_counter_state", "foreign_aid_counter_state", "steal_counter_state",
+               "coup_counter_state")
+DEAD_CARD = -1
+
+
+def save_game_graph_npz(path, environment):
+    """
+    Writes the full game graph of environment (every state and every enabled transition)
+    :param environment: A CoupMatchupEnvironment whose game has been built
+    """
+    require_numpy("Binary graph export", "use the csv edge lists")
+    _check_state_fields(environment)
+    table = environment._get_table()
+    targets = np.frombuffer(table.targets, dtype=np.int32).reshape(table.num_states, table.num_actions)
+    sources, edge_actions = np.nonzero(targets != DISABLED)
+    _write_graph(path, table.states, sources, targets[sources, edge_actions], edge_actions, table.actions,
+                 (environment.player1_cards, environment.player2_cards))
+
+
+def save_edges_npz(path, environment, edges):
+    """
+    Writes the graph made of edges, e.g. a run graph from run_experiment.iter_run_graph_edges(include_actions=True)
+    :param environment: The CoupMatchupEnvironment the edges belong to
+    :param edges: An iterable of (state, action, new_state) edges
+    """
+    require_numpy("Binary graph export", "use the csv edge lists")
+    _check_state_fields(environment)
+    actions = environment._get_actions()
+    action_ids = dict(zip(actions, range(len(actions))))
+    states = list()
+    state_ids = dict()
+    sources = list()
+    targets = list()
+    edge_actions = list()
+    for state, action, new_state in edges:
+        for node in (state, new_state):
+            if node not in state_ids:
+                state_ids[node] = len(states)
+                states.append(node)
+        sources.append(state_ids[state])
+        targets.append(state_ids[new_state])
+        edge_actions.append(action_ids[action])
+    _write_graph(path, states, np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int32),
+                 np.array(edge_actions, dtype=np.int8), actions, (environment.player1_cards, environment.player2_cards))
+
+
+def _check_state_fields(environment):
+    # the node table has no room for the pending field and exchanged hands of the extended rules
+    num_fields = len(environment.get_start_game_state())
+    if num_fields != constants.NUM_STATE_FIELDS:
+        raise Exception(f"The node table only holds the {constants.NUM_STATE_FIELDS} field states of the base rules, "
+                        f"{environment} has states with {num_fields} fields. Use save_game_graph_edge_list")
+
+
+def _write_graph(path, states, sources, targets, edge_actions, actions, cards):
+    """
+    :param states: A list of states, node i is states[i]
+    :param sources: Array with the source node of every edge
+    :param targets: Array with the target node of every edge
+    :param edge_actions: Array with the action code of every edge
+    :param actions: A tuple of action labels, action codes index into it
+    :param cards: (player1_cards, player2_cards)
+    """
+    nodes = np.array([_encode_state(state, cards) for state in states],
+                     dtype=np.int8).reshape(len(states), len(NODE_FIELDS))
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(len(states) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(states)), out=indptr[1:])
+    np.savez_compressed(path, nodes=nodes, node_fields=np.array(NODE_FIELDS), indptr=indptr,
+                        indices=np.asarray(targets, dtype=np.int32)[order],
+                        edge_actions=np.asarray(edge_actions, dtype=np.int8)[order], actions=np.array(actions),
+                        cards=np.array(cards))
+
+
+def _encode_state(state, cards):
+    fields = list()
+    for player_state, player_cards in zip(state[:2], cards):
+        fields.extend(DEAD_CARD if card == constants.DEAD else player_cards.index(card) for card in player_state[:2])
+        fields.append(player_state[2])
+    return tuple(fields) + tuple(state[2:])
+
+
+class GameGraph:
+    """
+    A graph loaded from a file written by this module. Node i has decoded fields nodes[i] (see NODE_FIELDS), its edges
+    are indptr[i]:indptr[i + 1] with targets indices[...] and action labels actions[edge_actions[...]].
+    """
+
+    def __init__(self, path):
+        require_numpy("Binary graph export", "use the csv edge lists")
+        with np.load(path, allow_pickle=False) as data:
+            self.nodes = data["nodes"]
+            self.node_fields = tuple(data["node_fields"].tolist())
+            self.indptr = data["indptr"]
+            self.indices = data["indices"]
+            self.edge_actions = data["edge_actions"]
+            self.actions = tuple(data["actions"].tolist())
+            cards = data["cards"].tolist()
+        self.player1_cards = tuple(cards[0])
+        self.player2_cards = tuple(cards[1])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get_state(self, node):
+        """
+        :return: The state tuple of node (see CoupMatchupEnvironment._get_states)
+        """
+        fields = self.nodes[node].tolist()
+        player_states = list()
+        for cards, (card_1, card_2, coins) in zip((self.player1_cards, self.player2_cards), (fields[0:3], fields[3:6])):
+            player_states.append((constants.DEAD if card_1 == DEAD_CARD else cards[card_1],
+                                  constants.DEAD if card_2 == DEAD_CARD else cards[card_2], coins))
+        return (player_states[0], player_states[1]) + tuple(fields[6:])
+
+    def get_edges(self, node):
+        """
+        :return: A list of (action, target_node) pairs for every edge leaving node
+        """
+        start, end = self.indptr[node], self.indptr[node + 1]
+        return [(self.actions[action], target)
+                for action, target in zip(self.edge_actions[start:end].tolist(), self.indices[start:end].tolist())]
@@ -0,0 +1,155 @@
+"""
+Parallel attractor solver that splits the game graph of a single matchup across worker processes.
+
+The transition table, the turn of every state, the successor counters and the attractor ranks of both players live in
+multiprocessing.shared_memory blocks that every worker maps. Each worker owns a contiguous block of state ids and is the
+only process that writes the counters and ranks of its states, so no locks are needed. Attractor levels are computed in
+synchronised rounds: in round k every worker follows the edges of its own states into the states of rank k (the
+frontier, read from the shared ranks) and gives rank k + 1 to the states that join the attractor, then all workers wait
+at a barrier before the next frontier is read. Workers only read ranks equal to k and only write ranks that are -1, so
+a worker that is ahead never changes what the others read in the same round.
+"""
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import csr_solver
+import solve_metrics
+
+
+def solve_parallel(environment, num_workers=None, verbose=False, metrics=None):
+    """
+    Solves environment with num_workers processes. The winning regions and policies of both players and the draw region
+    are stored in environment as if environment.solve() had been called.
+    :param num_workers: Number of worker processes (by default all cores)
+    :param metrics: An optional SolveMetrics the phases, level sizes and rounds are recorded in
+    """
+    csr_solver.require_numpy("The parallel solver backend", "use the worklist backend")
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    metrics = solve_metrics.SolveMetrics(environment.player1_cards, environment.player2_cards) \
+        if metrics is None else metrics
+    environment.build_game(verbose=verbose, metrics=metrics)
+    table = environment._get_table()
+    num_states = table.num_states
+    with metrics.phase("csr_graph"):
+        graph = csr_solver.CSRGraph.from_table(table)
+
+    blocks = list()
+    try:
+        with metrics.phase("shared_memory"):
+            targets = _create_shared_array(blocks, (num_states, table.num_actions), np.int32)
+            targets[:] = np.frombuffer(table.targets, dtype=np.int32).reshape(num_states, table.num_actions)
+            turns = _create_shared_array(blocks, (num_states,), np.int8)
+            turns[:] = graph.turns
+            # remaining[player - 1, state_id] = number of enabled actions from the state that do not (yet) lead into
+            # player's attractor
+            remaining = _create_shared_array(blocks, (2, num_states), np.int32)
+            remaining[:] = np.diff(graph.indptr)
+            ranks = _create_shared_array(blocks, (2, num_states), np.int32)
+            ranks[:] = -1
+            for player in (1, 2):
+                goal_ids = [table.state_ids[state] for state in environment.get_goal_states(player)]
+                ranks[player - 1, goal_ids] = 0
+                # states of the other player with no enabled actions are trivially in the first attractor level
+                ranks[player - 1, (remaining[player - 1] == 0) & (graph.turns != player) &
+                      (ranks[player - 1] == -1)] = 1
+
+        with metrics.phase("attractor_parallel"):
+            _run_workers(num_workers, num_states, blocks, verbose)
+
+        all_ranks = list()
+        with metrics.phase("policy"):
+            for player in (1, 2):
+                player_ranks = np.array(ranks[player - 1])
+                all_ranks.append((player_ranks, csr_solver.get_policy_codes(graph, player_ranks, player)))
+    finally:
+        # the arrays have to be released before their blocks can be closed
+        targets = turns = remaining = ranks = None
+        for block, _, _ in blocks:
+            block.close()
+            block.unlink()
+
+    (ranks_1, policy_codes_1), (ranks_2, policy_codes_2) = all_ranks
+    for player, player_ranks in ((1, ranks_1), (2, ranks_2)):
+        # one round per attractor level plus the round that finds no new states
+        metrics.record_attractor(player, player_ranks.tolist(), player_ranks.max(initial=-1) + 2)
+    with metrics.phase("decode"):
+        environment._decode_solution(ranks_1.tolist(), policy_codes_1.tolist(), ranks_2.tolist(),
+                                     policy_codes_2.tolist())
+
+
+def _create_shared_array(blocks, shape, dtype):
+    """
+    :param blocks: A list the new shared memory block is added to as (block, shape, dtype)
+    :return: A NumPy array of shape and dtype backed by a new shared memory block
+    """
+    size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    blocks.append((block, shape, dtype))
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _run_workers(num_workers, num_states, blocks, verbose):
+    barrier = multiprocessing.Barrier(num_workers)
+    workers = [multiprocessing.Process(target=_worker, args=(worker, num_workers, num_states, blocks, barrier, verbose))
+               for worker in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    # a worker that fails would leave the others waiting at the barrier forever, so abort it to release them
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(timeout=0.1)
+            if worker.exitcode not in (None, 0):
+                barrier.abort()
+    if any(worker.exitcode != 0 for worker in workers):
+        raise Exception(f"Parallel solver workers failed with exit codes {[worker.exitcode for worker in workers]}")
+
+
+def _worker(worker, num_workers, num_states, blocks, barrier, verbose):
+    """
+    Computes the attractors of both players for the states worker owns, in lockstep with the other workers
+    """
+    targets, turns, remaining, ranks = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+                                        for block, shape, dtype in blocks]
+    start = num_states * worker // num_workers
+    end = num_states * (worker + 1) // num_workers
+    # predecessors of every state among the states this worker owns in CSR form: the owned states with an edge into
+    # state s are predecessor_sources[predecessor_indptr[s]:predecessor_indptr[s + 1]] (once per edge)
+    sources, actions = np.nonzero(targets[start:end] != -1)
+    edge_targets = targets[start:end][sources, actions]
+    in_space = edge_targets < num_states
+    sources = sources[in_space].astype(np.int32) + start
+    edge_targets = edge_targets[in_space]
+    predecessor_sources = sources[np.argsort(edge_targets, kind="stable")]
+    predecessor_indptr = np.zeros(num_states + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edge_targets, minlength=num_states), out=predecessor_indptr[1:])
+
+    for player in (1, 2):
+        player_ranks = ranks[player - 1]
+        player_remaining = remaining[player - 1]
+        level = 0
+        frontier = np.flatnonzero(player_ranks == level)
+        while len(frontier) > 0:
+            if verbose and worker == 0:
+                print(f"Computing attractor level {level + 1} for player {player}")
+            counts = predecessor_indptr[frontier + 1] - predecessor_indptr[frontier]
+            edges = np.repeat(predecessor_indptr[frontier] - np.cumsum(counts) + counts, counts) + \
+                np.arange(counts.sum())
+            predecessors = predecessor_sources[edges]
+            predecessors = predecessors[player_ranks[predecessors] == -1]
+            players_turn = turns[predecessors] == player
+            # a state of player is winning if ANY action leads to a winning state
+            player_ranks[predecessors[players_turn]] = level + 1
+            # a state of the other player is winning once ALL of its actions lead to winning states
+            others = predecessors[~players_turn]
+            np.subtract.at(player_remaining, others, 1)
+            player_ranks[others[player_remaining[others] == 0]] = level + 1
+            # every worker has written its states of rank level + 1 once all of them pass the barrier
+            barrier.wait()
+            level += 1
+            frontier = np.flatnonzero(player_ranks == level)
@@ -0,0 +1,189 @@
+"""
+Local policy query service.
+
+Answers batched (matchup, state) -> (winner, action, distance-to-win) queries over localhost TCP or a Unix socket.
+Compiled PolicyTables of recently used matchups are kept in an LRU cache, matchups that are not cached are solved in a
+background process pool without blocking queries for other matchups.
+
+Protocol: every request is one line of JSON
+    {"queries": [{"player1_cards": ["duke", "assassin"], "player2_cards": ["ambassador", "ambassador"],
+                  "state": [["duke", "assassin", 2], ["ambassador", "ambassador", 2], 1, 0, 0, 0, 0]}, ...]}
+and is answered by one line of JSON with a result for every query, in order
+    {"results": [{"winner": 1, "action": "tax", "distance": 15}, ...]}
+or {"error": message} if the request cannot be answered. See PolicyTable.query for the meaning of the fields.
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import socket
+from collections import OrderedDict
+
+import constants
+from coup_matchup_environment import CoupMatchupEnvironment
+from policy_table import NUM_COIN_VALUES, PolicyTable
+from solution_store import SolutionStore
+
+# maximum length of a request line in bytes
+MAX_REQUEST_SIZE = 64 * 1024 ** 2
+
+
+def compile_policy_table(player1_cards, player2_cards, store=None):
+    """
+    Worker task of PolicyServer -- solves a matchup (or loads it from store) and compiles its PolicyTable
+    """
+    for card in tuple(player1_cards) + tuple(player2_cards):
+        if card not in constants.CARDS:
+            raise Exception(f"Card {card} not defined")
+    environment = CoupMatchupEnvironment(tuple(player1_cards), tuple(player2_cards), compact=True)
+    environment.solve(store=store)
+    return PolicyTable.from_environment(environment)
+
+
+class PolicyServer:
+    def __init__(self, cache_size=32, num_workers=1, store=None):
+        """
+        :param cache_size: Maximum number of compiled PolicyTables kept in memory
+        :param num_workers: Number of processes solving matchups that are not cached
+        :param store: An optional SolutionStore the workers load solutions from (and save new solutions to)
+        """
+        self.cache_size = cache_size
+        self.store = store
+        self._tables = OrderedDict()
+        # matchups that are being compiled, so concurrent queries for the same matchup only solve it once
+        self._pending = dict()
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers)
+
+    async def get_table(self, player1_cards, player2_cards):
+        """
+        :return: The PolicyTable of the matchup, compiling it in the process pool if it is not cached
+        """
+        matchup = (tuple(player1_cards), tuple(player2_cards))
+        table = self._tables.get(matchup)
+        if table is not None:
+            self._tables.move_to_end(matchup)
+            return table
+        if matchup not in self._pending:
+            loop = asyncio.get_running_loop()
+            self._pending[matchup] = loop.run_in_executor(self._executor, compile_policy_table, matchup[0],
+                                                          matchup[1], self.store)
+        try:
+            table = await self._pending[matchup]
+        finally:
+            self._pending.pop(matchup, None)
+        self._tables[matchup] = table
+        self._tables.move_to_end(matchup)
+        while len(self._tables) > self.cache_size:
+            self._tables.popitem(last=False)
+        return table
+
+    async def answer(self, request):
+        """
+        :param request: A decoded request (see the module docstring)
+        :return: The response to request
+        """
+        queries = request["queries"]
+        matchups = list(dict.fromkeys((tuple(query["player1_cards"]), tuple(query["player2_cards"]))
+                                      for query in queries))
+        # all matchups of the batch are looked up (and compiled if needed) concurrently
+        tables = dict(zip(matchups, await asyncio.gather(*(self.get_table(*matchup) for matchup in matchups))))
+        results = list()
+        for query in queries:
+            matchup = (tuple(query["player1_cards"]), tuple(query["player2_cards"]))
+            winner, action, distance = tables[matchup].query(_parse_state(query["state"], matchup))
+            results.append({"winner": winner, "action": action, "distance": distance})
+        return {"results": results}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.answer(json.loads(line))
+                except Exception as error:
+                    response = {"error": f"{type(error).__name__}: {error}"}
+                writer.write(f"{json.dumps(response)}\n".encode())
+                await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+        """
+        Serves queries until cancelled
+        :param host: Host to listen on (ignored if path is given)
+        :param port: Port to listen on (ignored if path is given)
+        :param path: Path of a Unix socket to listen on instead of TCP
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=path, limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_SIZE)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def _parse_state(state, matchup):
+    """
+    :param state: A state decoded from JSON (nested lists)
+    :param matchup: The (player1_cards, player2_cards) matchup the state belongs to
+    :return: state as a tuple
+    """
+    error = Exception(f"State {state} is not a state of {matchup[0]} vs {matchup[1]}")
+    if len(state) != constants.NUM_STATE_FIELDS or any(len(player_state) != 3 for player_state in state[:2]):
+        raise error
+    player_states = list()
+    for player_state, cards in zip(state[:2], matchup):
+        card_1, card_2, coins = player_state
+        if card_1 not in (cards[0], constants.DEAD) or card_2 not in (cards[1], constants.DEAD) or \
+                not 0 <= coins < NUM_COIN_VALUES:
+            raise error
+        player_states.append((card_1, card_2, coins))
+    turn, *counter_states = state[2:]
+    if turn not in (1, 2) or any(counter_state not in (0, 1) for counter_state in counter_states):
+        raise error
+    return (player_states[0], player_states[1], int(turn)) + tuple(int(value) for value in counter_states)
+
+
+def query_policy_server(queries, host="127.0.0.1", port=8765, path=None):
+    """
+    Blocking client for PolicyServer
+    :param queries: A list of query dicts (see the module docstring)
+    :return: The decoded response
+    """
+    if path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile('rwb') as stream:
+        stream.write(f"{json.dumps({'queries': queries})}\n".encode())
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve optimal play queries for Coup matchups")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--cache-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--store", default=None, help="Directory of a SolutionStore to load solutions from")
+    args = parser.parse_args()
+
+    store = SolutionStore(args.store) if args.store is not None else None
+    server = PolicyServer(cache_size=args.cache_size, num_workers=args.workers, store=store)
+    try:
+        asyncio.run(server.serve(host=args.host, port=args.port, path=args.socket))
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Mapping
+
+import constants
+
+# players can hold 0 to 12 coins (see CoupMatchupEnvironment._get_player_states)
+NUM_COIN_VALUES = 13
+# card 1 alive/dead x card 2 alive/dead x coins
+NUM_PLAYER_STATE_INDICES = 2 * 2 * NUM_COIN_VALUES
+# player 1 state x player 2 state x turn x the four counter flags
+NUM_STATE_INDICES = NUM_PLAYER_STATE_INDICES * NUM_PLAYER_STATE_INDICES * 2 ** 5
+NO_ACTION_CODE = 255
+NO_DISTANCE = -1
+# magic, number of state indices, length of the JSON metadata that follows the header
+SOLUTION_HEADER = struct.Struct("<8sII")
+SOLUTION_MAGIC = b"COUPPOL1"
+
+
+def get_state_index(state):
+    """
+    Stable numbering of states that only depends on which cards are alive, so it is computed arithmetically instead of
+    through a dictionary lookup. It follows the order of CoupMatchupEnvironment._get_states over the full
+    itertools.product (including the states removed there, which are simply never used).
+    :return: An integer in range(NUM_STATE_INDICES)
+    """
+    player1_state, player2_state, turn, assassinate_counter_state, foreign_aid_counter_state, steal_counter_state, \
+        coup_counter_state = state
+    index = _get_player_state_index(player1_state) * NUM_PLAYER_STATE_INDICES + _get_player_state_index(player2_state)
+    for value in (turn - 1, assassinate_counter_state, foreign_aid_counter_state, steal_counter_state,
+                  coup_counter_state):
+        index = index * 2 + value
+    return index
+
+
+def _get_player_state_index(player_state):
+    card_1_dead = player_state[0] == constants.DEAD
+    card_2_dead = player_state[1] == constants.DEAD
+    return (card_1_dead * 2 + card_2_dead) * NUM_COIN_VALUES + player_state[2]
+
+
+class PolicyTable:
+    """
+    Compiled answer table of a solved matchup indexed by get_state_index. For every state it holds the player that can
+    force a win (0 if neither can), the winner's attractor rank (the number of moves until the game ends under optimal
+    play) and the optimal action of the player to move if that player is the winner.
+    """
+
+    def __init__(self, player1_cards, player2_cards, actions, winners, distances, action_codes):
+        """
+        :param actions: A tuple of all actions, action_codes index into it
+        :param winners: A bytearray of length NUM_STATE_INDICES with the winner of every state (0 for no winner)
+        :param distances: An int array of length NUM_STATE_INDICES with the winner's attractor rank of every state
+        :param action_codes: A bytearray of length NUM_STATE_INDICES with the code of the optimal action from every state
+        """
+        self.player1_cards = tuple(player1_cards)
+        self.player2_cards = tuple(player2_cards)
+        self.actions = tuple(actions)
+        self.winners = winners
+        self.distances = distances
+        self.action_codes = action_codes
+
+    @classmethod
+    def from_environment(cls, environment):
+        """
+        :param environment: A solved CoupMatchupEnvironment over the full state space
+        :return: The PolicyTable of environment
+        """
+        _check_state_space(environment)
+        actions = environment._get_actions()
+        action_ids = dict(zip(actions, range(len(actions))))
+        winners = bytearray(NUM_STATE_INDICES)
+        distances = array('i', [NO_DISTANCE]) * NUM_STATE_INDICES
+        action_codes = bytearray([NO_ACTION_CODE]) * NUM_STATE_INDICES
+        for player in (1, 2):
+            policy = environment.get_policy(player)
+            for state in environment.get_win_region(player):
+                for original_state, action in _unfold(environment, state, policy[state]):
+                    index = get_state_index(original_state)
+                    winners[index] = player
+                    distances[index] = environment.get_attractor_rank(player, state)
+                    if action is not None:
+                        action_codes[index] = action_ids[action]
+        return cls(environment.player1_cards, environment.player2_cards, actions, winners, distances, action_codes)
+
+    def query(self, state):
+        """
+        :return: A tuple (winner, action, distance) for state. winner is 0 and distance None if neither player can force
+        a win, action is None unless the player to move wins from state
+        """
+        index = get_state_index(state)
+        winner = self.winners[index]
+        if winner == 0:
+            return 0, None, None
+        action_code = self.action_codes[index]
+        action = None if action_code == NO_ACTION_CODE else self.actions[action_code]
+        return winner, action, self.distances[index]
+
+
+class ActionCodePolicy(Mapping):
+    """
+    Presents an array of action codes indexed by state id (-1 for no action) as policy[state] = action (or None), so a
+    lookup is one state id lookup and one array read instead of a dictionary of every state
+    """
+
+    def __init__(self, environment, policy_codes):
+        """
+        :param environment: The solved CoupMatchupEnvironment the state ids belong to
+        :param policy_codes: An array where policy_codes[state_id] is the code of the action taken from the state or -1
+        """
+        self.environment = environment
+        self.policy_codes = policy_codes
+
+    def __getitem__(self, state):
+        state_id = self.environment.get_state_id(state)
+        if state_id >= len(self.policy_codes):
+            raise KeyError(state)
+        action_code = self.policy_codes[state_id]
+        return None if action_code == -1 else self.environment.actions[action_code]
+
+    def __iter__(self):
+        return iter(self.environment._states)
+
+    def __len__(self):
+        return len(self.policy_codes)
+
+
+def write_solution(path, environment):
+    """
+    Writes the winning regions of both players as bitsets and their policies as uint8 action codes, both indexed by
+    get_state_index, to a binary file that can be memory mapped with MappedSolution
+    :param environment: A solved CoupMatchupEnvironment over the full state space
+    """
+    _check_state_space(environment)
+    actions = environment._get_actions()
+    action_ids = dict(zip(actions, range(len(actions))))
+    metadata = json.dumps({"player1_cards": environment.player1_cards, "player2_cards": environment.player2_cards,
+                           "actions": actions}).encode()
+    # pad the metadata so the sections start 8 byte aligned
+    metadata += b" " * (-(SOLUTION_HEADER.size + len(metadata)) % 8)
+
+    bitsets = list()
+    policies = list()
+    for player in (1, 2):
+        bitset = bytearray(_get_bitset_size())
+        for state in environment.get_win_region(player):
+            for original_state in environment.get_original_states(state):
+                index = get_state_index(original_state)
+                bitset[index >> 3] |= 1 << (index & 7)
+        bitsets.append(bitset)
+        policy_codes = bytearray([NO_ACTION_CODE]) * NUM_STATE_INDICES
+        for state, action in environment.get_policy(player).items():
+            for original_state, original_action in _unfold(environment, state, action):
+                if original_action is not None:
+                    policy_codes[get_state_index(original_state)] = action_ids[original_action]
+        policies.append(policy_codes)
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'wb') as file:
+        file.write(SOLUTION_HEADER.pack(SOLUTION_MAGIC, NUM_STATE_INDICES, len(metadata)))
+        file.write(metadata)
+        for section in bitsets + policies:
+            file.write(section)
+    os.replace(temporary_path, path)
+
+
+def _unfold(environment, state, action):
+    """
+    :return: A list of (original state, action) of every state of the unfolded game that folds into state (see
+    CoupMatchupEnvironment.fold_state), state indices are only defined for unfolded states
+    """
+    return [(original_state, environment.get_original_action(original_state, action))
+            for original_state in environment.get_original_states(state)]
+
+
+def _check_state_space(environment):
+    """
+    Rejects environments whose states get_state_index cannot number: states with the pending field and exchanged hands
+    of the extended rules, more coins than NUM_COIN_VALUES covers and reachable only (or lazy) games, whose states left
+    out would be indistinguishable from states nobody wins
+    """
+    num_fields = len(environment.get_start_game_state())
+    if num_fields != constants.NUM_STATE_FIELDS:
+        raise Exception(f"State indices only cover the {constants.NUM_STATE_FIELDS} field states of the base rules, "
+                        f"{environment} has states with {num_fields} fields")
+    if environment.rules.max_coins >= NUM_COIN_VALUES:
+        raise Exception(f"State indices only cover up to {NUM_COIN_VALUES - 1} coins, {environment} allows "
+                        f"{environment.rules.max_coins}")
+    if environment.reachable_only:
+        raise Exception("Solutions can only be compiled from games over the full state space")
+
+
+def _get_bitset_size():
+    return (NUM_STATE_INDICES + 7) // 8
+
+
+class MappedSolution:
+    """
+    Read only view of a file written by write_solution. The file is memory mapped, so any number of processes loading
+    the same file share one copy of it in the page cache, and nothing is decoded up front: every lookup reads a single
+    byte of the mapping at the state's get_state_index.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of a file written by write_solution
+        """
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_indices, metadata_size = SOLUTION_HEADER.unpack_from(self._mmap)
+        if magic != SOLUTION_MAGIC or num_indices != NUM_STATE_INDICES:
+            self._mmap.close()
+            raise Exception(f"{path} is not a solution file compatible with this version")
+        metadata = json.loads(self._mmap[SOLUTION_HEADER.size:SOLUTION_HEADER.size + metadata_size])
+        self.player1_cards = tuple(metadata["player1_cards"])
+        self.player2_cards = tuple(metadata["player2_cards"])
+        self.actions = tuple(metadata["actions"])
+
+        view = memoryview(self._mmap)
+        offset = SOLUTION_HEADER.size + metadata_size
+        bitset_size = _get_bitset_size()
+        self.winning_regions = (view[offset:offset + bitset_size], view[offset + bitset_size:offset + 2 * bitset_size])
+        offset += 2 * bitset_size
+        self.policy_codes = (view[offset:offset + NUM_STATE_INDICES],
+                             view[offset + NUM_STATE_INDICES:offset + 2 * NUM_STATE_INDICES])
+
+    def is_winning(self, player, state_index):
+        """
+        :return: Whether the state with index state_index (see get_state_index) is in player's winning region
+        """
+        return bool(self.winning_regions[player - 1][state_index >> 3] & (1 << (state_index & 7)))
+
+    def get_action_code(self, player, state_index):
+        """
+        :return: The code of the action player takes from the state with index state_index or NO_ACTION_CODE
+        """
+        return self.policy_codes[player - 1][state_index]
+
+    def get_action(self, player, state):
+        """
+        :return: The action player's policy takes from state or None
+        """
+        action_code = self.policy_codes[player - 1][get_state_index(state)]
+        return None if action_code == NO_ACTION_CODE else self.actions[action_code]
+
+    def close(self):
+        for section in self.winning_regions + self.policy_codes:
+            section.release()
+        self._mmap.close()
@@ -0,0 +1,63 @@
+import json
+import os
+
+
+class ProgressJournal:
+    """
+    Append-only journal of completed work. Every record is one JSON line that is flushed and fsynced before append
+    returns, so it survives the process being killed. A record cut short by a crash is ignored when the journal is read.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the journal file
+        """
+        self.path = path
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def read(self):
+        """
+        :return: A list of all complete records in the journal (an empty list if there is no journal)
+        """
+        records = list()
+        if not self.exists():
+            return records
+        with open(self.path, 'r') as file:
+            for line in file:
+                if not line.endswith("\n"):
+                    # the last record was only partly written
+                    break
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def append(self, records):
+        """
+        Durably appends records to the journal
+        :param records: A list of JSON serializable records
+        """
+        self._truncate_partial_record()
+        with open(self.path, 'a') as file:
+            for record in records:
+                file.write(f"{json.dumps(record)}\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _truncate_partial_record(self):
+        """
+        Removes a partly written record left at the end of the journal by a crash so new records start on a new line
+        """
+        if not self.exists():
+            return
+        with open(self.path, 'rb+') as file:
+            data = file.read()
+            if data and not data.endswith(b"\n"):
+                file.truncate(data.rfind(b"\n") + 1)
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.path)
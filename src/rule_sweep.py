@@ -0,0 +1,97 @@
+"""
+Runs run_experiment over a grid of rule variants.
+
+Variants are run grouped by their graph rules (everything but the starting coins, see rules.get_graph_rules). Within a
+group every variant shares the transition skeleton and the solutions in the SolutionStore, so only the first variant of
+a group builds and solves the matchups and the others only load the solutions and look up their start states.
+"""
+import argparse
+import itertools
+import os
+
+from rules import DEFAULT_RULES, Rules, get_graph_rules, get_max_coins, get_rules_key
+from run_experiment import run_experiment
+from solution_store import SolutionStore
+
+
+def get_rule_variants(**values):
+    """
+    :param values: A list of values for any of the fields of Rules, fields that are not given keep their default.
+    If max_coins is not given it is derived from every combination (see rules.get_max_coins)
+    :return: A list with the Rules of every combination of the values
+    """
+    for field in values:
+        if field not in Rules._fields:
+            raise Exception(f"Rules have no field {field}, choose from {Rules._fields}")
+    field_values = [values.get(field) or [getattr(DEFAULT_RULES, field)] for field in Rules._fields]
+    variants = list()
+    for combination in itertools.product(*field_values):
+        combination = dict(zip(Rules._fields, combination))
+        if not values.get("max_coins"):
+            combination["max_coins"] = get_max_coins(combination["starting_coins"], combination["forced_coup_coins"])
+        variants.append(Rules(**combination))
+    return variants
+
+
+def run_sweep(variants, directory="../data/sweeps", num_cores=1, store=None, resume=True, verbose=False):
+    """
+    Runs run_experiment for every rule variant and writes a summary of the number of matchups each player wins under
+    every variant to directory/summary.txt
+    :param variants: A list of Rules
+    :param directory: Directory the results of every variant are written to (results_<rules key>.txt)
+    :param num_cores: Number of cores every run_experiment uses
+    :param store: The SolutionStore solutions are shared through, a store in directory/solutions is used by default
+    :param resume: Whether to skip variants whose results file already exists
+    :return: A dict of the form paths[rules] = path of the results file of rules
+    """
+    os.makedirs(directory, exist_ok=True)
+    store = SolutionStore(os.path.join(directory, "solutions")) if store is None else store
+    # variants that share their game graph run back to back
+    variants = sorted(dict.fromkeys(variants), key=lambda rules: (get_graph_rules(rules), rules))
+    paths = dict()
+    for i, rules in enumerate(variants):
+        path = os.path.join(directory, f"results_{get_rules_key(rules)}.txt")
+        paths[rules] = path
+        if resume and os.path.isfile(path):
+            print(f"Skipping {rules}, {path} already exists")
+            continue
+        print(f"Running variant {i + 1}/{len(variants)}: {rules}")
+        run_experiment(path=path, verbose=verbose, num_cores=num_cores, overwrite=True, store=store, rules=rules)
+
+    with open(os.path.join(directory, "summary.txt"), 'w') as file:
+        file.write(f"{', '.join(Rules._fields)}, player1_wins, player2_wins\n")
+        for rules, path in paths.items():
+            wins = read_win_counts(path)
+            file.write(f"{', '.join(str(value) for value in rules)}, {wins[1]}, {wins[2]}\n")
+    return paths
+
+
+def read_win_counts(path):
+    """
+    :param path: Path of a results file written by run_experiment
+    :return: A dict of the form wins[player] = number of matchups player wins
+    """
+    wins = {1: 0, 2: 0}
+    with open(path, 'r') as file:
+        for line in file:
+            wins[int(line.rsplit(",", 1)[1])] += 1
+    return wins
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the experiment over a grid of rule variants")
+    for field in Rules._fields:
+        parser.add_argument(f"--{field.replace('_', '-')}", type=int, nargs="+", default=None,
+                            help=f"Values of {field} (default "
+                                 f"{'derived' if field == 'max_coins' else getattr(DEFAULT_RULES, field)})")
+    parser.add_argument("--directory", default="../data/sweeps")
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--no-resume", action="store_true", help="Run variants whose results already exist again")
+    args = parser.parse_args()
+
+    variants = get_rule_variants(**{field: getattr(args, field) for field in Rules._fields})
+    run_sweep(variants, directory=args.directory, num_cores=args.cores, resume=not args.no_resume)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Rule parameters of the game that can be varied between experiments (see rule_sweep).
+"""
+from collections import namedtuple
+
+# most coins a player gains with one action (tax)
+MAX_COINS_GAINED = 3
+
+
+def get_max_coins(starting_coins, forced_coup_coins):
+    """
+    :return: The most coins a player can hold: a player below forced_coup_coins gains at most MAX_COINS_GAINED with one
+    action and a player at or above it can only coup, which costs coins
+    """
+    return max(starting_coins, forced_coup_coins - 1 + MAX_COINS_GAINED)
+
+
+class Rules(namedtuple("Rules", ["starting_coins", "max_coins", "forced_coup_coins", "coup_cost", "assassinate_cost"])):
+    """
+    starting_coins: coins each player starts the game with
+    max_coins: most coins a player can hold, transitions past it leave the state space
+    forced_coup_coins: a player holding at least this many coins can only coup
+    coup_cost: coins needed for a coup, they are paid when couping
+    assassinate_cost: coins needed to assassinate, as in the original model of the game they are not paid
+
+    Rules whose coin values do not fit together are rejected: max_coins has to cover every coin count a player can
+    reach (see get_max_coins), otherwise games leave the state space and some matchups have no winner, and a forced
+    coup has to be affordable.
+    """
+    __slots__ = ()
+
+    def __new__(cls, starting_coins, max_coins, forced_coup_coins, coup_cost, assassinate_cost):
+        rules = super().__new__(cls, starting_coins, max_coins, forced_coup_coins, coup_cost, assassinate_cost)
+        if max_coins < get_max_coins(starting_coins, forced_coup_coins):
+            raise Exception(f"{rules} lets players reach {get_max_coins(starting_coins, forced_coup_coins)} coins, "
+                            f"max_coins has to be at least that")
+        if coup_cost > forced_coup_coins:
+            raise Exception(f"{rules} forces players to coup before they can afford it, coup_cost has to be at most "
+                            f"forced_coup_coins")
+        return rules
+
+
+DEFAULT_RULES = Rules(starting_coins=2, max_coins=12, forced_coup_coins=10, coup_cost=7, assassinate_cost=3)
+
+
+def get_graph_rules(rules):
+    """
+    The full state space and its transitions do not depend on the start state, so rule variants that only differ in
+    starting_coins share their game graph (and its solution)
+    :return: rules with starting_coins replaced by the default
+    """
+    return rules._replace(starting_coins=DEFAULT_RULES.starting_coins)
+
+
+def get_rules_key(rules):
+    """
+    :return: A short string identifying rules, used in file names
+    """
+    return "-".join(str(value) for value in rules)
@@ -1,37 +1,44 @@
 import itertools
+import json
 import random
-import threading
 import concurrent.futures
 import os
+from collections import deque, namedtuple
 
 import constants
+import graph_export
+import solve_metrics
+import symmetry
 from coup_matchup_environment import CoupMatchupEnvironment
+from progress_journal import ProgressJournal
+from rules import DEFAULT_RULES, get_rules_key
+from solution_store import SolutionStore, get_rules_fingerprint
 
 
-def run_matchup(player1_cards, player2_cards, verbose=False):
-    matchup_env = CoupMatchupEnvironment(player1_cards, player2_cards)
-    matchup_env.solve(verbose=verbose)
+def run_matchup(player1_cards, player2_cards, verbose=False, store=None, rules=DEFAULT_RULES):
+    matchup_env = CoupMatchupEnvironment(player1_cards, player2_cards, compact=True, rules=rules)
+    matchup_env.solve(verbose=verbose, store=store)
     initial_state = matchup_env.get_start_game_state()
 
-    winner = None
-    if initial_state in matchup_env.get_win_region(1):
-        winner = 1
-    elif initial_state in matchup_env.get_win_region(2):
-        winner = 2
-
-    assert winner is not None, f"Error with {matchup_env}, no winner found."
+    if initial_state in matchup_env.get_draw_region():
+        raise Exception(f"Error with {player1_cards} vs {player2_cards}, neither player can force a win from the start "
+                        f"state.")
+    winner = 1 if initial_state in matchup_env.get_win_region(1) else 2
     return winner, matchup_env.get_policy(1), matchup_env.get_policy(2), matchup_env
 
 
-def get_game_run(matchup: CoupMatchupEnvironment, policy_1: dict, policy_2: dict):
+def get_game_run(matchup: CoupMatchupEnvironment, policy_1: dict = None, policy_2: dict = None):
     """
     Returns a list in the form (state, action, state, action...) representing a run of game matchup with the
     given policies.
-    :param policy_1: Policy for player 1
-    :param policy_2: Policy for player 2
+    :param policy_1: Policy for player 1, by default the optimal policy (see CoupMatchupEnvironment.get_optimal_policy)
+    so the run is the shortest win against the longest loss
+    :param policy_2: Policy for player 2, by default the optimal policy
     :param matchup: CoupMatchupEnvironment environment of the game
     :return:
     """
+    policy_1 = matchup.get_optimal_policy(1) if policy_1 is None else policy_1
+    policy_2 = matchup.get_optimal_policy(2) if policy_2 is None else policy_2
     run = list()
     state = matchup.get_start_game_state()
     run.append(state)
@@ -41,25 +48,66 @@ def get_game_run(matchup: CoupMatchupEnvironment, policy_1: dict, policy_2: dict
         action = policy_1[state] if turn == 1 else policy_2[state]
         # if action is None that means there is no action for player to win so a random action is selected
         if action is None:
-            action = random.choice(CoupMatchupEnvironment.get_enabled_actions(state))
-        new_state = CoupMatchupEnvironment.transition(state, action)
+            action = random.choice(matchup.get_enabled_actions(state, matchup.rules))
+        new_state = matchup.transition(state, action, matchup.rules)
         run.extend([action, new_state])
         print(state, action)
         state = new_state
     return run
 
 
-def get_run_graph(matchup: CoupMatchupEnvironment, pi1: dict, pi2: dict):
+def get_run_graph(matchup: CoupMatchupEnvironment, pi1: dict = None, pi2: dict = None, store=None, max_depth=None,
+                  max_nodes=None):
     """
     Returns a graph in the form graph[state] = list(successor_states) that shows a game run where the player who wins
-    takes their optimal action and the player who loses has all possible successor states listed
+    takes their optimal action and the player who loses has all possible successor states listed. If pi1 or pi2 are
+    not given the matchup's fastest win policies are used, solving it (or loading it from store) first if needed.
+    See iter_run_graph_edges for max_depth and max_nodes.
     """
     initial_state = matchup.get_start_game_state()
-    graph = dict()
-    _get_run_graph(initial_state, graph, matchup, pi1, pi2)
+    graph = {initial_state: list()}
+    for state, new_state in iter_run_graph_edges(matchup, pi1, pi2, store=store, max_depth=max_depth,
+                                                 max_nodes=max_nodes):
+        graph[state].append(new_state)
+        graph.setdefault(new_state, list())
     return graph
 
 
+def iter_run_graph_edges(matchup: CoupMatchupEnvironment, pi1: dict = None, pi2: dict = None, store=None,
+                         max_depth=None, max_nodes=None, include_actions=False):
+    """
+    Yields the edges (state, new_state) of the run graph (see get_run_graph) as they are found by a breadth first search
+    from the start state, so the graph never has to be held in memory. Every state is expanded at most once.
+    :param max_depth: States max_depth moves from the start state are not expanded
+    :param max_nodes: Once max_nodes states have been found no new states are expanded (edges into them are still
+    yielded)
+    :param include_actions: If True the edges are yielded as (state, action, new_state)
+    """
+    if not matchup.is_solved():
+        matchup.solve(store=store)
+    pi1 = matchup.get_fastest_win_policy(1) if pi1 is None else pi1
+    pi2 = matchup.get_fastest_win_policy(2) if pi2 is None else pi2
+    goal_states = matchup.get_goal_states(1) | matchup.get_goal_states(2)
+    initial_state = matchup.get_start_game_state()
+    # depths[state] = number of moves from the start state, also the index of visited states
+    depths = {initial_state: 0}
+    queue = deque([initial_state])
+    while queue:
+        state = queue.popleft()
+        if state in goal_states or (max_depth is not None and depths[state] >= max_depth):
+            continue
+        turn = state[2]
+        action = pi1[state] if turn == 1 else pi2[state]
+        # if action is None that means there is no action for player to win, so we look at all their possible actions
+        actions = matchup.get_enabled_actions(state, matchup.rules) if action is None else [action]
+        for action in actions:
+            new_state = matchup.transition(state, action, matchup.rules)
+            yield (state, action, new_state) if include_actions else (state, new_state)
+            if new_state not in depths and (max_nodes is None or len(depths) < max_nodes):
+                depths[new_state] = depths[state] + 1
+                queue.append(new_state)
+
+
 def save_run_graph(path: str, graph):
     with open(path, 'w') as file:
         file.write(f"source,target\n")
@@ -68,29 +116,26 @@ def save_run_graph(path: str, graph):
                 file.write(f"{str(source).replace(',', '.')},{str(target).replace(',', '.')}\n")
 
 
-def _get_run_graph(initial_state, graph: dict, matchup: CoupMatchupEnvironment, pi1: dict, pi2: dict):
+def stream_run_graph(path: str, matchup: CoupMatchupEnvironment, pi1: dict = None, pi2: dict = None, store=None,
+                     max_depth=None, max_nodes=None):
     """
-    Utility function -- see get_run_graph
+    Writes the run graph of matchup (see get_run_graph) to path in the format of save_run_graph, edge by edge as the
+    edges are found
     """
-    state = initial_state
-    graph[state] = list()
-    if state in matchup.get_goal_states(1) or state in matchup.get_goal_states(2):
-        return
-    else:
-        turn = state[2]
-        action = pi1[state] if turn == 1 else pi2[state]
-        # if action is None that means there is no action for player to win, so we look at all their possible actions
-        if action is None:
-            for action in CoupMatchupEnvironment.get_enabled_actions(state):
-                new_state = CoupMatchupEnvironment.transition(state, action)
-                graph[state].append(new_state)
-                if new_state not in graph.keys():
-                    _get_run_graph(new_state, graph, matchup, pi1, pi2)
-        else:
-            new_state = CoupMatchupEnvironment.transition(state, action)
-            graph[state].append(new_state)
-            _get_run_graph(new_state, graph, matchup, pi1, pi2)
-    return
+    with open(path, 'w') as file:
+        file.write(f"source,target\n")
+        for source, target in iter_run_graph_edges(matchup, pi1, pi2, store=store, max_depth=max_depth,
+                                                   max_nodes=max_nodes):
+            file.write(f"{str(source).replace(',', '.')},{str(target).replace(',', '.')}\n")
+
+
+def save_run_graph_npz(path: str, matchup: CoupMatchupEnvironment, pi1: dict = None, pi2: dict = None, store=None,
+                       max_depth=None, max_nodes=None):
+    """
+    Writes the run graph of matchup (see get_run_graph) with action labels to a binary file, see graph_export
+    """
+    graph_export.save_edges_npz(path, matchup, iter_run_graph_edges(matchup, pi1, pi2, store=store, max_depth=max_depth,
+                                                                    max_nodes=max_nodes, include_actions=True))
 
 
 def get_next_states(matchup: CoupMatchupEnvironment, state, pi):
@@ -99,73 +144,258 @@ def get_next_states(matchup: CoupMatchupEnvironment, state, pi):
     otherwise returns a list of all states that can result from any enabled action.
     """
     if pi[state] is not None:
-        return [matchup.transition(state, pi[state])]
+        return [matchup.transition(state, pi[state], matchup.rules)]
     else:
-        return [matchup.transition(state, action) for action in matchup.get_enabled_actions(state)]
+        return [matchup.transition(state, action, matchup.rules)
+                for action in matchup.get_enabled_actions(state, matchup.rules)]
+
+
+# The result of one matchup, small enough to send back from a worker process cheaply
+MatchupResult = namedtuple("MatchupResult", ["player1_cards", "player2_cards", "winner"])
+
 
+def format_result(result: MatchupResult):
+    return f"{result.player1_cards}, {result.player2_cards}, {result.winner}"
 
-def write_to_file(result, file, lock):
+
+class OrderedResultWriter:
     """
-    Write to a file in a thread safe way
+    Streams results to a file in a fixed matchup order. Results that arrive before all earlier matchups are done are
+    buffered and written as soon as the gap is filled, so the output is the same whatever order workers finish in.
     """
-    lock.acquire()
-    try:
-        file.write(f"{result}\n")
-    finally:
-        lock.release()
 
+    def __init__(self, file, matchups):
+        """
+        :param file: An open file to write results to
+        :param matchups: A list of (player1_cards, player2_cards) matchups in the order they should be written
+        """
+        self.file = file
+        self.matchups = list(matchups)
+        self._next_index = 0
+        self._pending = dict()
+
+    def add(self, result: MatchupResult):
+        self._pending[(result.player1_cards, result.player2_cards)] = result
+        while self._next_index < len(self.matchups) and self.matchups[self._next_index] in self._pending:
+            self.file.write(f"{format_result(self._pending.pop(self.matchups[self._next_index]))}\n")
+            self._next_index += 1
+        self.file.flush()
+
+    def get_written_count(self):
+        """
+        :return: The number of results written so far
+        """
+        return self._next_index
+
+    def is_complete(self):
+        """
+        :return: Whether the results of all matchups have been written
+        """
+        return self._next_index == len(self.matchups)
 
-def run_experiment(path="../data/results.txt", verbose=False, num_cores=1, overwrite=False):
+
+def run_experiment(path="../data/results.txt", verbose=False, num_cores=1, overwrite=False, store=None,
+                   chunk_size=None, resume=True, hooks=None, metrics_path=None, rules=DEFAULT_RULES,
+                   trace_memory=False):
     """
     Evaluate all possible matchups and write the results to the file specified by path
+
+    Every solved matchup is first appended to a journal next to path (path + ".journal"). If the run is interrupted,
+    calling this function again skips the matchups already in the journal and only solves the rest. Once every matchup
+    is solved the journal is compacted into the results file in canonical matchup order and removed.
     :param path: Path of file to write results to
     :param verbose: Boolean value indicating whether to print matchup debug info
     :param num_cores: Number of cores to use for parallel processing
     :param overwrite: Whether to overwrite the file at path if it already exists
+    :param store: An optional SolutionStore, matchups already in the store are loaded instead of solved. Workers write
+    new solutions to the store themselves and only send small MatchupResults back
+    :param chunk_size: Number of canonical matchups each worker task solves (by default about 4 tasks per worker)
+    :param resume: Whether to continue from an existing journal, if False the journal is discarded and every matchup is
+    solved again
+    :param hooks: Callables called with the "solve" event of every canonical matchup as soon as it is solved, the same
+    event solve(hooks=) ends with (see solve_metrics). Phase events are not passed on, workers cannot call the hooks
+    of this process
+    :param metrics_path: Optional path to write the summary of the solve metrics of all matchups to as JSON
+    :param rules: The Rules every matchup is played with
+    :param trace_memory: Whether every solve traces memory with tracemalloc, in the worker that runs it, so the metrics
+    hold per-phase peaks and the peak of the solve itself (see CoupMatchupEnvironment.solve)
+    :return: The summary of the solve metrics of all canonical matchups (see solve_metrics.summarize)
     """
     if os.path.isfile(path) and overwrite is False:
         raise Exception(
             f"File {path} already exists, if you wish to overwrite it call this function with overwrite=True")
     if num_cores < 1:
         raise Exception(f"Error, value of {num_cores} for num_cores not allowed")
-    # Compute combinations of cards since (DUKE,CAPTAIN) is the same as (CAPTAIN,DUKE)
-    card_pairs = list(itertools.combinations(constants.CARDS, 2))
-    # Add duplicate pairs (CAPTAIN, CAPTAIN), (DUKE,DUKE), etc.
-    card_pairs.extend([(card, card) for card in constants.CARDS])
-    matchups = list(itertools.product(card_pairs, card_pairs))
+    matchups = get_matchups()
+
+    journal = ProgressJournal(f"{path}.journal")
+    if not resume:
+        journal.remove()
+    rules_fingerprint = f"{get_rules_fingerprint(CoupMatchupEnvironment)}_{get_rules_key(rules)}"
+    if not journal.exists():
+        journal.append([{"rules_fingerprint": rules_fingerprint}])
+    results, metrics = read_journal(journal, rules_fingerprint)
+    hooks = list(hooks) if hooks is not None else list()
+    completed = {(result.player1_cards, result.player2_cards) for result in results}
+    if completed:
+        print(f"Resuming from {journal.path} with {len(completed)}/{len(matchups)} matchups already solved")
+
+    # only one matchup of every group of equivalent matchups is solved (see symmetry)
+    groups = [(canonical_matchup, members) for canonical_matchup, members in get_matchup_groups(matchups).items()
+              if not completed.issuperset(members)]
     i = 0
     if num_cores == 1:
-        with open(path, "w") as file:
-            for matchup in matchups:
-                winner, _, _, _ = run_matchup(matchup[0], matchup[1], verbose=verbose)
-                file.write(f"{matchup[0]},{matchup[1]},{winner}\n")
-                print(f"Solved {i + 1}/{len(matchups)} matchups")
-                i += 1
-    else:
+        for canonical_matchup, members in groups:
+            group_results, group_metrics = solve_matchup_group(canonical_matchup, members, verbose=verbose, store=store,
+                                                               rules=rules, trace_memory=trace_memory)
+            _add_results(journal, results, metrics, group_results, [group_metrics], hooks)
+            print(f"Solved {i + 1}/{len(groups)} canonical matchups")
+            i += 1
+    elif groups:
         max_workers = os.cpu_count() if num_cores > os.cpu_count() else num_cores
+        if chunk_size is None:
+            chunk_size = max(1, len(groups) // (max_workers * 4))
+        chunks = [groups[start:start + chunk_size] for start in range(0, len(groups), chunk_size)]
         with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-            with open(path, 'w') as file:
-                lock = threading.Lock()
-                future_results = [executor.submit(run_matchup, matchup[0], matchup[1], verbose=verbose)
-                                  for matchup in matchups]
+            # future_results[future] = number of canonical matchups solved by the task
+            future_results = {executor.submit(solve_matchup_chunk, chunk, verbose=verbose, store=store,
+                                              rules=rules, trace_memory=trace_memory): len(chunk)
+                              for chunk in chunks}
+            for future in concurrent.futures.as_completed(future_results):
+                chunk_results, chunk_metrics = future.result()
+                _add_results(journal, results, metrics, chunk_results, chunk_metrics, hooks)
+                i += future_results[future]
+                print(f"Solved {i}/{len(groups)} canonical matchups")
+
+    compact_results(path, matchups, results)
+    journal.remove()
+
+    summary = solve_metrics.summarize(metrics)
+    print(f"Solved {summary['num_solves']} canonical matchups in {summary['total_seconds']:.1f}s ("
+          + ", ".join(f"{name} {phase['share']:.0%}" for name, phase in summary["phases"].items()) + ")")
+    if metrics_path is not None:
+        with open(metrics_path, 'w') as file:
+            json.dump(summary, file, indent=2)
+    return summary
+
+
+def get_matchups():
+    """
+    :return: A list of every (player1_cards, player2_cards) matchup in the order results are written
+    """
+    # Compute combinations of cards since (DUKE,CAPTAIN) is the same as (CAPTAIN,DUKE)
+    card_pairs = list(itertools.combinations(constants.CARDS, 2))
+    # Add duplicate pairs (CAPTAIN, CAPTAIN), (DUKE,DUKE), etc.
+    card_pairs.extend([(card, card) for card in constants.CARDS])
+    return list(itertools.product(card_pairs, card_pairs))
+
+
+def _add_results(journal, results, metrics, new_results, new_metrics, hooks):
+    """
+    Records newly solved matchups in the journal before adding them to results and metrics
+    """
+    journal.append([result._asdict() for result in new_results] + [{"metrics": record} for record in new_metrics])
+    results.extend(new_results)
+    metrics.extend(new_metrics)
+    for record in new_metrics:
+        for hook in hooks:
+            hook(dict(event="solve", **record))
+
+
+def read_journal(journal: ProgressJournal, rules_fingerprint):
+    """
+    :param rules_fingerprint: Fingerprint of the current rules (see solution_store.get_rules_fingerprint)
+    :return: A list of the MatchupResults and a list of the solve metrics dicts recorded in journal
+    """
+    results = list()
+    metrics = list()
+    for record in journal.read():
+        if "rules_fingerprint" in record:
+            if record["rules_fingerprint"] != rules_fingerprint:
+                raise Exception(f"Journal {journal.path} was written with different rules, call run_experiment with "
+                                f"resume=False to start over")
+            continue
+        if "metrics" in record:
+            metrics.append(record["metrics"])
+            continue
+        results.append(MatchupResult(tuple(record["player1_cards"]), tuple(record["player2_cards"]), record["winner"]))
+    return results, metrics
+
 
-                i = 0
-                for future in concurrent.futures.as_completed(future_results):
-                    winner, _, _, matchup = future.result()
-                    result = f"{matchup.player1_cards}, {matchup.player2_cards}, {winner}"
-                    write_to_file(result, file, lock)
-                    print(f"Solved {i + 1}/{len(matchups)} matchups")
-                    i += 1
+def compact_results(path, matchups, results):
+    """
+    Atomically writes results to path in the order of matchups
+    :param matchups: A list of (player1_cards, player2_cards) matchups in the order they should be written
+    :param results: A list of MatchupResults containing every matchup (duplicates are ignored)
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as file:
+        writer = OrderedResultWriter(file, matchups)
+        for result in results:
+            writer.add(result)
+        if not writer.is_complete():
+            raise Exception(f"Cannot write {path}, only {writer.get_written_count()}/{len(matchups)} matchups are "
+                            f"solved")
+    os.replace(temporary_path, path)
+
+
+def get_matchup_groups(matchups):
+    """
+    :param matchups: A list of (player1_cards, player2_cards) matchups
+    :return: A dict of the form groups[canonical_matchup] = list of matchups equivalent to canonical_matchup
+    """
+    groups = dict()
+    for matchup in matchups:
+        canonical_matchup = symmetry.canonicalize_matchup(*matchup)[:2]
+        groups.setdefault(canonical_matchup, list()).append(matchup)
+    return groups
+
+
+def solve_matchup_group(canonical_matchup, matchups, verbose=False, store=None, rules=DEFAULT_RULES,
+                        trace_memory=False):
+    """
+    Solves canonical_matchup once and maps its solution onto every equivalent matchup
+    :param canonical_matchup: A canonical (player1_cards, player2_cards) matchup (see symmetry.canonicalize_matchup)
+    :param matchups: The matchups equivalent to canonical_matchup
+    :return: A list with a MatchupResult for every matchup and the solve metrics of canonical_matchup as a dict
+    """
+    matchup_env = CoupMatchupEnvironment(canonical_matchup[0], canonical_matchup[1], compact=True, rules=rules)
+    metrics = matchup_env.solve(verbose=verbose, store=store, trace_memory=trace_memory)
+    results = list()
+    for matchup in matchups:
+        winner = symmetry.get_matchup_winner(matchup_env, matchup[0], matchup[1])
+        if winner is None:
+            raise Exception(f"Error with {matchup[0]} vs {matchup[1]}, neither player can force a win from the start "
+                            f"state.")
+        results.append(MatchupResult(matchup[0], matchup[1], winner))
+    return results, metrics.to_dict()
+
+
+def solve_matchup_chunk(groups, verbose=False, store=None, rules=DEFAULT_RULES, trace_memory=False):
+    """
+    Worker task of run_experiment -- solves a chunk of matchup groups (see solve_matchup_group)
+    :param groups: A list of (canonical_matchup, matchups) pairs
+    :return: A list with a MatchupResult for every matchup in the chunk and a list of the solve metrics dicts of the
+    canonical matchups
+    """
+    results = list()
+    metrics = list()
+    for canonical_matchup, matchups in groups:
+        group_results, group_metrics = solve_matchup_group(canonical_matchup, matchups, verbose=verbose, store=store,
+                                                           rules=rules, trace_memory=trace_memory)
+        results.extend(group_results)
+        metrics.append(group_metrics)
+    return results, metrics
 
 
 def main():
-    # run_experiment(verbose=False, num_cores=1)
+    store = SolutionStore()
+    # run_experiment(verbose=False, num_cores=1, store=store)
     matchup = CoupMatchupEnvironment((constants.DUKE, constants.ASSASSIN), (constants.AMBASSADOR, constants.AMBASSADOR))
-    matchup.solve(verbose=True)
+    matchup.solve(verbose=True, store=store)
     matchup.save_game_graph_edge_list(path="../data/DAvAMAM_full_graph.csv")
-    graph = get_run_graph(matchup, pi1=matchup.get_policy(1), pi2=matchup.get_policy(2))
-    save_run_graph(path="../data/DAvAMAM_all_runs.csv", graph=graph)
-    matchup.play_game(save_run=True, path="../data/DAvAMAM_run.txt")
+    stream_run_graph(path="../data/DAvAMAM_all_runs.csv", matchup=matchup, store=store)
+    matchup.play_game(save_run=True, path="../data/DAvAMAM_run.txt", store=store)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+"""
+Runs the matchups of run_experiment on any number of worker processes and hosts that share a filesystem.
+
+The canonical matchup groups of every rule variant are split into shards that are the tasks of a WorkQueue (see
+work_queue). Workers claim shards through lease files, solve them with solve_matchup_chunk and commit the results to the
+queue, so workers can be started and killed at any time: the shards of a dead worker are reclaimed once its lease
+expires. When every shard is done, merge writes one results file per rule variant in the format of run_experiment.
+
+    python sharded_experiment.py init ../data/queue --starting-coins 2 3
+    python sharded_experiment.py work ../data/queue --store ../data/solutions    (on every host, once per core)
+    python sharded_experiment.py merge ../data/queue --output ../data/sweeps
+"""
+import argparse
+import json
+import os
+import time
+
+import solve_metrics
+from coup_matchup_environment import CoupMatchupEnvironment
+from rule_sweep import get_rule_variants
+from rules import DEFAULT_RULES, Rules, get_rules_key
+from run_experiment import MatchupResult, compact_results, get_matchup_groups, get_matchups, solve_matchup_chunk
+from solution_store import SolutionStore, get_rules_fingerprint
+from work_queue import WorkQueue, get_worker_id
+
+MANIFEST = "manifest.json"
+
+
+def init_queue(directory, variants=(DEFAULT_RULES,), shard_size=4, lease_seconds=600):
+    """
+    Creates the work queue of every rule variant. Calling it again on an existing queue adds missing shards only
+    :param variants: A list of Rules
+    :param shard_size: Number of canonical matchup groups (see run_experiment.get_matchup_groups) per shard
+    :param lease_seconds: Seconds without a heartbeat after which a worker's shard is given to another worker
+    :return: The WorkQueue
+    """
+    manifest = {"rules_fingerprint": get_rules_fingerprint(CoupMatchupEnvironment), "lease_seconds": lease_seconds,
+                "shard_size": shard_size, "variants": [list(rules) for rules in dict.fromkeys(variants)]}
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, 'r') as file:
+            existing_manifest = json.load(file)
+        if existing_manifest != manifest:
+            # other shard sizes give other shards, which would queue the same groups twice
+            raise Exception(f"Queue {directory} was created with different rules, variants, shard size or lease "
+                            f"seconds, use a new directory")
+
+    groups = list(get_matchup_groups(get_matchups()).items())
+    tasks = dict()
+    for rules in dict.fromkeys(variants):
+        for shard, start in enumerate(range(0, len(groups), shard_size)):
+            tasks[f"{get_rules_key(rules)}_{shard:04d}"] = {"rules": list(rules),
+                                                            "groups": groups[start:start + shard_size]}
+    queue = WorkQueue(directory, lease_seconds=lease_seconds)
+    queue.add_tasks(tasks)
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return queue
+
+
+def open_queue(directory, check_rules=True):
+    """
+    :param check_rules: Whether to fail if the rules implementation changed since the queue was created
+    :return: The WorkQueue in directory and its manifest
+    """
+    manifest_path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(manifest_path):
+        raise Exception(f"No queue in {directory}, create it with init_queue first")
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    if check_rules and manifest["rules_fingerprint"] != get_rules_fingerprint(CoupMatchupEnvironment):
+        raise Exception(f"Queue {directory} was created with a different implementation of the rules")
+    return WorkQueue(directory, lease_seconds=manifest["lease_seconds"]), manifest
+
+
+def run_worker(directory, store=None, worker_id=None, max_tasks=None, poll_seconds=30, verbose=False):
+    """
+    Claims and solves shards until every shard of the queue is done
+    :param store: An optional SolutionStore, a store on the shared filesystem lets workers reuse each other's solutions
+    :param worker_id: Id of the worker in lease files (by default host name and process id)
+    :param max_tasks: Maximum number of shards to solve before returning
+    :param poll_seconds: Seconds to wait before looking for expired leases when every remaining shard is leased
+    :return: The number of shards this worker solved
+    """
+    queue, _ = open_queue(directory)
+    worker_id = get_worker_id() if worker_id is None else worker_id
+    solved = 0
+    while max_tasks is None or solved < max_tasks:
+        lease = queue.claim(worker_id)
+        if lease is None:
+            if not queue.get_pending_task_ids():
+                break
+            # the remaining shards are leased by other workers, one of them may still die and leave its shard behind
+            time.sleep(poll_seconds)
+            continue
+        task = queue.get_task(lease.task_id)
+        groups = [(_to_matchup(canonical_matchup), [_to_matchup(matchup) for matchup in matchups])
+                  for canonical_matchup, matchups in task["groups"]]
+        with lease:
+            results, metrics = solve_matchup_chunk(groups, verbose=verbose, store=store, rules=Rules(*task["rules"]))
+        queue.complete(lease, {"worker_id": worker_id, "results": [result._asdict() for result in results],
+                               "metrics": metrics})
+        solved += 1
+        print(f"{worker_id} solved shard {lease.task_id}")
+    return solved
+
+
+def merge(directory, output_directory=None):
+    """
+    Writes the results of every rule variant of a finished queue to output_directory/results_<rules key>.txt and the
+    summary of their solve metrics to output_directory/metrics_<rules key>.json
+    :param output_directory: Directory to write to, the queue directory by default
+    :return: A dict of the form paths[rules] = path of the results file of rules
+    """
+    queue, manifest = open_queue(directory, check_rules=False)
+    pending = queue.get_pending_task_ids()
+    if pending:
+        raise Exception(f"Cannot merge {directory}, {len(pending)} shards are not done yet (e.g. {pending[0]})")
+    output_directory = directory if output_directory is None else output_directory
+    os.makedirs(output_directory, exist_ok=True)
+
+    variants = [Rules(*values) for values in manifest["variants"]]
+    results = {rules: list() for rules in variants}
+    metrics = {rules: list() for rules in variants}
+    for task_id in queue.get_task_ids():
+        rules = Rules(*queue.get_task(task_id)["rules"])
+        result = queue.get_result(task_id)
+        results[rules].extend(MatchupResult(tuple(record["player1_cards"]), tuple(record["player2_cards"]),
+                                            record["winner"]) for record in result["results"])
+        metrics[rules].extend(result["metrics"])
+
+    matchups = get_matchups()
+    paths = dict()
+    for rules in variants:
+        rules_key = get_rules_key(rules)
+        paths[rules] = os.path.join(output_directory, f"results_{rules_key}.txt")
+        compact_results(paths[rules], matchups, results[rules])
+        with open(os.path.join(output_directory, f"metrics_{rules_key}.json"), 'w') as file:
+            json.dump(solve_metrics.summarize(metrics[rules]), file, indent=2)
+    return paths
+
+
+def _to_matchup(matchup):
+    # JSON turns the card tuples into lists
+    return tuple(matchup[0]), tuple(matchup[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the experiment on several hosts through a shared work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = commands.add_parser("init", help="Create the work queue")
+    init_parser.add_argument("directory")
+    for field in Rules._fields:
+        init_parser.add_argument(f"--{field.replace('_', '-')}", type=int, nargs="+", default=None,
+                                 help=f"Values of {field} (default "
+                                      f"{'derived' if field == 'max_coins' else getattr(DEFAULT_RULES, field)})")
+    init_parser.add_argument("--shard-size", type=int, default=4, help="Canonical matchups per shard")
+    init_parser.add_argument("--lease-seconds", type=int, default=600,
+                             help="Seconds without a heartbeat after which a shard is given to another worker")
+
+    work_parser = commands.add_parser("work", help="Solve shards until the queue is done")
+    work_parser.add_argument("directory")
+    work_parser.add_argument("--store", default=None, help="Directory of a SolutionStore")
+    work_parser.add_argument("--max-tasks", type=int, default=None)
+    work_parser.add_argument("--poll-seconds", type=float, default=30)
+    work_parser.add_argument("--verbose", action="store_true")
+
+    merge_parser = commands.add_parser("merge", help="Write the results of a finished queue")
+    merge_parser.add_argument("directory")
+    merge_parser.add_argument("--output", default=None, help="Directory to write the results to")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        variants = get_rule_variants(**{field: getattr(args, field) for field in Rules._fields})
+        queue = init_queue(args.directory, variants, shard_size=args.shard_size, lease_seconds=args.lease_seconds)
+        print(f"Created {len(queue.get_task_ids())} shards in {args.directory}")
+    elif args.command == "work":
+        store = SolutionStore(args.store) if args.store is not None else None
+        run_worker(args.directory, store=store, max_tasks=args.max_tasks, poll_seconds=args.poll_seconds,
+                   verbose=args.verbose)
+    else:
+        for rules, path in merge(args.directory, args.output).items():
+            print(f"Wrote results of {rules} to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Vectorized Monte-Carlo simulation of many games of a matchup at once.
+
+Every game is one entry of a NumPy array of state ids and all games take their next step together over the compact
+transition table of the matchup. A player moving from their winning region follows the stored (fastest win) policy and
+every other move is drawn from the loser policy, so the winner plays optimally while the loser (or both players in the
+draw region) plays a configurable stochastic policy:
+
+    "uniform"       every enabled action is equally likely (the random choice of get_game_run)
+    "slowest_loss"  the deterministic slowest loss policy (see CoupMatchupEnvironment.get_slowest_loss_policy)
+    {action: w}     every enabled action is drawn with probability proportional to its weight (actions that are not
+                    given get weight 1), e.g. {constants.INCOME: 0} for a loser that never takes income
+"""
+import argparse
+import json
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import constants
+from coup_matchup_environment import CoupMatchupEnvironment
+from csr_solver import CSRGraph, require_numpy
+
+LOSER_POLICIES = ("uniform", "slowest_loss")
+
+
+class SimulationResult:
+    """
+    Distributions collected over the simulated games
+    """
+
+    def __init__(self, environment, num_games, lengths, winners, action_counts, state_visits):
+        """
+        :param environment: The simulated CoupMatchupEnvironment
+        :param lengths: lengths[n] = number of games that ended after n moves
+        :param winners: winners[player] = number of games player won, winners[0] = games that did not end within the
+        step limit or left the state space
+        :param action_counts: action_counts[player - 1, action_id] = number of times player took action action_id
+        :param state_visits: state_visits[state_id] = number of times a game was in the state
+        """
+        self.environment = environment
+        self.num_games = num_games
+        self.lengths = lengths
+        self.winners = winners
+        self.action_counts = action_counts
+        self.state_visits = state_visits
+
+    def get_mean_length(self):
+        finished = self.lengths.sum()
+        return float(np.dot(np.arange(len(self.lengths)), self.lengths) / finished) if finished else None
+
+    def get_length_percentile(self, percentile):
+        """
+        :param percentile: A percentile between 0 and 100
+        :return: The game length at percentile over the finished games
+        """
+        cumulative = np.cumsum(self.lengths)
+        if len(cumulative) == 0:
+            return None
+        return int(np.searchsorted(cumulative, cumulative[-1] * percentile / 100))
+
+    def get_action_frequencies(self, player):
+        """
+        :return: A dict of the form frequencies[action] = share of player's moves that took action
+        """
+        counts = self.action_counts[player - 1]
+        total = counts.sum()
+        return {action: float(count / total) if total else 0.0
+                for action, count in zip(self.environment.actions, counts)}
+
+    def get_most_visited_states(self, top=10):
+        """
+        :return: A list of (state, number of visits) of the top most visited states
+        """
+        state_ids = np.argsort(self.state_visits, kind="stable")[::-1][:top]
+        table = self.environment._get_table()
+        return [(table.states[state_id], int(self.state_visits[state_id])) for state_id in state_ids]
+
+    def to_dict(self, top=10):
+        """
+        :return: The distributions as a JSON serializable dict
+        """
+        return {"player1_cards": list(self.environment.player1_cards),
+                "player2_cards": list(self.environment.player2_cards), "num_games": self.num_games,
+                "wins": {str(player): int(self.winners[player]) for player in (1, 2)},
+                "unfinished": int(self.winners[0]), "mean_length": self.get_mean_length(),
+                "lengths": self.lengths.tolist(),
+                "action_frequencies": {str(player): self.get_action_frequencies(player) for player in (1, 2)},
+                "num_states_visited": int(np.count_nonzero(self.state_visits)),
+                "most_visited_states": [[list(map(str, state)), visits]
+                                        for state, visits in self.get_most_visited_states(top)]}
+
+
+def simulate(environment, num_games, loser_policy="uniform", max_steps=1000, batch_size=1 << 20, seed=None,
+             store=None):
+    """
+    Simulates num_games games of environment from its start state
+    :param environment: A CoupMatchupEnvironment, solved first (or loaded from store) if needed
+    :param loser_policy: The policy of moves outside the mover's winning region, see the module docstring
+    :param max_steps: Games that have not ended after max_steps moves are stopped and counted as unfinished
+    :param batch_size: Maximum number of games stepped at once, bounds the memory of the simulation
+    :param seed: Seed of the random number generator
+    :return: A SimulationResult
+    """
+    require_numpy("The simulator")
+    if not environment.is_solved():
+        environment.solve(store=store)
+    environment._ensure_game_built()
+    table = environment._get_table()
+    num_states = table.num_states
+    num_actions = table.num_actions
+    graph = CSRGraph.from_table(table)
+    # targets[state_id, action_id] with every state outside the state space mapped to the sink num_states
+    targets = np.frombuffer(table.targets, dtype=np.int32).reshape(num_states, num_actions)
+    targets = np.where(targets < num_states, targets, num_states)
+    # win_codes[player - 1, state_id] = player's policy action, -1 outside player's winning region. The extra column
+    # is the sink which has no policy
+    win_codes = np.full((2, num_states + 1), -1, dtype=np.int8)
+    for player in (1, 2):
+        win_codes[player - 1, :num_states] = environment._policy_codes[player - 1]
+    loser_codes = _get_loser_codes(environment, loser_policy, num_states)
+    cumulative_weights = _get_cumulative_weights(environment, graph, loser_policy)
+    terminal_winners = _get_terminal_winners(table)
+    turns = np.append(graph.turns, 0)
+
+    rng = np.random.default_rng(seed)
+    start_state_id = environment.get_state_id(environment.get_start_game_state())
+    lengths = np.zeros(max_steps + 1, dtype=np.int64)
+    winners = np.zeros(3, dtype=np.int64)
+    action_counts = np.zeros((2, num_actions), dtype=np.int64)
+    state_visits = np.zeros(num_states + 1, dtype=np.int64)
+    for start in range(0, num_games, batch_size):
+        states = np.full(min(batch_size, num_games - start), start_state_id, dtype=np.int32)
+        for step in range(max_steps + 1):
+            state_visits += np.bincount(states, minlength=num_states + 1)
+            ended = terminal_winners[states] >= 0
+            if ended.any():
+                lengths[step] += np.count_nonzero(ended)
+                winners += np.bincount(terminal_winners[states[ended]], minlength=3)
+                states = states[~ended]
+            if len(states) == 0 or step == max_steps:
+                break
+            movers = turns[states].astype(np.int64)
+            action_ids = win_codes[movers - 1, states]
+            losing = action_ids == -1
+            if loser_codes is not None:
+                action_ids[losing] = loser_codes[states[losing]]
+                losing = action_ids == -1
+            if losing.any():
+                action_ids[losing] = _sample_actions(graph, cumulative_weights, states[losing], rng)
+            action_counts += np.bincount((movers - 1) * num_actions + action_ids.astype(np.int64),
+                                         minlength=2 * num_actions).reshape(2, num_actions)
+            states = targets[states, action_ids]
+        # games still running after max_steps are unfinished
+        winners[0] += len(states)
+    return SimulationResult(environment, num_games, np.trim_zeros(lengths, 'b'), winners, action_counts,
+                            state_visits[:num_states])
+
+
+def _get_loser_codes(environment, loser_policy, num_states):
+    """
+    :return: loser_codes[state_id] = action code of a deterministic loser policy (-1 where it has none, with the sink
+    as the last entry) or None for stochastic loser policies
+    """
+    if loser_policy != "slowest_loss":
+        return None
+    loser_codes = np.full(num_states + 1, -1, dtype=np.int8)
+    for player in (1, 2):
+        environment.get_slowest_loss_policy(player)
+        player_codes = np.frombuffer(environment._slowest_loss_codes[player], dtype=np.int8)
+        loser_codes[:num_states] = np.where(player_codes != -1, player_codes, loser_codes[:num_states])
+    return loser_codes
+
+
+def _get_cumulative_weights(environment, graph, loser_policy):
+    """
+    :return: The running sum of the weights of all edges of graph in edge order, edges of states whose actions all
+    have weight 0 get weight 1 so every state can be left
+    """
+    if isinstance(loser_policy, str):
+        if loser_policy not in LOSER_POLICIES:
+            raise Exception(f"Unknown loser policy {loser_policy}, choose from {LOSER_POLICIES} or give action weights")
+        weights = np.ones(len(graph.indices), dtype=np.float64)
+    else:
+        action_weights = np.array([loser_policy.get(action, 1.0) for action in environment.actions], dtype=np.float64)
+        if (action_weights < 0).any():
+            raise Exception("Action weights of the loser policy must not be negative")
+        weights = action_weights[graph.edge_actions]
+        state_weights = np.add.reduceat(weights, graph.indptr[:-1]) if len(weights) else weights
+        # reduceat returns the weight of the next edge for states without edges, only states with edges matter
+        zero_states = np.flatnonzero((state_weights == 0) & (np.diff(graph.indptr) > 0))
+        weights[np.isin(graph.edge_sources, zero_states)] = 1.0
+    return np.concatenate(([0.0], np.cumsum(weights)))
+
+
+def _sample_actions(graph, cumulative_weights, states, rng):
+    """
+    :return: The action code of one enabled action of every state drawn with probability proportional to its weight
+    """
+    low = cumulative_weights[graph.indptr[states]]
+    high = cumulative_weights[graph.indptr[states + 1]]
+    edges = np.searchsorted(cumulative_weights, low + rng.random(len(states)) * (high - low), side='right') - 1
+    # guard against rounding past the last edge of a state
+    edges = np.clip(edges, graph.indptr[states], graph.indptr[states + 1] - 1)
+    return graph.edge_actions[edges]
+
+
+def _get_terminal_winners(table):
+    """
+    :return: terminal_winners[state_id] = the player who won the game in the state, 0 for the sink (states outside the
+    state space) and -1 for states the game continues from
+    """
+    terminal_winners = np.full(table.num_states + 1, -1, dtype=np.int8)
+    for state_id, state in enumerate(table.states[:table.num_states]):
+        for player, opponent_state in ((1, state[1]), (2, state[0])):
+            if opponent_state[0] == constants.DEAD and opponent_state[1] == constants.DEAD:
+                terminal_winners[state_id] = player
+    terminal_winners[table.num_states] = 0
+    return terminal_winners
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many games of a matchup")
+    parser.add_argument("--player1", nargs=2, required=True, choices=constants.CARDS, help="Cards of player 1")
+    parser.add_argument("--player2", nargs=2, required=True, choices=constants.CARDS, help="Cards of player 2")
+    parser.add_argument("--games", type=int, default=1000000, help="Number of games to simulate")
+    parser.add_argument("--loser-policy", default="uniform", choices=LOSER_POLICIES)
+    parser.add_argument("--max-steps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Path of the JSON file to write the distributions to")
+    args = parser.parse_args()
+
+    environment = CoupMatchupEnvironment(tuple(args.player1), tuple(args.player2), compact=True)
+    result = simulate(environment, args.games, loser_policy=args.loser_policy, max_steps=args.max_steps,
+                      seed=args.seed)
+    print(f"{args.games} games, wins {result.winners[1]}/{result.winners[2]}, unfinished {result.winners[0]}, "
+          f"mean length {result.get_mean_length()}")
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(result.to_dict(), file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
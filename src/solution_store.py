@@ -0,0 +1,171 @@
+import hashlib
+import inspect
+import os
+import struct
+from array import array
+
+import constants
+from rules import get_graph_rules, get_rules_key
+
+# magic, number of states, number of actions
+HEADER = struct.Struct("<8sIB")
+MAGIC = b"COUPSOL4"
+# policy code stored for states without a winning action
+NO_ACTION_CODE = 255
+# attractor rank stored for states outside a winning region
+NO_RANK = 0xFFFF
+# methods whose source determines the game graph, changing any of them invalidates stored solutions
+RULE_METHODS = ("_get_states", "_is_in_state_space", "_get_player_states", "_get_actions", "get_start_game_state",
+                "get_goal_states", "get_enabled_actions", "transition", "_fold_player_state")
+
+
+class SolutionStore:
+    """
+    Disk backed store of solved matchups. Each solution is a single binary file holding both players' attractor ranks as
+    uint16 (which also give the winning regions) and both policies as uint8 action codes indexed by state id.
+
+    Files are keyed by the two card pairs, the state generation mode, the Rules and a fingerprint of the rules'
+    implementation (constants.py and the transition logic of the environment) so a rule change never returns a stale
+    solution. The full state space does not depend on the start state, so full solutions are shared by all Rules that
+    only differ in starting_coins. The total size of the store is bounded by max_bytes, least recently used solutions
+    are evicted first.
+    """
+
+    def __init__(self, directory="../data/solutions", max_bytes=512 * 1024 ** 2):
+        """
+        :param directory: Directory the solution files are kept in
+        :param max_bytes: Maximum total size of the solution files in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # _fingerprints[environment_class] = rules fingerprint of the class
+        self._fingerprints = dict()
+
+    def get_path(self, environment):
+        """
+        :return: The path of the solution file for the matchup of environment
+        """
+        environment_class = type(environment)
+        if environment_class not in self._fingerprints:
+            self._fingerprints[environment_class] = get_rules_fingerprint(environment_class)
+        if environment.reachable_only:
+            mode = "reachable"
+            rules_key = get_rules_key(environment.rules)
+        else:
+            mode = "full"
+            rules_key = get_rules_key(get_graph_rules(environment.rules))
+        if environment.fold_hands:
+            mode = f"{mode}-folded"
+        matchup = f"{'-'.join(environment.player1_cards)}_{'-'.join(environment.player2_cards)}"
+        return os.path.join(self.directory,
+                            f"{matchup}_{mode}_{rules_key}_{self._fingerprints[environment_class]}.sol")
+
+    def load(self, environment):
+        """
+        Loads the stored solution of environment's matchup into environment
+        :return: True if a solution was found and loaded, False otherwise
+        """
+        path = self.get_path(environment)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            # mark the solution as recently used for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            # never stored or evicted by another process sharing the store
+            return False
+        if len(data) < HEADER.size:
+            return False
+        magic, num_states, num_actions = HEADER.unpack_from(data)
+        # two uint16 ranks and two uint8 policy codes per state, a shorter file was cut off while being copied
+        if magic != MAGIC or len(data) != HEADER.size + 6 * num_states:
+            return False
+        states = environment._get_states()
+        actions = environment._get_actions()
+        if num_states != len(states) or num_actions != len(actions):
+            return False
+        environment._states = states
+        environment.actions = actions
+
+        offset = HEADER.size
+        ranks = list()
+        for _ in range(2):
+            player_ranks = array('H', data[offset:offset + 2 * num_states])
+            ranks.append([-1 if rank == NO_RANK else rank for rank in player_ranks])
+            offset += 2 * num_states
+        policy_codes = list()
+        for _ in range(2):
+            policy_codes.append([-1 if code == NO_ACTION_CODE else code for code in data[offset:offset + num_states]])
+            offset += num_states
+        environment._decode_solution(ranks[0], policy_codes[0], ranks[1], policy_codes[1])
+        return True
+
+    def save(self, environment):
+        """
+        Writes the solution of a solved environment to the store and evicts old solutions if the store is too large
+        """
+        states = environment._get_states()
+        actions = environment._get_actions()
+        action_codes = dict(zip(actions, range(len(actions))))
+
+        data = bytearray(HEADER.pack(MAGIC, len(states), len(actions)))
+        for player in (1, 2):
+            ranks = environment._ranks_1 if player == 1 else environment._ranks_2
+            if max(ranks, default=-1) >= NO_RANK:
+                raise Exception(f"Attractor ranks of {environment} are too large to store")
+            data.extend(array('H', [NO_RANK if rank == -1 else rank for rank in ranks]).tobytes())
+        for player in (1, 2):
+            policy = environment.get_policy(player)
+            data.extend(array('B', [NO_ACTION_CODE if policy[state] is None else action_codes[policy[state]]
+                                    for state in states]).tobytes())
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.get_path(environment)
+        # write to a temporary file first so readers never see a partially written solution
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+        self._evict(keep=path)
+
+    def _evict(self, keep):
+        """
+        Removes the least recently used solutions until the store fits in max_bytes
+        :param keep: Path of a solution that is never evicted
+        """
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith(".sol"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # removed by another process sharing the store
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def get_rules_fingerprint(environment_class):
+    """
+    :param environment_class: The environment class whose transition logic is fingerprinted
+    :return: A short hash of the values in constants.py and the source of the methods that define the game graph
+    """
+    digest = hashlib.sha256()
+    for name, value in sorted(vars(constants).items()):
+        if not name.startswith("_"):
+            digest.update(f"{name}={value!r}\n".encode())
+    # environment classes with extra rule helpers list them in rule_methods
+    for name in RULE_METHODS + tuple(getattr(environment_class, "rule_methods", ())):
+        digest.update(inspect.getsource(getattr(environment_class, name)).encode())
+    return digest.hexdigest()[:16]
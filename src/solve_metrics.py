@@ -0,0 +1,238 @@
+"""
+Structured instrumentation of CoupMatchupEnvironment.solve.
+
+solve() times each of its phases and records the size of the game graph and the attractor computation in a
+SolveMetrics object that it returns. While tracemalloc is tracing every phase also records the peak of the allocations
+made during that phase, so the phase that dominates memory can be told apart from the others. solve(trace_memory=True)
+turns tracing on for the duration of the solve (see trace_memory). Hooks are called with an event dict every time a
+phase ends and once when the solve is finished, so a caller can stream metrics to a file (json_lines_hook) or a logger
+(logging_hook) while a long sweep is running. summarize combines the metrics of many solves, e.g. the matchups of
+run_experiment.
+"""
+import contextlib
+import json
+import logging
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from transition_table import DISABLED
+
+# highest tracemalloc peak before phases reset it (see SolveMetrics.phase), so get_peak_memory still covers the whole
+# trace
+_traced_peak_before_reset = 0
+
+
+def get_peak_memory():
+    """
+    :return: The peak memory of this process in bytes: the peak of traced memory since tracing started (or since
+    reset_peak_memory) if tracemalloc is tracing, otherwise the maximum resident set size of the process so far, which
+    includes everything the process did before (None if neither is available)
+    """
+    if tracemalloc.is_tracing():
+        return max(_traced_peak_before_reset, tracemalloc.get_traced_memory()[1])
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def reset_peak_memory():
+    """
+    Starts measuring the traced peak of get_peak_memory from the current traced memory
+    """
+    global _traced_peak_before_reset
+    _traced_peak_before_reset = 0
+    tracemalloc.reset_peak()
+
+
+@contextlib.contextmanager
+def trace_memory(enabled=True):
+    """
+    Context manager tracing memory with tracemalloc while it is active, so the phases of a solve record their own peaks
+    and get_peak_memory covers only what happens inside it. If tracemalloc is already tracing it is left to its owner
+    (e.g. benchmark) and nothing changes. Tracing only covers the current process, not the workers of the parallel
+    backend.
+    :param enabled: Whether to trace, so callers can pass their trace_memory flag straight through
+    """
+    if not enabled or tracemalloc.is_tracing():
+        yield
+        return
+    tracemalloc.start()
+    reset_peak_memory()
+    try:
+        yield
+    finally:
+        tracemalloc.stop()
+
+
+def _reset_traced_peak():
+    """
+    Resets the tracemalloc peak without losing it for get_peak_memory
+    :return: The tracemalloc peak before the reset
+    """
+    global _traced_peak_before_reset
+    peak = tracemalloc.get_traced_memory()[1]
+    _traced_peak_before_reset = max(_traced_peak_before_reset, peak)
+    tracemalloc.reset_peak()
+    return peak
+
+
+class SolveMetrics:
+    def __init__(self, player1_cards, player2_cards, hooks=None):
+        """
+        :param hooks: Callables that are called with an event dict at the end of every phase and of the solve
+        """
+        self.player1_cards = tuple(player1_cards)
+        self.player2_cards = tuple(player2_cards)
+        self.hooks = list(hooks) if hooks is not None else list()
+        # phases[name] = {"seconds": wall time, "peak_memory_bytes": peak traced memory during the phase, None unless
+        # tracemalloc is tracing (see trace_memory)}
+        self.phases = dict()
+        # traced peaks of the phases that are running, innermost last
+        self._phase_peaks = list()
+        self.num_states = None
+        # enabled transitions (edges of the game graph) and disabled (state, action) pairs
+        self.num_edges = None
+        self.num_disabled = None
+        # level_sizes[player][rank] = number of states with attractor rank rank in player's attractor
+        self.level_sizes = {1: list(), 2: list()}
+        # solver iterations per player: worklist pops for the worklist backend, level sweeps for the csr backend
+        self.iterations = {1: 0, 2: 0}
+        self.backend = None
+        self.loaded_from_store = False
+        self.peak_memory_bytes = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager timing the phase name of the solve. If tracemalloc is tracing the peak of the phase is measured
+        by resetting the tracemalloc peak when the phase starts, the peak of an enclosing phase is carried over so
+        phases can be nested
+        """
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            peak = _reset_traced_peak()
+            if self._phase_peaks:
+                self._phase_peaks[-1] = max(self._phase_peaks[-1], peak)
+            self._phase_peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak_memory = None
+            if tracing:
+                peak_memory = max(self._phase_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._phase_peaks:
+                    self._phase_peaks[-1] = max(self._phase_peaks[-1], peak_memory)
+        phase = self.phases.setdefault(name, {"seconds": 0.0, "peak_memory_bytes": None})
+        phase["seconds"] += seconds
+        if peak_memory is not None:
+            phase["peak_memory_bytes"] = max(phase["peak_memory_bytes"] or 0, peak_memory)
+        self._emit({"event": "phase", "phase": name, "seconds": seconds, "peak_memory_bytes": peak_memory})
+
+    def record_graph(self, table):
+        """
+        :param table: The TransitionTable of the solved game
+        """
+        self.num_states = table.num_states
+        self.num_disabled = table.targets.count(DISABLED)
+        self.num_edges = len(table.targets) - self.num_disabled
+
+    def record_attractor(self, player, ranks, iterations):
+        """
+        :param ranks: player's attractor ranks indexed by state id (-1 outside the attractor)
+        :param iterations: Number of solver iterations it took to compute ranks
+        """
+        level_sizes = list()
+        for rank in ranks:
+            if rank >= 0:
+                if rank >= len(level_sizes):
+                    level_sizes.extend([0] * (rank + 1 - len(level_sizes)))
+                level_sizes[rank] += 1
+        self.level_sizes[player] = level_sizes
+        self.iterations[player] = int(iterations)
+
+    def finish(self):
+        """
+        Records the peak memory of the whole solve and notifies the hooks that the solve is finished
+        """
+        self.peak_memory_bytes = get_peak_memory()
+        self._emit(dict(event="solve", **self.to_dict()))
+
+    def get_total_seconds(self):
+        return sum(phase["seconds"] for phase in self.phases.values())
+
+    def to_dict(self):
+        """
+        :return: The metrics as a JSON serializable dict
+        """
+        return {"player1_cards": list(self.player1_cards), "player2_cards": list(self.player2_cards),
+                "backend": self.backend, "loaded_from_store": self.loaded_from_store,
+                "total_seconds": self.get_total_seconds(), "phases": self.phases, "num_states": self.num_states,
+                "num_edges": self.num_edges, "num_disabled": self.num_disabled,
+                "level_sizes": {str(player): sizes for player, sizes in self.level_sizes.items()},
+                "iterations": {str(player): iterations for player, iterations in self.iterations.items()},
+                "peak_memory_bytes": self.peak_memory_bytes}
+
+    def _emit(self, event):
+        event["player1_cards"] = list(self.player1_cards)
+        event["player2_cards"] = list(self.player2_cards)
+        for hook in self.hooks:
+            hook(event)
+
+
+def json_lines_hook(file):
+    """
+    :param file: A file opened for writing
+    :return: A hook writing every event to file as one line of JSON
+    """
+    def hook(event):
+        file.write(f"{json.dumps(event)}\n")
+        file.flush()
+    return hook
+
+
+def logging_hook(logger=None, level=logging.INFO):
+    """
+    :return: A hook logging every event to logger (by default the logger of this module)
+    """
+    logger = logging.getLogger(__name__) if logger is None else logger
+
+    def hook(event):
+        logger.log(level, json.dumps(event))
+    return hook
+
+
+def summarize(metrics, top=10):
+    """
+    :param metrics: A list of metrics dicts (see SolveMetrics.to_dict)
+    :param top: Number of slowest matchups to list
+    :return: A dict with the number of solves, the total time and the share of each phase in it, and the slowest
+    matchups with their dominant phase
+    """
+    phase_seconds = dict()
+    for record in metrics:
+        for name, phase in record["phases"].items():
+            phase_seconds[name] = phase_seconds.get(name, 0.0) + phase["seconds"]
+    total_seconds = sum(phase_seconds.values())
+    slowest = sorted(metrics, key=lambda record: record["total_seconds"], reverse=True)[:top]
+    peak_memories = [record["peak_memory_bytes"] for record in metrics if record["peak_memory_bytes"] is not None]
+    return {
+        "num_solves": len(metrics),
+        "num_loaded_from_store": sum(record["loaded_from_store"] for record in metrics),
+        "total_seconds": total_seconds,
+        "phases": {name: {"seconds": seconds, "share": seconds / total_seconds if total_seconds else 0.0}
+                   for name, seconds in sorted(phase_seconds.items(), key=lambda item: item[1], reverse=True)},
+        "slowest_matchups": [{"player1_cards": record["player1_cards"], "player2_cards": record["player2_cards"],
+                              "total_seconds": record["total_seconds"],
+                              "dominant_phase": max(record["phases"], key=lambda name: record["phases"][name]["seconds"],
+                                                    default=None)}
+                             for record in slowest],
+        "peak_memory_bytes": max(peak_memories, default=None),
+    }
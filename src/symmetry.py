@@ -0,0 +1,132 @@
+"""
+Canonical forms of matchups and states.
+
+Two kinds of relabeling leave a game unchanged:
+ - swapping the players: (A,B) vs (C,D) is the game (C,D) vs (A,B) where the other player moves first
+ - swapping the order of the cards in a hand: (A,B) is the same hand as (B,A) with kill_card_1 and kill_card_2 swapped
+
+Every matchup is mapped to a canonical matchup (both hands in constants.CARDS order and the hands themselves in order)
+together with the Relabeling that maps states of the canonical game to states of the original game, so one solve of the
+canonical game answers every equivalent matchup.
+"""
+from collections import namedtuple
+
+import constants
+
+# swap_players: player 1 of the canonical game is player 2 of the original game
+# swap_cards_1, swap_cards_2: the hand of player 1 (2) of the original game is in the reverse of canonical order
+Relabeling = namedtuple("Relabeling", ["swap_players", "swap_cards_1", "swap_cards_2"])
+
+_KILL_ACTION_SWAP = {constants.KILL_CARD_1: constants.KILL_CARD_2, constants.KILL_CARD_2: constants.KILL_CARD_1}
+
+
+def canonicalize_hand(cards):
+    """
+    :param cards: A tuple of two cards
+    :return: The cards in constants.CARDS order and whether they had to be swapped to get there
+    """
+    if constants.CARDS.index(cards[0]) > constants.CARDS.index(cards[1]):
+        return (cards[1], cards[0]), True
+    return tuple(cards), False
+
+
+def canonicalize_matchup(player1_cards, player2_cards):
+    """
+    :return: The canonical player1_cards, the canonical player2_cards and the Relabeling that maps states of the
+    canonical game to states of the game player1_cards vs player2_cards
+    """
+    hand_1, swap_cards_1 = canonicalize_hand(player1_cards)
+    hand_2, swap_cards_2 = canonicalize_hand(player2_cards)
+    hand_key_1 = [constants.CARDS.index(card) for card in hand_1]
+    hand_key_2 = [constants.CARDS.index(card) for card in hand_2]
+    if hand_key_1 > hand_key_2:
+        return hand_2, hand_1, Relabeling(True, swap_cards_1, swap_cards_2)
+    return hand_1, hand_2, Relabeling(False, swap_cards_1, swap_cards_2)
+
+
+def relabel_state(state, relabeling, inverse=False):
+    """
+    :param state: A state of the canonical game (or of the original game if inverse is True)
+    :param relabeling: The Relabeling returned by canonicalize_matchup
+    :param inverse: Map a state of the original game back to the canonical game instead
+    :return: The equivalent state in the other game
+    """
+    player1_state, player2_state, turn = state[0], state[1], state[2]
+    if inverse:
+        player1_state, player2_state = _swap_cards(player1_state, player2_state, relabeling)
+    if relabeling.swap_players:
+        player1_state, player2_state = player2_state, player1_state
+        turn = 1 if turn == 2 else 2
+    if not inverse:
+        player1_state, player2_state = _swap_cards(player1_state, player2_state, relabeling)
+    return (player1_state, player2_state, turn) + tuple(state[3:])
+
+
+def relabel_action(action, turn, relabeling):
+    """
+    :param action: An action taken in one of the games
+    :param turn: The player of the original game taking the action
+    :param relabeling: The Relabeling returned by canonicalize_matchup
+    :return: The equivalent action in the other game (kill actions of a swapped hand are swapped, the rest is unchanged)
+    """
+    swap_cards = relabeling.swap_cards_1 if turn == 1 else relabeling.swap_cards_2
+    if swap_cards:
+        return _KILL_ACTION_SWAP.get(action, action)
+    return action
+
+
+def relabel_solution(canonical_environment, environment, relabeling):
+    """
+    Stores the winning regions and policies of the solved canonical_environment in environment, mapped through
+    relabeling. The relabeled policies win as fast as the policies of a direct solve but may break ties between equally
+    good kill actions differently.
+    :param canonical_environment: A solved CoupMatchupEnvironment of the canonical matchup
+    :param environment: An unsolved CoupMatchupEnvironment of an equivalent matchup (full state space)
+    :param relabeling: The Relabeling returned by canonicalize_matchup for environment's matchup
+    """
+    if environment.reachable_only or canonical_environment.reachable_only:
+        raise Exception("Solutions can only be relabeled between games over the full state space")
+    environment._states = environment._get_states()
+    environment.actions = environment._get_actions()
+    num_states = len(environment._states)
+    state_ids = dict(zip(environment._states, range(num_states)))
+    action_ids = dict(zip(environment.actions, range(len(environment.actions))))
+
+    solution = dict()
+    for canonical_player in (1, 2):
+        player = 3 - canonical_player if relabeling.swap_players else canonical_player
+        ranks = [-1 for _ in range(num_states)]
+        policy_codes = [-1 for _ in range(num_states)]
+        for state in canonical_environment.get_win_region(canonical_player):
+            ranks[state_ids[relabel_state(state, relabeling)]] = \
+                canonical_environment.get_attractor_rank(canonical_player, state)
+        for state, action in canonical_environment.get_policy(canonical_player).items():
+            if action is not None:
+                state_id = state_ids[relabel_state(state, relabeling)]
+                policy_codes[state_id] = action_ids[relabel_action(action, player, relabeling)]
+        solution[player] = (ranks, policy_codes)
+    environment._decode_solution(*solution[1], *solution[2])
+
+
+def get_matchup_winner(canonical_environment, player1_cards, player2_cards):
+    """
+    :param canonical_environment: A solved CoupMatchupEnvironment of the canonical matchup of player1_cards vs
+    player2_cards
+    :return: The player that wins player1_cards vs player2_cards (1 or 2) or None if the game is a draw
+    """
+    _, _, relabeling = canonicalize_matchup(player1_cards, player2_cards)
+    start_game_state = type(canonical_environment)(player1_cards, player2_cards,
+                                                   rules=canonical_environment.rules).get_start_game_state()
+    canonical_state = relabel_state(start_game_state, relabeling, inverse=True)
+    for canonical_player in (1, 2):
+        if canonical_state in canonical_environment.get_win_region(canonical_player):
+            return 3 - canonical_player if relabeling.swap_players else canonical_player
+    return None
+
+
+def _swap_cards(player1_state, player2_state, relabeling):
+    if relabeling.swap_cards_1:
+        player1_state = (player1_state[1], player1_state[0], player1_state[2])
+    if relabeling.swap_cards_2:
+        player2_state = (player2_state[1], player2_state[0], player2_state[2])
+    return player1_state, player2_state
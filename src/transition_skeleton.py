@@ -0,0 +1,140 @@
+"""
+Card agnostic transition structure shared by all matchups.
+
+Apart from ability checks such as "has DUKE" or "has CAPTAIN or AMBASSADOR", transition and get_enabled_actions do not
+depend on which cards a player holds, only on which of their cards are alive. The skeleton is the full transition table
+of a matchup between placeholder cards, built once. A matchup's table is a copy of the skeleton where the transitions
+whose ability check fails for the matchup's cards are disabled (the ability mask).
+"""
+import itertools
+from array import array
+
+import constants
+from rules import get_graph_rules
+from transition_table import DISABLED, TransitionTable
+
+PLACEHOLDER_CARDS = (("player1_card_1", "player1_card_2"), ("player2_card_1", "player2_card_2"))
+
+_skeletons = dict()
+
+
+class TransitionSkeleton:
+    def __init__(self, environment_class, rules):
+        """
+        :param environment_class: The environment class whose transition logic the skeleton is built from
+        :param rules: The Rules the skeleton is built with
+        """
+        template = environment_class(PLACEHOLDER_CARDS[0], PLACEHOLDER_CARDS[1], rules=rules)
+        self.environment_class = environment_class
+        self.rules = rules
+        self.actions = template._get_actions()
+        table = TransitionTable(template._get_states(), self.actions)
+        self.num_states = table.num_states
+        num_actions = table.num_actions
+
+        # enabled actions only depend on the moving player's alive cards, coins and the counter flags (the enable key)
+        self.keys = list()
+        key_ids = dict()
+        self.state_keys = array('H', [0]) * self.num_states
+        # conditional_entries[key_id][action_id] = table indices of transitions that need an ability check
+        self.conditional_entries = list()
+        # (candidate action ids, conditional action ids) of every key
+        key_actions = list()
+        for state_id in range(self.num_states):
+            state = table.states[state_id]
+            key = self._get_key(state)
+            key_id = key_ids.get(key)
+            if key_id is None:
+                key_id = len(self.keys)
+                key_ids[key] = key_id
+                self.keys.append(key)
+                key_actions.append(self._get_key_actions(key, table.action_ids))
+                self.conditional_entries.append({action_id: array('i') for action_id in key_actions[key_id][1]})
+            self.state_keys[state_id] = key_id
+
+            row = state_id * num_actions
+            candidate_action_ids, conditional_action_ids = key_actions[key_id]
+            for action_id in candidate_action_ids:
+                new_state = environment_class.transition(state, self.actions[action_id], rules)
+                table.targets[row + action_id] = table.intern(new_state)
+                if action_id in conditional_action_ids:
+                    self.conditional_entries[key_id][action_id].append(row + action_id)
+        self.table = table
+
+    @staticmethod
+    def _get_key(state):
+        """
+        :return: The enable key of state: (turn, card 1 alive, card 2 alive, coins, counter flags...) where the
+        alive flags and coins are those of the moving player
+        """
+        player = state[0] if state[2] == 1 else state[1]
+        return (state[2], player[0] != constants.DEAD, player[1] != constants.DEAD, player[2]) + tuple(state[3:])
+
+    def _get_key_state(self, key, cards):
+        """
+        :return: A state with enable key key where the moving player holds cards
+        """
+        turn, card_1_alive, card_2_alive, coins = key[:4]
+        player = (cards[0] if card_1_alive else constants.DEAD, cards[1] if card_2_alive else constants.DEAD, coins)
+        other_player = (constants.DEAD, constants.DEAD, 0)
+        if turn == 1:
+            return (player, other_player, turn) + tuple(key[4:])
+        return (other_player, player, turn) + tuple(key[4:])
+
+    def _get_key_actions(self, key, action_ids):
+        """
+        :return: The ids of actions enabled for key with at least one hand and the ids of the actions that are not
+        enabled with every hand
+        """
+        enabled_sets = [set(self.environment_class.get_enabled_actions(self._get_key_state(key, cards), self.rules))
+                        for cards in itertools.product(constants.CARDS, repeat=2)]
+        candidate_actions = set.union(*enabled_sets)
+        conditional_actions = candidate_actions - set.intersection(*enabled_sets)
+        return sorted(action_ids[action] for action in candidate_actions), \
+            {action_ids[action] for action in conditional_actions}
+
+    def build_table(self, environment):
+        """
+        :param environment: A CoupMatchupEnvironment over the full state space
+        :return: The TransitionTable of environment, built by applying the ability mask of its cards to the skeleton
+        """
+        states = environment._get_states()
+        table = TransitionTable(states, self.actions)
+        if table.num_states != self.num_states:
+            raise Exception(f"{environment} does not have the state space of the transition skeleton")
+        table.targets = array('i', self.table.targets)
+        # states outside the state space are interned in the same order as in the skeleton
+        for state in self.table.states[self.num_states:]:
+            table.intern(self._get_matchup_state(state, environment))
+
+        for key_id, key in enumerate(self.keys):
+            cards = environment.player1_cards if key[0] == 1 else environment.player2_cards
+            enabled = set(environment.get_enabled_actions(self._get_key_state(key, cards), self.rules))
+            for action_id, entries in self.conditional_entries[key_id].items():
+                if self.actions[action_id] not in enabled:
+                    for entry in entries:
+                        table.targets[entry] = DISABLED
+        return table
+
+    @staticmethod
+    def _get_matchup_state(state, environment):
+        """
+        :return: state with the placeholder cards replaced by the cards of environment's matchup
+        """
+        player_states = list()
+        for player_state, placeholders, cards in zip(state[:2], PLACEHOLDER_CARDS,
+                                                     (environment.player1_cards, environment.player2_cards)):
+            player_states.append(tuple(cards[placeholders.index(card)] if card in placeholders else card
+                                       for card in player_state[:2]) + (player_state[2],))
+        return tuple(player_states) + tuple(state[2:])
+
+
+def get_skeleton(environment_class, rules):
+    """
+    :return: The TransitionSkeleton of environment_class under rules, building it on first use. Rules that only differ
+    in the start state share a skeleton
+    """
+    key = (environment_class, get_graph_rules(rules))
+    if key not in _skeletons:
+        _skeletons[key] = TransitionSkeleton(environment_class, key[1])
+    return _skeletons[key]
@@ -0,0 +1,193 @@
+from array import array
+from collections.abc import Mapping
+
+import constants
+
+# Marker stored in the table for actions that are not enabled from a state
+DISABLED = -1
+
+
+class TransitionTable:
+    """
+    Array backed transition table. Every state gets a dense integer id (its position in the states list) and every
+    action a small integer code (its position in the actions tuple). The table is a flat int32 array where
+    targets[state_id * num_actions + action_id] = target_state_id, or DISABLED if the action is not enabled.
+
+    Transitions can lead to states outside the state space (e.g. a player reaching 13 coins or both players having two
+    dead cards). These are given ids >= num_states so they can be stored in the table, but they have no row of their
+    own and are never winning for either player.
+    """
+
+    def __init__(self, states, actions):
+        """
+        :param states: A list of all states in the state space
+        :param actions: A tuple of all possible actions
+        """
+        self.states = list(states)
+        self.num_states = len(self.states)
+        self.actions = tuple(actions)
+        self.num_actions = len(self.actions)
+        self.state_ids = dict(zip(self.states, range(self.num_states)))
+        self.action_ids = dict(zip(self.actions, range(self.num_actions)))
+        self.targets = array('i', [DISABLED]) * (self.num_states * self.num_actions)
+
+    @classmethod
+    def build(cls, states, actions, transition, get_enabled_actions):
+        """
+        :param states: A list of all states in the state space
+        :param actions: A tuple of all possible actions
+        :param transition: Function of (state, action) returning the resulting state
+        :param get_enabled_actions: Function of state returning the actions enabled from that state
+        :return: A TransitionTable containing every enabled transition
+        """
+        table = cls(states, actions)
+        for state_id in range(table.num_states):
+            state = table.states[state_id]
+            row = state_id * table.num_actions
+            for action in get_enabled_actions(state):
+                table.targets[row + table.action_ids[action]] = table.intern(transition(state, action))
+        return table
+
+    @classmethod
+    def expand(cls, initial_states, actions, transition, get_enabled_actions, is_in_state_space, max_states=None):
+        """
+        Builds the table of the states reachable from initial_states by generating states on demand: a state gets an id
+        and a row of the table when it is first reached, so no state outside the reachable part of the state space is
+        ever created.
+        :param initial_states: A list of states the expansion starts from
+        :param transition: Function of (state, action) returning the resulting state
+        :param get_enabled_actions: Function of state returning the actions enabled from that state
+        :param is_in_state_space: Function of state returning False for states outside the state space, these are
+        given ids >= num_states and are not expanded
+        :param max_states: Maximum number of states, the expansion raises an exception instead of exceeding it. Every
+        state takes num_actions * 4 bytes in the table plus the state itself and its entry in state_ids
+        :return: A TransitionTable containing every enabled transition of the reachable states
+        """
+        table = cls(list(), actions)
+        empty_row = array('i', [DISABLED]) * table.num_actions
+        # states outside the state space get their ids once the number of states is known
+        outside_states = list()
+        outside_ids = dict()
+        # (table index, index in outside_states) of every transition into a state outside the state space
+        outside_entries = list()
+        for state in initial_states:
+            table.intern(state)
+        # the states list doubles as the BFS queue, state_id is the next state to expand
+        state_id = 0
+        while state_id < len(table.states):
+            state = table.states[state_id]
+            row = state_id * table.num_actions
+            table.targets.extend(empty_row)
+            for action in get_enabled_actions(state):
+                new_state = transition(state, action)
+                new_state_id = table.state_ids.get(new_state)
+                if new_state_id is None:
+                    if new_state in outside_ids or not is_in_state_space(new_state):
+                        outside_entries.append((row + table.action_ids[action],
+                                                outside_ids.setdefault(new_state, len(outside_states))))
+                        if len(outside_ids) > len(outside_states):
+                            outside_states.append(new_state)
+                        continue
+                    if max_states is not None and len(table.states) >= max_states:
+                        raise Exception(f"State expansion exceeded max_states={max_states}")
+                    new_state_id = table.intern(new_state)
+                table.targets[row + table.action_ids[action]] = new_state_id
+            state_id += 1
+
+        table.num_states = len(table.states)
+        for state in outside_states:
+            table.intern(state)
+        for entry, outside_index in outside_entries:
+            table.targets[entry] = table.num_states + outside_index
+        return table
+
+    @classmethod
+    def from_transitions(cls, states, actions, transitions):
+        """
+        :param transitions: A transition dictionary where transitions[state][action] = new_state or ACTION_DISABLED
+        :return: A TransitionTable equivalent to transitions
+        """
+        table = cls(states, actions)
+        for state_id in range(table.num_states):
+            row = state_id * table.num_actions
+            state_transitions = transitions[table.states[state_id]]
+            for action_id in range(table.num_actions):
+                target = state_transitions[table.actions[action_id]]
+                if target != constants.ACTION_DISABLED:
+                    table.targets[row + action_id] = table.intern(target)
+        return table
+
+    def intern(self, state):
+        """
+        :return: The id of state, assigning a new id past the end of the state space if state is not part of it
+        """
+        state_id = self.state_ids.get(state)
+        if state_id is None:
+            state_id = len(self.states)
+            self.states.append(state)
+            self.state_ids[state] = state_id
+        return state_id
+
+    def target(self, state_id, action_id):
+        """
+        :return: The id of the state reached by taking action_id from state_id or DISABLED
+        """
+        return self.targets[state_id * self.num_actions + action_id]
+
+    def successors(self, state_id):
+        """
+        :return: A list of (action_id, target_id) pairs for every action enabled from state_id
+        """
+        row = state_id * self.num_actions
+        return [(action_id, self.targets[row + action_id]) for action_id in range(self.num_actions)
+                if self.targets[row + action_id] != DISABLED]
+
+    def view(self):
+        """
+        :return: A read only view of the table with the same interface as the transitions dictionary
+        """
+        return TransitionView(self)
+
+
+class TransitionView(Mapping):
+    """
+    Presents a TransitionTable as transitions[state][action] = new_state (or constants.ACTION_DISABLED) without
+    materialising the nested dictionaries.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, state):
+        state_id = self.table.state_ids[state]
+        if state_id >= self.table.num_states:
+            raise KeyError(state)
+        return _StateTransitionView(self.table, state_id)
+
+    def __iter__(self):
+        return iter(self.table.states[:self.table.num_states])
+
+    def __len__(self):
+        return self.table.num_states
+
+
+class _StateTransitionView(Mapping):
+    """
+    The transitions out of a single state -- see TransitionView
+    """
+
+    def __init__(self, table, state_id):
+        self.table = table
+        self.row = state_id * table.num_actions
+
+    def __getitem__(self, action):
+        target = self.table.targets[self.row + self.table.action_ids[action]]
+        if target == DISABLED:
+            return constants.ACTION_DISABLED
+        return self.table.states[target]
+
+    def __iter__(self):
+        return iter(self.table.actions)
+
+    def __len__(self):
+        return self.table.num_actions
@@ -0,0 +1,214 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+class WorkQueue:
+    """
+    Work queue kept in a directory on a filesystem shared by every worker, so workers on different hosts can split the
+    tasks without any other coordination:
+
+        tasks/<task_id>.json   the task, written once when the queue is created
+        leases/<task_id>       the lease of the worker solving the task
+        done/<task_id>.json    the result of the task
+
+    A worker claims a task by creating its lease file with O_EXCL, which only one worker can do. While it works it
+    keeps touching the lease (the heartbeat). A lease whose modification time is older than lease_seconds belongs to a
+    worker that died or lost the filesystem and is reclaimed by the next worker looking for work. Results are written to
+    a temporary file and renamed into done, so a task is either done completely or not at all. Tasks must be idempotent:
+    a worker that stalls past its lease can finish after its task was reclaimed, and both results are the same.
+
+    Lease expiry compares the modification time set by the filesystem with the clock of the worker, so the clocks of
+    the hosts must agree to well within lease_seconds.
+    """
+
+    def __init__(self, directory, lease_seconds=600):
+        """
+        :param directory: Directory of the queue
+        :param lease_seconds: Seconds without a heartbeat after which a lease expires
+        """
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.tasks_directory = os.path.join(directory, "tasks")
+        self.leases_directory = os.path.join(directory, "leases")
+        self.done_directory = os.path.join(directory, "done")
+
+    def add_tasks(self, tasks):
+        """
+        :param tasks: A dict of the form tasks[task_id] = JSON serializable task, tasks that already exist are kept
+        """
+        for directory in (self.tasks_directory, self.leases_directory, self.done_directory):
+            os.makedirs(directory, exist_ok=True)
+        for task_id, task in tasks.items():
+            path = self._get_task_path(task_id)
+            if not os.path.isfile(path):
+                _write_json(path, task)
+
+    def get_task_ids(self):
+        return sorted(name[:-len(".json")] for name in os.listdir(self.tasks_directory) if name.endswith(".json"))
+
+    def get_task(self, task_id):
+        with open(self._get_task_path(task_id), 'r') as file:
+            return json.load(file)
+
+    def is_done(self, task_id):
+        return os.path.isfile(self._get_done_path(task_id))
+
+    def get_result(self, task_id):
+        with open(self._get_done_path(task_id), 'r') as file:
+            return json.load(file)
+
+    def get_pending_task_ids(self):
+        """
+        :return: The ids of the tasks that are not done yet (leased or not)
+        """
+        return [task_id for task_id in self.get_task_ids() if not self.is_done(task_id)]
+
+    def claim(self, worker_id):
+        """
+        Leases the first task that is neither done nor leased by a live worker
+        :return: A Lease or None if no task can be claimed right now
+        """
+        for task_id in self.get_pending_task_ids():
+            lease = self._try_lease(task_id, worker_id)
+            if lease is not None:
+                if self.is_done(task_id):
+                    # the task was finished between listing and leasing it
+                    lease.release()
+                    continue
+                return lease
+        return None
+
+    def complete(self, lease, result):
+        """
+        Records the result of the task of lease and releases the lease
+        :param result: The JSON serializable result of the task
+        """
+        _write_json(self._get_done_path(lease.task_id), result)
+        lease.release()
+
+    def _try_lease(self, task_id, worker_id):
+        path = os.path.join(self.leases_directory, task_id)
+        token = f"{worker_id} {uuid.uuid4().hex}"
+        for _ in range(2):
+            try:
+                descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._reclaim_expired(path, worker_id):
+                    return None
+                continue
+            with os.fdopen(descriptor, 'w') as file:
+                file.write(token)
+            return Lease(task_id, path, token, self.lease_seconds)
+        return None
+
+    def _reclaim_expired(self, path, worker_id):
+        """
+        Removes the lease at path if it expired
+        :return: Whether the lease was removed
+        """
+        try:
+            token = _read_token(path)
+            if time.time() - os.stat(path).st_mtime < self.lease_seconds:
+                return False
+            # renaming is atomic, so of several workers reclaiming the same lease only one succeeds
+            expired_path = f"{path}.{worker_id}.{uuid.uuid4().hex}.expired"
+            os.rename(path, expired_path)
+        except FileNotFoundError:
+            # another worker released or reclaimed the lease first
+            return False
+        if _read_token(expired_path) != token:
+            # the lease was renewed by a new owner between reading and renaming it, put it back unless a third worker
+            # already created a lease
+            try:
+                os.link(expired_path, path)
+            except FileExistsError:
+                pass
+            os.remove(expired_path)
+            return False
+        os.remove(expired_path)
+        return True
+
+    def _get_task_path(self, task_id):
+        return os.path.join(self.tasks_directory, f"{task_id}.json")
+
+    def _get_done_path(self, task_id):
+        return os.path.join(self.done_directory, f"{task_id}.json")
+
+
+class Lease:
+    """
+    A worker's claim on one task. Used as a context manager it sends heartbeats from a background thread until the
+    block exits
+    """
+
+    def __init__(self, task_id, path, token, lease_seconds):
+        self.task_id = task_id
+        self.path = path
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._send_heartbeats, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+        if exc_type is not None:
+            # give the task back right away instead of waiting for the lease to expire
+            self.release()
+
+    def is_held(self):
+        """
+        :return: Whether the lease file still belongs to this lease (it is lost if it expired and was reclaimed)
+        """
+        try:
+            return _read_token(self.path) == self.token
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self):
+        if self.is_held():
+            os.utime(self.path)
+
+    def release(self):
+        if self.is_held():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _send_heartbeats(self):
+        while not self._stopped.wait(self.lease_seconds / 4):
+            self.heartbeat()
+
+
+def get_worker_id():
+    """
+    :return: An id of this process that is unique across hosts
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _read_token(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+
+def _write_json(path, data):
+    """
+    Atomically writes data as JSON to path
+    """
+    temporary_path = f"{path}.{get_worker_id()}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
@@ -0,0 +1,98 @@
+import pytest
+
+import constants
+from extended_rules import CHALLENGE_WINDOW, EXCHANGE_HANDS, LOSE_INFLUENCE, NO_PENDING, \
+    ExtendedCoupMatchupEnvironment
+from rules import Rules
+
+transition = ExtendedCoupMatchupEnvironment.transition
+get_enabled_actions = ExtendedCoupMatchupEnvironment.get_enabled_actions
+
+
+def play(state, actions):
+    for action in actions:
+        assert action in get_enabled_actions(state), (state, action)
+        state = transition(state, action)
+    return state
+
+
+@pytest.fixture
+def start_game_state():
+    return ExtendedCoupMatchupEnvironment(("assassin", "captain"), ("duke", "contessa")).get_start_game_state()
+
+
+def test_unchallenged_bluff_succeeds(start_game_state):
+    state = play(start_game_state, [constants.TAX])
+    assert state[2] == 2 and state[7] == (CHALLENGE_WINDOW, constants.TAX)
+    assert play(state, [constants.NO_ACTION]) == (("assassin", "captain", 5), ("duke", "contessa", 2), 2, 0, 0, 0, 0,
+                                                  NO_PENDING)
+
+
+def test_challenged_bluff_fails(start_game_state):
+    # player 1 does not hold the duke, so the challenge succeeds and player 1 loses an influence and the tax
+    state = play(start_game_state, [constants.TAX, constants.CHALLENGE])
+    assert state[2] == 1 and state[7] == (LOSE_INFLUENCE, constants.TAX, False)
+    assert play(state, [constants.KILL_CARD_1]) == ((constants.DEAD, "captain", 2), ("duke", "contessa", 2), 2, 0, 0,
+                                                    0, 0, NO_PENDING)
+
+
+def test_challenged_claim_succeeds(start_game_state):
+    # player 1 holds the captain, so the challenger loses an influence and the steal goes ahead
+    state = play(start_game_state, [constants.STEAL, constants.CHALLENGE])
+    assert state[2] == 2 and state[7] == (LOSE_INFLUENCE, constants.STEAL, True)
+    state = play(state, [constants.KILL_CARD_2])
+    assert state == (("assassin", "captain", 2), ("duke", constants.DEAD, 2), 2, 0, 0, 1, 0, NO_PENDING)
+    assert play(state, [constants.NO_ACTION]) == (("assassin", "captain", 4), ("duke", constants.DEAD, 0), 2, 0, 0, 0,
+                                                  0, NO_PENDING)
+
+
+def test_challenged_contessa_bluff_loses_two_influences():
+    state = (("duke", "captain", 2), ("assassin", "duke", 3), 2, 0, 0, 0, 0, NO_PENDING)
+    state = play(state, [constants.ASSASSINATE, constants.NO_ACTION])
+    assert state[2] == 1 and state[3] == 1
+    # player 1 blocks without the contessa, loses an influence to the challenge and the other to the assassination
+    state = play(state, [constants.BLOCK_ASSASSINATE, constants.CHALLENGE])
+    assert state[7] == (LOSE_INFLUENCE, constants.BLOCK_ASSASSINATE, False)
+    state = play(state, [constants.KILL_CARD_1])
+    assert state[7] == (LOSE_INFLUENCE, None, False)
+    assert get_enabled_actions(state) == [constants.KILL_CARD_2]
+    state = play(state, [constants.KILL_CARD_2])
+    assert state[0][:2] == (constants.DEAD, constants.DEAD) and state[7] == NO_PENDING
+
+
+def test_exchange_hands_respect_copies_per_card():
+    state = (("ambassador", "captain", 2), ("duke", "duke", 2), 1, 0, 0, 0, 0, NO_PENDING)
+    hands = [EXCHANGE_HANDS[hand_id] for hand_id in ExtendedCoupMatchupEnvironment._get_exchange_hands(state)]
+    # only one of the three dukes is left, and a player with two alive cards chooses two cards
+    assert ("duke", "duke") not in hands and ("duke", "captain") in hands
+    assert all(len(hand) == 2 for hand in hands)
+    state = (("ambassador", constants.DEAD, 2), ("duke", "duke", 2), 1, 0, 0, 0, 0, NO_PENDING)
+    hands = [EXCHANGE_HANDS[hand_id] for hand_id in ExtendedCoupMatchupEnvironment._get_exchange_hands(state)]
+    assert hands == [(card,) for card in constants.CARDS]
+
+
+def test_max_states_raises():
+    environment = ExtendedCoupMatchupEnvironment(("duke", "captain"), ("contessa", "assassin"), max_states=100)
+    with pytest.raises(Exception, match="max_states=100"):
+        environment.solve()
+
+
+def test_solved_game_is_consistent():
+    # few coins keep the lazily generated game small
+    rules = Rules(starting_coins=0, max_coins=3, forced_coup_coins=1, coup_cost=1, assassinate_cost=1)
+    environment = ExtendedCoupMatchupEnvironment(("duke", "captain"), ("contessa", "assassin"), rules=rules)
+    environment.solve()
+    assert not environment.get_win_region(1) & environment.get_win_region(2)
+    assert environment.get_start_game_state() in environment.get_win_region(1) | environment.get_win_region(2)
+    for player in (1, 2):
+        policy = environment.get_policy(player)
+        for state in environment.get_win_region(player):
+            rank = environment.get_attractor_rank(player, state)
+            if rank == 0:
+                continue
+            new_states = [new_state for new_state in environment.transitions[state].values()
+                          if new_state != constants.ACTION_DISABLED]
+            if state[2] == player:
+                new_states = [environment.transitions[state][policy[state]]]
+            # the winner's action and every action of the other player lead to a state of lower rank
+            assert all(environment.get_attractor_rank(player, new_state) < rank for new_state in new_states), state
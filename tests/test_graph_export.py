@@ -0,0 +1,42 @@
+import pytest
+
+# the binary graph export needs the optional numpy
+np = pytest.importorskip("numpy")
+
+import run_experiment
+from coup_matchup_environment import CoupMatchupEnvironment
+from graph_export import GameGraph
+from transition_table import DISABLED
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["unfolded", "folded"])
+def solved(request):
+    # a folded state of this matchup can hold the second card of player 1 in card 1
+    environment = CoupMatchupEnvironment(("duke", "assassin"), ("ambassador", "ambassador"), compact=True,
+                                         fold_hands=request.param)
+    environment.solve()
+    return environment
+
+
+def test_game_graph_round_trip(solved, tmp_path):
+    path = str(tmp_path / "graph.npz")
+    solved.save_game_graph_npz(path)
+    graph = GameGraph(path)
+    table = solved._get_table()
+    assert len(graph) == len(table.states)
+    assert [graph.get_state(node) for node in range(len(graph))] == list(table.states)
+    for node in range(table.num_states):
+        row = table.targets[node * table.num_actions:(node + 1) * table.num_actions]
+        assert graph.get_edges(node) == [(table.actions[action_id], target) for action_id, target in enumerate(row)
+                                         if target != DISABLED]
+
+
+def test_run_graph_round_trip(solved, tmp_path):
+    path = str(tmp_path / "run_graph.npz")
+    edges = list(run_experiment.iter_run_graph_edges(solved, include_actions=True))
+    run_experiment.save_run_graph_npz(path, solved)
+    graph = GameGraph(path)
+    states = list(dict.fromkeys(state for source, _, target in edges for state in (source, target)))
+    assert [graph.get_state(node) for node in range(len(graph))] == states
+    assert sorted((graph.get_state(node), action, graph.get_state(target)) for node in range(len(graph))
+                  for action, target in graph.get_edges(node)) == sorted(edges)
@@ -0,0 +1,48 @@
+import pytest
+
+import constants
+from coup_matchup_environment import CoupMatchupEnvironment
+
+
+@pytest.fixture(scope="module")
+def solved():
+    environment = CoupMatchupEnvironment(("duke", "assassin"), ("captain", "contessa"), compact=True)
+    environment.solve()
+    return environment
+
+
+def get_successors(environment, state):
+    return [(action, new_state) for action, new_state in environment.transitions[state].items()
+            if new_state != constants.ACTION_DISABLED]
+
+
+@pytest.mark.parametrize("player", [1, 2])
+def test_fastest_win_steps_down_one_rank(solved, player):
+    policy = solved.get_fastest_win_policy(player)
+    for state in solved.get_win_region(player):
+        rank = solved.get_attractor_rank(player, state)
+        if state[2] == player and rank > 0:
+            new_state = solved.transitions[state][policy[state]]
+            assert solved.get_attractor_rank(player, new_state) == rank - 1, state
+
+
+@pytest.mark.parametrize("player", [1, 2])
+def test_slowest_loss_takes_highest_winner_rank(solved, player):
+    winner = 3 - player
+    policy = solved.get_slowest_loss_policy(player)
+    for state in solved.get_win_region(winner):
+        if state[2] == player and solved.get_attractor_rank(winner, state) > 0:
+            successor_ranks = {action: solved.get_attractor_rank(winner, new_state)
+                               for action, new_state in get_successors(solved, state)}
+            assert successor_ranks[policy[state]] == max(successor_ranks.values()), state
+
+
+@pytest.mark.parametrize("player", [1, 2])
+def test_optimal_policy_combines_win_and_loss(solved, player):
+    fastest_win_policy = solved.get_fastest_win_policy(player)
+    slowest_loss_policy = solved.get_slowest_loss_policy(player)
+    optimal_policy = solved.get_optimal_policy(player)
+    for state in solved._states:
+        expected = fastest_win_policy[state] if fastest_win_policy[state] is not None else slowest_loss_policy[state]
+        assert optimal_policy[state] == expected, state
+    assert solved.get_optimal_policy(player).policy_codes is optimal_policy.policy_codes
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+import pytest
+
+from coup_matchup_environment import CoupMatchupEnvironment
+from policy_server import PolicyServer, query_policy_server
+from policy_table import NUM_COIN_VALUES, PolicyTable
+
+MATCHUP = (("duke", "assassin"), ("captain", "contessa"))
+
+
+@pytest.fixture(scope="module")
+def solved():
+    environment = CoupMatchupEnvironment(*MATCHUP, compact=True)
+    environment.solve()
+    return environment
+
+
+def get_expected(environment, state):
+    for player in (1, 2):
+        rank = environment.get_attractor_rank(player, state)
+        if rank is not None:
+            return player, environment.get_policy(player)[state], rank
+    return 0, None, None
+
+
+def test_policy_table_matches_solution(solved):
+    table = PolicyTable.from_environment(solved)
+    for state in solved._states:
+        assert table.query(state) == get_expected(solved, state), state
+
+
+@pytest.fixture(scope="module")
+def server_port():
+    server = PolicyServer(num_workers=1)
+    started = threading.Event()
+    # the server runs in its own event loop in a thread, the blocking client is called from the tests
+    context = dict()
+
+    async def serve():
+        context["loop"] = asyncio.get_running_loop()
+        context["stop"] = asyncio.Event()
+        tcp_server = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+        context["port"] = tcp_server.sockets[0].getsockname()[1]
+        started.set()
+        async with tcp_server:
+            await context["stop"].wait()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),))
+    thread.start()
+    started.wait()
+    yield context["port"]
+    context["loop"].call_soon_threadsafe(context["stop"].set)
+    thread.join()
+    server.close()
+
+
+def get_query(state):
+    return {"player1_cards": list(MATCHUP[0]), "player2_cards": list(MATCHUP[1]), "state": state}
+
+
+def test_server_answers_queries(solved, server_port):
+    states = [solved.get_start_game_state(), (("duke", "dead", 5), ("captain", "contessa", 1), 2, 0, 0, 1, 0),
+              (("dead", "assassin", 3), ("dead", "dead", 0), 1, 0, 0, 0, 0)]
+    response = query_policy_server([get_query(state) for state in states], port=server_port)
+    assert [tuple(result.values()) for result in response["results"]] == [get_expected(solved, state)
+                                                                          for state in states]
+
+
+@pytest.mark.parametrize("state", [
+    [["duke", "assassin", 2], ["captain", "contessa", 2], 1, 0, 0, 0],
+    [["duke", "assassin"], ["captain", "contessa", 2], 1, 0, 0, 0, 0],
+    [["contessa", "assassin", 2], ["captain", "contessa", 2], 1, 0, 0, 0, 0],
+    [["duke", "assassin", 2], ["captain", "contessa", 2], 3, 0, 0, 0, 0],
+    [["duke", "assassin", NUM_COIN_VALUES], ["captain", "contessa", 2], 1, 0, 0, 0, 0],
+    [["duke", "assassin", 2], ["captain", "contessa", -1], 1, 0, 0, 0, 0],
+], ids=["short", "short_player_state", "wrong_card", "turn", "too_many_coins", "negative_coins"])
+def test_server_rejects_invalid_states(server_port, state):
+    response = query_policy_server([get_query(state)], port=server_port)
+    assert "is not a state of" in response["error"]
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from coup_matchup_environment import CoupMatchupEnvironment
+from rule_sweep import get_rule_variants
+from rules import DEFAULT_RULES, Rules, get_graph_rules
+from solution_store import SolutionStore
+
+MATCHUP = (("duke", "assassin"), ("captain", "contessa"))
+
+
+@pytest.mark.parametrize("values, message", [(dict(max_coins=11), "max_coins"), (dict(starting_coins=13), "max_coins"),
+                                             (dict(coup_cost=11), "coup_cost"), (dict(forced_coup_coins=6), "coup_cost")],
+                         ids=["max_coins", "starting_coins", "coup_cost", "forced_coup_coins"])
+def test_rules_reject_invalid_values(values, message):
+    with pytest.raises(Exception, match=message):
+        Rules(**dict(DEFAULT_RULES._asdict(), **values))
+
+
+def test_rule_variants_expand_every_combination():
+    variants = get_rule_variants(starting_coins=[1, 3], forced_coup_coins=[9, 10], coup_cost=[6, 7])
+    assert len(variants) == 8 and len(set(variants)) == 8
+    assert {(rules.starting_coins, rules.forced_coup_coins, rules.coup_cost) for rules in variants} == \
+        {(starting_coins, forced_coup_coins, coup_cost) for starting_coins in (1, 3) for forced_coup_coins in (9, 10)
+         for coup_cost in (6, 7)}
+    # max_coins is derived from every combination and the fields that are not given keep their default
+    assert {(rules.forced_coup_coins, rules.max_coins) for rules in variants} == {(9, 11), (10, 12)}
+    assert all(rules.assassinate_cost == DEFAULT_RULES.assassinate_cost for rules in variants)
+    assert get_rule_variants(max_coins=[13]) == [DEFAULT_RULES._replace(max_coins=13)]
+    with pytest.raises(Exception):
+        get_rule_variants(income=[2])
+
+
+def test_starting_coins_variants_share_store_file(tmp_path):
+    store = SolutionStore(str(tmp_path))
+    variants = get_rule_variants(starting_coins=[1, 4])
+    assert get_graph_rules(variants[0]) == get_graph_rules(variants[1])
+    for i, rules in enumerate(variants):
+        environment = CoupMatchupEnvironment(*MATCHUP, compact=True, rules=rules)
+        assert environment.solve(store=store).loaded_from_store == (i > 0)
+        direct_environment = CoupMatchupEnvironment(*MATCHUP, compact=True, rules=rules)
+        direct_environment.solve()
+        start_game_state = environment.get_start_game_state()
+        assert start_game_state[0][2] == rules.starting_coins
+        for player in (1, 2):
+            assert environment.get_win_region(player) == direct_environment.get_win_region(player)
+            assert environment.get_attractor_rank(player, start_game_state) == \
+                direct_environment.get_attractor_rank(player, start_game_state)
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith(".sol")] == \
+        [os.path.basename(store.get_path(environment))]
@@ -0,0 +1,75 @@
+import pytest
+
+import run_experiment
+from coup_matchup_environment import CoupMatchupEnvironment
+
+
+@pytest.fixture(scope="module")
+def solved():
+    environment = CoupMatchupEnvironment(("duke", "assassin"), ("ambassador", "ambassador"), compact=True)
+    environment.solve()
+    return environment
+
+
+def get_run_graph_recursive(matchup, state, graph, pi1, pi2):
+    """
+    The recursive run graph builder that iter_run_graph_edges replaced
+    """
+    graph[state] = list()
+    if state in matchup.get_goal_states(1) or state in matchup.get_goal_states(2):
+        return
+    action = pi1[state] if state[2] == 1 else pi2[state]
+    if action is None:
+        for action in matchup.get_enabled_actions(state, matchup.rules):
+            new_state = matchup.transition(state, action, matchup.rules)
+            graph[state].append(new_state)
+            if new_state not in graph:
+                get_run_graph_recursive(matchup, new_state, graph, pi1, pi2)
+    else:
+        new_state = matchup.transition(state, action, matchup.rules)
+        graph[state].append(new_state)
+        get_run_graph_recursive(matchup, new_state, graph, pi1, pi2)
+
+
+def get_depths(graph, state):
+    """
+    :return: {state: number of moves from state} of every state of graph reachable from state
+    """
+    depths = {state: 0}
+    frontier = [state]
+    while frontier:
+        next_frontier = list()
+        for source in frontier:
+            for target in graph[source]:
+                if target not in depths:
+                    depths[target] = depths[source] + 1
+                    next_frontier.append(target)
+        frontier = next_frontier
+    return depths
+
+
+def test_run_graph_matches_recursive_builder(solved):
+    pi1, pi2 = solved.get_policy(1), solved.get_policy(2)
+    graph = dict()
+    get_run_graph_recursive(solved, solved.get_start_game_state(), graph, pi1, pi2)
+    assert run_experiment.get_run_graph(solved, pi1, pi2) == graph
+
+
+@pytest.mark.parametrize("max_depth", [0, 1, 5, 20])
+def test_max_depth_stops_search(solved, max_depth):
+    start_game_state = solved.get_start_game_state()
+    depths = get_depths(run_experiment.get_run_graph(solved), start_game_state)
+    edges = list(run_experiment.iter_run_graph_edges(solved, max_depth=max_depth))
+    assert {source for source, _ in edges} == {state for state, depth in depths.items() if depth < max_depth} - \
+        solved.get_goal_states(1) - solved.get_goal_states(2)
+
+
+@pytest.mark.parametrize("max_nodes", [1, 5, 15])
+def test_max_nodes_stops_search(solved, max_nodes):
+    all_edges = set(run_experiment.iter_run_graph_edges(solved))
+    edges = list(run_experiment.iter_run_graph_edges(solved, max_nodes=max_nodes))
+    sources = {source for source, _ in edges}
+    assert set(edges) <= all_edges and len({source for source, _ in all_edges}) > max_nodes
+    assert len(sources) <= max_nodes
+    # only the first max_nodes states found are expanded, later states are yielded as targets only
+    assert len(sources | {target for _, target in edges}) > max_nodes
@@ -0,0 +1,42 @@
+import pytest
+
+from coup_matchup_environment import CoupMatchupEnvironment
+
+# the simulator needs the optional numpy
+np = pytest.importorskip("numpy")
+simulator = pytest.importorskip("simulator")
+
+
+@pytest.fixture(scope="module")
+def solved():
+    environment = CoupMatchupEnvironment(("duke", "assassin"), ("captain", "contessa"), compact=True)
+    environment.solve()
+    return environment
+
+
+def test_slowest_loss_games_last_the_attractor_rank(solved):
+    start_game_state = solved.get_start_game_state()
+    winner = 1 if start_game_state in solved.get_win_region(1) else 2
+    rank = solved.get_attractor_rank(winner, start_game_state)
+    result = simulator.simulate(solved, 500, loser_policy="slowest_loss", seed=0)
+    # both players play deterministically, so every game is the same fastest win against the slowest loss
+    assert result.lengths.tolist() == [0] * rank + [500]
+    assert result.winners[winner] == 500 and result.winners[0] == 0
+
+
+def test_uniform_games_are_reproducible(solved):
+    first = simulator.simulate(solved, 2000, seed=7, batch_size=512)
+    second = simulator.simulate(solved, 2000, seed=7, batch_size=512)
+    assert first.to_dict() == second.to_dict()
+    assert first.winners.sum() == 2000 and first.lengths.sum() == first.winners[1] + first.winners[2]
+
+
+def test_max_steps_counts_unfinished_games(solved):
+    max_steps = 30
+    truncated = simulator.simulate(solved, 1000, max_steps=max_steps, seed=0)
+    result = simulator.simulate(solved, 1000, seed=0)
+    assert 0 < truncated.winners[0] < 1000 and len(truncated.lengths) <= max_steps + 1
+    assert truncated.lengths.sum() + truncated.winners[0] == 1000
+    # with the same seed the games take the same first max_steps moves, the unfinished ones are the longer games
+    assert truncated.lengths.tolist() == result.lengths[:max_steps + 1].tolist()
+    assert truncated.winners[0] == result.lengths[max_steps + 1:].sum() and result.winners[0] == 0
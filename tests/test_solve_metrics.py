@@ -0,0 +1,18 @@
+import tracemalloc
+
+from coup_matchup_environment import CoupMatchupEnvironment
+
+
+def test_trace_memory_records_phase_peaks():
+    events = list()
+    environment = CoupMatchupEnvironment(("duke", "assassin"), ("captain", "contessa"), compact=True)
+    metrics = environment.solve(hooks=[events.append], trace_memory=True)
+    assert not tracemalloc.is_tracing()
+    assert all(phase["peak_memory_bytes"] > 0 for phase in metrics.phases.values())
+    assert metrics.peak_memory_bytes >= max(phase["peak_memory_bytes"] for phase in metrics.phases.values())
+    assert [event["event"] for event in events] == ["phase"] * len(events[:-1]) + ["solve"]
+
+
+def test_phase_peaks_need_tracing():
+    metrics = CoupMatchupEnvironment(("duke", "assassin"), ("captain", "contessa"), compact=True).solve()
+    assert all(phase["peak_memory_bytes"] is None for phase in metrics.phases.values())
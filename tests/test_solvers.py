@@ -0,0 +1,178 @@
+"""
+Regression tests of the solvers and of the ways solutions are stored, all checked against a full worklist solve.
+"""
+import random
+
+import pytest
+
+import constants
+from coup_matchup_environment import CoupMatchupEnvironment
+from policy_table import get_state_index
+from progress_journal import ProgressJournal
+from solution_store import SolutionStore
+
+MATCHUPS = [(("duke", "assassin"), ("captain", "contessa")), (("ambassador", "ambassador"), ("duke", "captain"))]
+
+
+@pytest.fixture(scope="module", params=MATCHUPS, ids=lambda matchup: f"{matchup[0]}v{matchup[1]}")
+def solved(request):
+    environment = CoupMatchupEnvironment(*request.param, compact=True)
+    environment.solve()
+    return environment
+
+
+def solve_fixpoint(environment, player):
+    """
+    Reference attractor computed level by level like the original fixpoint solver: every level adds the states of
+    player with ANY action into the previous level and the states of the other player with ALL enabled actions into it
+    :return: {state: rank} of player's winning region and {state: action} of the last action into the previous level
+    """
+    ranks = {state: 0 for state in environment.get_goal_states(player)}
+    policy = dict()
+    # the enabled transitions of the states outside the goal states, read once instead of on every level
+    remaining = {state: [(action, new_state) for action, new_state in environment.transitions[state].items()
+                         if new_state != constants.ACTION_DISABLED]
+                 for state in environment._states if state not in ranks}
+    level = 0
+    while True:
+        level += 1
+        new_ranks = dict()
+        for state, transitions in remaining.items():
+            if state[2] == player:
+                for action, new_state in transitions:
+                    if new_state in ranks:
+                        new_ranks[state] = level
+                        policy[state] = action
+            elif all(new_state in ranks for _, new_state in transitions):
+                new_ranks[state] = level
+        if not new_ranks:
+            return ranks, policy
+        ranks.update(new_ranks)
+        for state in new_ranks:
+            del remaining[state]
+
+
+def get_solution(environment):
+    """
+    :return: {state: (player 1 rank, player 2 rank)} with None for states outside a winning region
+    """
+    return {state: (environment.get_attractor_rank(1, state), environment.get_attractor_rank(2, state))
+            for state in environment._states}
+
+
+@pytest.mark.parametrize("backend", ["csr", "parallel"])
+def test_backends_agree(solved, backend):
+    # both backends need the optional numpy
+    pytest.importorskip("numpy")
+    environment = CoupMatchupEnvironment(solved.player1_cards, solved.player2_cards, compact=True)
+    environment.solve(backend=backend, num_workers=2)
+    assert environment._states == solved._states
+    assert environment._ranks_1 == solved._ranks_1 and environment._ranks_2 == solved._ranks_2
+    assert environment._policy_codes == solved._policy_codes
+
+
+@pytest.mark.parametrize("compact", [False, True], ids=["dict", "compact"])
+def test_fixpoint_agrees(compact):
+    environment = CoupMatchupEnvironment(*MATCHUPS[0], compact=compact)
+    environment.solve()
+    for player in (1, 2):
+        ranks, policy = solve_fixpoint(environment, player)
+        assert environment.get_win_region(player) == set(ranks)
+        assert all(environment.get_attractor_rank(player, state) == rank for state, rank in ranks.items())
+        environment_policy = environment.get_policy(player)
+        for state in environment._states:
+            assert environment_policy[state] == policy.get(state), state
+
+
+def test_fold_hands_agrees(solved):
+    environment = CoupMatchupEnvironment(solved.player1_cards, solved.player2_cards, compact=True, fold_hands=True)
+    environment.solve()
+    folded_solution = get_solution(environment)
+    for state, ranks in get_solution(solved).items():
+        assert folded_solution[environment.fold_state(state)] == ranks, state
+
+
+def test_reachable_only_agrees(solved):
+    environment = CoupMatchupEnvironment(solved.player1_cards, solved.player2_cards, compact=True,
+                                         reachable_only=True)
+    environment.solve()
+    solution = get_solution(solved)
+    assert len(environment._states) < len(solved._states)
+    for state, ranks in get_solution(environment).items():
+        assert solution[state] == ranks, state
+
+
+def test_solve_from_agrees(solved):
+    environment = CoupMatchupEnvironment(solved.player1_cards, solved.player2_cards)
+    states = [solved.get_start_game_state()] + random.Random(0).sample(solved._states, 300)
+    for state in states:
+        rank_1, rank_2 = solved.get_attractor_rank(1, state), solved.get_attractor_rank(2, state)
+        expected = (1, rank_1) if rank_1 is not None else (2, rank_2) if rank_2 is not None else (0, None)
+        assert environment.solve_from(state) == expected, state
+
+
+def test_solution_store_round_trip(solved, tmp_path):
+    store = SolutionStore(str(tmp_path))
+    CoupMatchupEnvironment(solved.player1_cards, solved.player2_cards, compact=True).solve(store=store)
+    environment = CoupMatchupEnvironment(solved.player1_cards, solved.player2_cards, compact=True)
+    assert environment.solve(store=store).loaded_from_store
+    assert environment._states == solved._states
+    assert environment._ranks_1 == solved._ranks_1 and environment._ranks_2 == solved._ranks_2
+    assert environment._policy_codes == solved._policy_codes
+
+
+def test_solution_store_ignores_broken_files(tmp_path, monkeypatch):
+    store = SolutionStore(str(tmp_path))
+    environment = CoupMatchupEnvironment(*MATCHUPS[0], compact=True)
+    environment.solve(store=store)
+    path = store.get_path(environment)
+    with open(path, 'rb') as file:
+        data = file.read()
+    for broken_data in (data[:5], data[:-1]):
+        with open(path, 'wb') as file:
+            file.write(broken_data)
+        environment = CoupMatchupEnvironment(*MATCHUPS[0], compact=True)
+        assert not store.load(environment)
+        assert environment._states is None and not environment.is_solved()
+    # the file is evicted by another process sharing the store between reading and touching it
+    with open(path, 'wb') as file:
+        file.write(data)
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr("solution_store.os.utime", evicted)
+    assert not store.load(CoupMatchupEnvironment(*MATCHUPS[0], compact=True))
+
+
+def test_export_solution_round_trip(solved, tmp_path):
+    path = str(tmp_path / "solution.bin")
+    solved.export_solution(path)
+    solution = CoupMatchupEnvironment.load_solution(path)
+    try:
+        for state in solved._states:
+            for player in (1, 2):
+                assert solution.is_winning(player, get_state_index(state)) == (state in solved.get_win_region(player))
+                assert solution.get_action(player, state) == solved.get_policy(player)[state]
+    finally:
+        solution.close()
+
+
+def test_progress_journal_round_trip(tmp_path):
+    journal = ProgressJournal(str(tmp_path / "journal.jsonl"))
+    assert journal.read() == []
+    journal.append([{"task": 1}, {"task": 2}])
+    # a record cut short by a crash is ignored and overwritten by the next append
+    with open(journal.path, 'a') as file:
+        file.write('{"task": 3')
+    assert journal.read() == [{"task": 1}, {"task": 2}]
+    journal.append([{"task": 3}])
+    assert journal.read() == [{"task": 1}, {"task": 2}, {"task": 3}]
+    journal.remove()
+    assert not journal.exists()
+
+
+def test_export_solution_rejects_reachable_only(tmp_path):
+    environment = CoupMatchupEnvironment(("duke", "assassin"), ("captain", "contessa"), reachable_only=True)
+    environment.solve()
+    with pytest.raises(Exception, match="full state space"):
+        environment.export_solution(str(tmp_path / "solution.bin"))
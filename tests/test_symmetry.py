@@ -0,0 +1,33 @@
+import pytest
+
+from coup_matchup_environment import CoupMatchupEnvironment
+from symmetry import canonicalize_matchup, get_matchup_winner, relabel_solution
+
+
+# no swap, swapped cards of player 1 only and swapped cards of both players together with swapped players
+@pytest.mark.parametrize("matchup", [(("duke", "assassin"), ("captain", "contessa")),
+                                     (("contessa", "duke"), ("assassin", "ambassador")),
+                                     (("captain", "assassin"), ("contessa", "duke"))])
+def test_relabel_solution_matches_direct_solve(matchup):
+    canonical_cards_1, canonical_cards_2, relabeling = canonicalize_matchup(*matchup)
+    canonical_environment = CoupMatchupEnvironment(canonical_cards_1, canonical_cards_2, compact=True)
+    canonical_environment.solve()
+    environment = CoupMatchupEnvironment(*matchup)
+    relabel_solution(canonical_environment, environment, relabeling)
+    direct_environment = CoupMatchupEnvironment(*matchup, compact=True)
+    direct_environment.solve()
+
+    assert set(environment._states) == set(direct_environment._states)
+    for player in (1, 2):
+        assert environment.get_win_region(player) == direct_environment.get_win_region(player)
+        policy = environment.get_policy(player)
+        for state in environment.get_win_region(player):
+            rank = environment.get_attractor_rank(player, state)
+            assert rank == direct_environment.get_attractor_rank(player, state), state
+            # ties between equally good actions may be broken differently, but the policy has to win as fast
+            if state[2] == player and rank > 0:
+                new_state = environment.transition(state, policy[state], environment.rules)
+                assert environment.get_attractor_rank(player, new_state) == rank - 1, state
+    assert environment.get_draw_region() == direct_environment.get_draw_region()
+    winner = 1 if environment.get_start_game_state() in environment.get_win_region(1) else 2
+    assert get_matchup_winner(canonical_environment, *matchup) == winner
@@ -0,0 +1,58 @@
+import os
+import time
+
+import pytest
+
+from work_queue import WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path), lease_seconds=1)
+    queue.add_tasks({"task_0": {"shard": 0}})
+    return queue
+
+
+def expire(queue, lease):
+    # moves the last heartbeat of lease back past lease_seconds instead of waiting for it
+    past = time.time() - 2 * queue.lease_seconds
+    os.utime(lease.path, (past, past))
+
+
+def test_claim_is_exclusive(queue):
+    lease = queue.claim("worker_a")
+    assert lease is not None and lease.task_id == "task_0"
+    assert queue.claim("worker_b") is None
+    queue.complete(lease, {"shard": 0})
+    assert queue.claim("worker_b") is None
+    assert queue.get_result("task_0") == {"shard": 0} and queue.get_pending_task_ids() == []
+
+
+def test_expired_lease_is_reclaimed(queue):
+    lease_a = queue.claim("worker_a")
+    expire(queue, lease_a)
+    lease_b = queue.claim("worker_b")
+    assert lease_b is not None and lease_b.task_id == "task_0"
+    assert lease_b.is_held() and not lease_a.is_held()
+    assert os.listdir(queue.leases_directory) == ["task_0"]
+
+
+def test_heartbeat_keeps_lease(queue):
+    lease = queue.claim("worker_a")
+    expire(queue, lease)
+    lease.heartbeat()
+    assert queue.claim("worker_b") is None
+    # the background heartbeats keep the lease alive for longer than lease_seconds
+    with lease:
+        time.sleep(2.5 * queue.lease_seconds)
+        assert queue.claim("worker_b") is None
+    assert lease.is_held()
+
+
+def test_stale_release_keeps_new_lease(queue):
+    lease_a = queue.claim("worker_a")
+    expire(queue, lease_a)
+    lease_b = queue.claim("worker_b")
+    lease_a.release()
+    assert lease_b.is_held()
+    assert queue.claim("worker_c") is None